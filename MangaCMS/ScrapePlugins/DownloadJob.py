@@ -0,0 +1,121 @@
+
+import logging
+import datetime
+
+# State transitions a release row is expected to make while it's being
+# fetched. Anything else is allowed (plugins do odd things), but logged.
+TRANSITIONS = {
+	'new'        : ('fetching', 'processing', 'complete', 'error', 'missing', 'removed', 'disabled'),
+	'fetching'   : ('new', 'processing', 'complete', 'error', 'missing', 'removed', 'disabled'),
+	'processing' : ('new', 'complete', 'error', 'missing'),
+	'error'      : ('new', ),
+	'missing'    : ('new', ),
+	'complete'   : ('upload', ),
+}
+
+
+class DownloadJob(object):
+	'''
+	Pending state changes for a single release row.
+
+	Rather than opening a session (and re-loading the row) every time a
+	fetch moves from one state to the next, transitions are accumulated
+	here, and written either onto a row that's already loaded for some
+	other reason (`apply()`), or as a single UPDATE by primary key
+	(`flush()`), which doesn't need the row to be loaded at all.
+	'''
+
+	def __init__(self, db, target_table, row_id, state=None, log=None):
+		self.db           = db
+		self.target_table = target_table
+		self.row_id       = row_id
+		self.state        = state
+		self.pending      = {}
+		self.log          = log or logging.getLogger("Main.DownloadJob")
+
+	def __repr__(self):
+		return "<DownloadJob row %s (%s) pending: %s>" % (self.row_id, self.state, self.pending)
+
+	@property
+	def dirty(self):
+		return bool(self.pending)
+
+	def transition(self, state, **values):
+		if self.state and state != self.state and state not in TRANSITIONS.get(self.state, ()):
+			self.log.warning("Unexpected state transition for row %s: '%s' -> '%s'", self.row_id, self.state, state)
+
+		self.pending['state'] = state
+		self.pending.update(values)
+		self.state = state
+
+	def set(self, **values):
+		self.pending.update(values)
+
+	def fetching(self, **values):
+		self.transition('fetching', **values)
+
+	def processing(self, **values):
+		self.transition('processing', **values)
+
+	def complete(self, **values):
+		now = datetime.datetime.now()
+		values.setdefault('downloaded_at', now)
+		values.setdefault('last_checked',  now)
+		self.transition('complete', **values)
+
+	def error(self, err_str=None, **values):
+		self.transition('error', err_str=err_str, **values)
+
+	def reset(self, **values):
+		self.transition('new', **values)
+
+	def apply(self, row):
+		'''
+		Write the pending changes onto an already loaded row. They'll be
+		committed along with whatever else the row's session does.
+		'''
+		for key, value in self.pending.items():
+			setattr(row, key, value)
+		self.pending = {}
+
+	def flush(self, sess=None):
+		'''
+		Write the pending changes as a single UPDATE. If `sess` is passed, the
+		update is issued in (and committed with) that session.
+		Returns the number of rows updated.
+		'''
+		if not self.pending:
+			return 0
+
+		tbl = self.target_table.__table__
+		stmt = tbl.update()                       \
+			.where(tbl.c.id == self.row_id)       \
+			.values(**self.pending)
+
+		with self.db.session_context(reuse_sess=sess) as sess_c:
+			res = sess_c.execute(stmt)
+
+		self.pending = {}
+		return res.rowcount
+
+
+def bulk_transition(db, target_table, row_ids, state, where=None, sess=None, **values):
+	'''
+	Move every row in `row_ids` to `state` (and set any other `values`) in a
+	single UPDATE. `where` is an optional list of additional predicates.
+	Returns the number of rows updated.
+	'''
+	row_ids = list(row_ids)
+	if not row_ids:
+		return 0
+
+	tbl = target_table.__table__
+	stmt = tbl.update().where(tbl.c.id.in_(row_ids))
+	for clause in (where or []):
+		stmt = stmt.where(clause)
+	values['state'] = state
+	stmt = stmt.values(**values)
+
+	with db.session_context(reuse_sess=sess) as sess_c:
+		res = sess_c.execute(stmt)
+	return res.rowcount
@@ -39,7 +39,11 @@ class DbLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase):
 			urlPath = '/list/{num}'.format(num=pageOverride)
 			pageUrl = urllib.parse.urljoin(self.urlBase, urlPath)
 
-			page = self.wg.getpage(pageUrl)
+			# Regular runs only look at the first page, so skip it if it hasn't changed.
+			if pageOverride == 1:
+				page = self.get_page_if_changed(pageUrl)
+			else:
+				page = self.wg.getpage(pageUrl)
 		except urllib.error.URLError:
 			self.log.critical("Could not get page from HBrowse!")
 			self.log.critical(traceback.format_exc())
@@ -74,6 +78,8 @@ class DbLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase):
 		#
 
 		page = self.loadFeed(pageOverride)
+		if page is None:
+			return []
 
 		soup = bs4.BeautifulSoup(page, "lxml")
 
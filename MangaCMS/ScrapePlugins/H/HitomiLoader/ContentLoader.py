@@ -235,7 +235,7 @@ class ContentLoader(MangaCMS.ScrapePlugins.RetreivalBase.RetreivalBase):
 		return subid
 
 
-	def getImages(self, fetch_params):
+	def getImageUrls(self, fetch_params):
 
 		# print("getImage", fetch_params)
 
@@ -252,22 +252,17 @@ class ContentLoader(MangaCMS.ScrapePlugins.RetreivalBase.RetreivalBase):
 			imgurl = re.sub(r"\/\/..?\.hitomi\.la\/", 'https://{}.hitomi.la/'.format(self.extract_cdn_subdomain(imgurl)), imgurl, flags=re.IGNORECASE)
 			# print("ImageURL:", imgurl)
 			imageurls.append((imgurl, fetch_params['spage']))
-		if not imageurls:
-			return []
 
-		images = []
+		return imageurls
 
-
-		for imageurl, referrer in imageurls:
-			images.append(self.getImage(imageurl, referrer))
-
-		return images
+	def fetch_page(self, page_idx, url, referrer):
+		return self.getImage(url, referrer)
 
 
 	def get_link(self, link_row_id):
 		try:
 			link_info = self.getDownloadInfo(link_row_id)
-			images = self.getImages(link_info)
+			imageurls = self.getImageUrls(link_info)
 			title  = link_info['title']
 			artist = link_info['artist']
 
@@ -276,25 +271,38 @@ class ContentLoader(MangaCMS.ScrapePlugins.RetreivalBase.RetreivalBase):
 				row.state = 'error'
 			return False
 
-		if not (images and title):
+		if not (imageurls and title):
 			return False
 
 
-		with self.row_sess_context(dbid=link_row_id) as row_tup:
-			row, sess = row_tup
+		with self.row_context(dbid=link_row_id) as row:
+			series_name = row.series_name
+
+		fileN = title+" - "+artist+".zip"
+		fileN = nt.makeFilenameSafe(fileN)
 
-			fileN = title+" - "+artist+".zip"
-			fileN = nt.makeFilenameSafe(fileN)
+		container_dir = os.path.join(settings.hitSettings["dlDir"],
+			nt.makeFilenameSafe(series_name))
 
-			container_dir = os.path.join(settings.hitSettings["dlDir"],
-				nt.makeFilenameSafe(row.series_name))
+		wholePath = os.path.join(container_dir, fileN)
 
-			wholePath = os.path.join(container_dir, fileN)
+		try:
+			with self.image_sink(wholePath) as sink:
+				for imageName, imageContent in self.fetch_pages(imageurls):
+					sink.add_image(imageName, imageContent)
 
-			fqFName = self.save_image_set(row, sess, wholePath, images)
+				job = self.download_job(link_row_id)
+				job.processing()
 
-		with self.row_context(dbid=link_row_id) as row:
-			row.state = 'processing'
+				with self.row_sess_context(dbid=link_row_id) as row_tup:
+					row, sess = row_tup
+					job.apply(row)
+					fqFName = self.save_image_sink(row, sess, sink)
+
+		except WebRequest.WebGetException:
+			with self.row_context(dbid=link_row_id) as row:
+				row.state = 'error'
+			return False
 
 		# We don't want to upload the file we just downloaded, so specify doUpload as false.
 		# As a result of this, the seriesName paramerer also no longer matters
@@ -302,10 +310,8 @@ class ContentLoader(MangaCMS.ScrapePlugins.RetreivalBase.RetreivalBase):
 
 
 		self.log.info( "Done")
-		with self.row_context(dbid=link_row_id) as row:
-			row.state = 'complete'
-			row.downloaded_at = datetime.datetime.now()
-			row.last_checked = datetime.datetime.now()
+		job.complete()
+		job.flush()
 
 
 
@@ -116,27 +116,19 @@ class ContentLoader(MangaCMS.ScrapePlugins.RetreivalBase.RetreivalBase):
 
 
 
-	def fetchImages(self, image_list):
-
-		images = []
-		for imgUrl, referrerUrl in image_list:
-			images.append(self.getImage(imgUrl, referrerUrl))
-
-		return images
+	def fetch_page(self, page_idx, url, referrer):
+		return self.getImage(url, referrer)
 
 
 
 	def doDownload(self, linkDict, link_row_id):
 
-		images = self.fetchImages(linkDict["dlLinks"])
-
-		if not images:
+		if not linkDict["dlLinks"]:
 			with self.row_context(dbid=link_row_id) as row:
 				row.state = 'error'
 			return
 
-		with self.row_sess_context(dbid=link_row_id) as row_tup:
-			row, sess = row_tup
+		with self.row_context(dbid=link_row_id) as row:
 			row.series_name = linkDict['series_name']
 
 			fileN = row.origin_name + ".zip"
@@ -144,14 +136,19 @@ class ContentLoader(MangaCMS.ScrapePlugins.RetreivalBase.RetreivalBase):
 
 			fqFName = os.path.join(settings.nhSettings["dlDir"], nt.makeFilenameSafe(row.series_name), fileN)
 
-			fqFName = self.save_image_set(row, sess, fqFName, images)
+		with self.image_sink(fqFName) as sink:
+			for imageName, imageContent in self.fetch_pages(linkDict["dlLinks"]):
+				sink.add_image(imageName, imageContent)
+
+			with self.row_sess_context(dbid=link_row_id) as row_tup:
+				row, sess = row_tup
+				fqFName = self.save_image_sink(row, sess, sink)
 
 		self.processDownload(seriesName=False, archivePath=fqFName, doUpload=False)
 
-		with self.row_context(dbid=link_row_id) as row:
-			row.state = 'complete'
-			row.downloaded_at = datetime.datetime.now()
-			row.last_checked = datetime.datetime.now()
+		job = self.download_job(link_row_id)
+		job.complete()
+		job.flush()
 
 
 	def get_link(self, link_row_id):
@@ -37,6 +37,14 @@ class ContentLoader(MangaCMS.ScrapePlugins.RetreivalBase.RetreivalBase, LoginMix
 
 	retreivalThreads = 1
 
+	# Pacing within a process is still the random sleep after each gallery in
+	# get_link(). The shared budget is only a ceiling across processes (e.g.
+	# a manual run alongside the scheduler): one request every 20 seconds,
+	# and archive downloads averaging no more than 256 KB/s.
+	rate_limit_requests_per_sec = 1 / 20
+	rate_limit_bytes_per_sec    = 256 * 1024
+	rate_limit_burst            = 3
+
 	shouldCanonize = False
 	outOfCredits   = False
 
@@ -31,6 +31,14 @@ class DbLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase, LoginMixin.ExLoginM
 	urlBase = "https://exhentai.org/"
 	urlFeed = "https://exhentai.org/?page={num}&f_search={search}"
 
+	# Upper bound on the number of search result pages walked per search,
+	# if we don't reach a page of already known items first. Galleries that
+	# were dropped as unwanted after being fetched aren't in the DB, so a
+	# search that turns up many of them will never have a fully known page.
+	# Paging is therefore opt-in: with 1, only the first page is loaded,
+	# as it always was.
+	feed_max_pages = 1
+
 
 	# -----------------------------------------------------------------------------------
 	# The scraping parts
@@ -131,21 +139,26 @@ class DbLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase, LoginMixin.ExLoginM
 
 		return ret
 
-	def get_feed(self, searchTag,
+	def get_feed_page(self, searchTag,
 				includeExpunge=False,
 				includeLowPower=False,
 				includeDownvoted=False,
 				pageOverride=None
 			):
+		'''
+		Returns a (item_count, parsed_items) tuple for a single page of search results.
+		'''
 		ret = []
 
-		self.log.info("Loading feed for search: '%s'", searchTag)
+		self.log.info("Loading feed for search: '%s' (page %s)", searchTag, pageOverride)
 		soup = self.loadFeed(searchTag, pageOverride, includeExpunge, includeLowPower, includeDownvoted)
+		if not soup:
+			return 0, []
 
 		itemTable = soup.find("table", class_="itg")
 
 		if not itemTable:
-			return []
+			return 0, []
 
 		rows = itemTable.find_all("tr", class_=re.compile("gtr[01]"))
 		self.log.info("Found %s items on page.", len(rows))
@@ -156,12 +169,49 @@ class DbLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase, LoginMixin.ExLoginM
 				ret.append(item)
 
 
+		return len(rows), ret
+
+	def get_feed(self, searchTag,
+				includeExpunge=False,
+				includeLowPower=False,
+				includeDownvoted=False,
+				pageOverride=None
+			):
+		'''
+		Search results are newest first, so walk pages until we hit one
+		where everything's already in the DB (or run out, or hit
+		feed_max_pages). Rows parseItem() filtered out (excluded categories,
+		our own uploads, artist galleries) don't need fetching, so they count
+		as known. If pageOverride is passed, only that page is loaded.
+		'''
+		if pageOverride is not None:
+			_, ret = self.get_feed_page(searchTag, includeExpunge, includeLowPower, includeDownvoted, pageOverride)
+			return ret
+
+		ret = []
+		for page in range(self.feed_max_pages):
+			if page:
+				time.sleep(random.randrange(3, 10))
+
+			row_count, items = self.get_feed_page(searchTag, includeExpunge, includeLowPower, includeDownvoted, page)
+			ret.extend(items)
+
+			if not row_count:
+				break
+			if all(item["source_id"] in self.known_ids for item in items):
+				self.log.info("Everything on page %s is already known. Stopping.", page)
+				break
+			if not runStatus.run:
+				self.log.info( "Breaking due to exit flag being set")
+				break
+
 		return ret
 
 	# TODO: Add the ability to re-acquire downloads that are
 	# older then a certain age.
 	# We have to override the parent class here, since we're doing some more complex stuff.
 	def do_fetch_feeds(self):
+		self._known_ids = None
 		self._resetStuckItems()
 		self.checkLogin()
 		if not self.checkExAccess():
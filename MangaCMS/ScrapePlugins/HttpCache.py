@@ -0,0 +1,92 @@
+
+import os
+import os.path
+import json
+import time
+import uuid
+import hashlib
+import threading
+
+import settings
+
+
+def body_hash(content):
+	if isinstance(content, str):
+		content = content.encode("utf-8")
+	return hashlib.sha1(content).hexdigest()
+
+
+class HttpCache(object):
+	'''
+	On-disk validator cache for feed pages, keyed by URL.
+
+	Only metadata is kept: the ETag and Last-Modified headers from the
+	last fetch (so the next one can be a conditional GET), and a hash of
+	the body (so that servers that don't support conditional requests
+	still let us skip re-parsing an unchanged page).
+
+	Each entry is a small JSON file at <cache_dir>/<sha1[:2]>/<sha1>.json.
+	'''
+
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+		os.makedirs(self.cache_dir, exist_ok=True)
+
+	def _path(self, url):
+		key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+		return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+	def get(self, url):
+		try:
+			with open(self._path(url), "r") as fp:
+				meta = json.load(fp)
+		except (FileNotFoundError, ValueError):
+			return None
+		if meta.get('url') != url:
+			return None
+		return meta
+
+	def put(self, url, etag=None, last_modified=None, content_hash=None):
+		fpath = self._path(url)
+		os.makedirs(os.path.dirname(fpath), exist_ok=True)
+
+		meta = {
+				'url'           : url,
+				'etag'          : etag,
+				'last_modified' : last_modified,
+				'body_hash'     : content_hash,
+				'fetched'       : time.time(),
+			}
+
+		tmp_path = "%s.%s.tmp" % (fpath, uuid.uuid4().hex)
+		with open(tmp_path, "w") as fp:
+			json.dump(meta, fp)
+		os.rename(tmp_path, fpath)
+
+	def conditional_headers(self, url):
+		meta = self.get(url)
+		headers = {}
+		if meta:
+			if meta.get('etag'):
+				headers['If-None-Match'] = meta['etag']
+			if meta.get('last_modified'):
+				headers['If-Modified-Since'] = meta['last_modified']
+		return meta, headers
+
+
+_HTTP_CACHE      = None
+_HTTP_CACHE_LOCK = threading.Lock()
+
+def get_http_cache():
+	'''
+	Process-wide HTTP metadata cache, or None if `settings.httpCacheDir` isn't set.
+	'''
+	global _HTTP_CACHE
+	cache_dir = getattr(settings, "httpCacheDir", None)
+	if not cache_dir:
+		return None
+
+	with _HTTP_CACHE_LOCK:
+		if _HTTP_CACHE is None:
+			_HTTP_CACHE = HttpCache(cache_dir)
+		return _HTTP_CACHE
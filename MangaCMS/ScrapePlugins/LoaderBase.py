@@ -3,13 +3,19 @@
 
 import abc
 import datetime
+import collections
+import urllib.error
 
-import tqdm
+import bs4
 import WebRequest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
 
 import settings
 import nameTools as nt
+import MangaCMS.lib.KnownIdIndex as KnownIdIndex
 import MangaCMS.ScrapePlugins.MangaScraperBase
+import MangaCMS.ScrapePlugins.HttpCache as HttpCache
 import MangaCMS.ScrapePlugins.ScrapeExceptions as ScrapeExceptions
 
 
@@ -22,9 +28,24 @@ class LoaderBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 
 	plugin_type = "FeedLoader"
 
+	# Number of feed items inserted (and committed) per statement by _process_links_into_db()
+	ingest_chunk_size = 500
+
+	# Keep an index of the source_ids already in the DB (see known_ids), so
+	# feeds can stop paging early and known items skip the insert entirely.
+	use_known_ids = True
+
+	# Use the HTTP validator cache (settings.httpCacheDir) in get_page_if_changed()
+	use_http_cache = True
+
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
-		self.wg = WebRequest.WebGetRobust(logPath=self.logger_path+".Web")
+		self.wg = self.rate_limited_wg(WebRequest.WebGetRobust(logPath=self.logger_path+".Web"))
+		self._known_ids = None
+
+		self.http_cache = HttpCache.get_http_cache() if self.use_http_cache else None
+		self.http_cache_stats = collections.Counter()
+		self._http_cache_pending = {}
 
 	def setup(self):
 		pass
@@ -61,47 +82,137 @@ class LoaderBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 		assert isinstance(check_dict.get("tags", []), (list, tuple)), "Tags item must be a list!"
 
 
+	def _insert_link_chunk(self, sess, chunk):
+		'''
+		Insert a chunk of (link, tags) tuples, skipping any whose
+		(source_site, source_id) is already present. Returns the number
+		of new rows.
+		'''
+		tbl = self.target_table.__table__
+		now = datetime.datetime.now()
+
+		# A multi-row insert needs every row to have the same columns, and
+		# not every feed populates every key on every item.
+		by_keys = {}
+		for link, _ in chunk:
+			row = {
+					'state'       : 'new',
+					'source_site' : self.plugin_key,
+					'first_seen'  : now,
+				}
+			row.update(link)
+			by_keys.setdefault(tuple(sorted(row.keys())), []).append(row)
+
+		new_items = 0
+		for rows in by_keys.values():
+			stmt = postgresql.insert(tbl)                                              \
+				.values(rows)                                                            \
+				.on_conflict_do_nothing(index_elements=['source_site', 'source_id'])     \
+				.returning(tbl.c.id)
+			new_items += len(sess.execute(stmt).fetchall())
+
+		tagged = {link['source_id'] : tags for link, tags in chunk if tags}
+		if tagged:
+			self._attach_link_tags(sess, tagged)
+
+		return new_items
+
+	def _attach_link_tags(self, sess, tagged):
+		'''
+		Add tags to the rows for the source_ids in `tagged` ({source_id : [tags]}),
+		with one query for the row ids, one for their current tags and a single
+		bulk insert of the link rows (tag ids come from the tag registry). Rows
+		that end up with unwanted tags are removed, like update_tags() would.
+		'''
+		assert self.target_tags_table is not None, "%s items can't have tags!" % self.target_table.__tablename__
+
+		tbl      = self.target_table.__table__
+		tag_tbl  = self.target_tags_table.__table__
+		link_tbl = self.target_tags_link
+
+		row_ids = sess.execute(
+				sa.select([tbl.c.id, tbl.c.source_id])
+					.where(tbl.c.source_site == self.plugin_key)
+					.where(tbl.c.source_id.in_(list(tagged.keys())))
+			)
+		row_ids = {source_id : row_id for row_id, source_id in row_ids}
+
+		current = {}
+		cur_q = sa.select([link_tbl.c.releases_id, tag_tbl.c.tag])                   \
+			.select_from(link_tbl.join(tag_tbl, link_tbl.c.tags_id == tag_tbl.c.id))   \
+			.where(link_tbl.c.releases_id.in_(list(row_ids.values())))
+		for row_id, tag in sess.execute(cur_q):
+			current.setdefault(row_id, set()).add(tag)
+
+		tagged = [(row_ids[source_id], tags) for source_id, tags in tagged.items()]
+		wanted = self.wanted_from_tags_batch(
+				list(current.get(row_id, set()) | set(tags)) for row_id, tags in tagged
+			)
+
+		to_link  = {}
+		unwanted = []
+		for (row_id, tags), is_wanted in zip(tagged, wanted):
+			if not is_wanted:
+				self.log.info("How does something have masked tags on insertion?")
+				unwanted.append(row_id)
+				continue
+			to_link[row_id] = tags
+
+		if to_link:
+			self.target_tags_table.registry.link(sess, link_tbl, to_link)
+
+		if unwanted:
+			sess.execute(link_tbl.delete().where(link_tbl.c.releases_id.in_(unwanted)))
+			sess.execute(tbl.delete().where(tbl.c.id.in_(unwanted)))
+
 	def _process_links_into_db(self, linksDicts):
 
 		self.log.info( "Inserting...")
 
+		# Validate and normalize everything up-front, so a bad item fails
+		# the batch before anything is written. Items repeated within the
+		# feed are collapsed (first one wins, tags are merged), which is
+		# what the old one-query-per-item path ended up doing.
+		items = collections.OrderedDict()
+		for link in linksDicts:
+
+			self._check_keys(link)
+
+			tags = link.pop("tags", [])
+			self._check_tags(tags)
+
+			if 'series_name' in link and self.shouldCanonize:
+				link["series_name"] = nt.getCanonicalMangaUpdatesName(link["series_name"])
+
+			tags = [self._fix_tag(tag) for tag in tags]
+
+			if link["source_id"] in items:
+				items[link["source_id"]][1].extend(tags)
+			else:
+				items[link["source_id"]] = (link, list(tags))
+
+		items = list(items.values())
+
+		# Items we already have, with no tags to merge, would be no-ops for
+		# the insert, so don't send them to the DB at all.
+		if self.use_known_ids:
+			known = self.known_ids
+			before = len(items)
+			items = [(link, tags) for link, tags in items if tags or link["source_id"] not in known]
+			if before != len(items):
+				self.log.info("Skipping %s already known items", before - len(items))
 
 		newItems = 0
-		with self.db.session_context() as sess:
-			for link in tqdm.tqdm(linksDicts):
-
-				self._check_keys(link)
-
-				tags = link.pop("tags", [])
-				assert isinstance(tags, (list, tuple)), "tags must be a list or tuple!"
-
-				if 'series_name' in link and self.shouldCanonize:
-					link["series_name"] = nt.getCanonicalMangaUpdatesName(link["series_name"])
-
-				have = sess.query(self.target_table)                            \
-					.filter(self.target_table.source_site == self.plugin_key)     \
-					.filter(self.target_table.source_id == link["source_id"]) \
-					.scalar()
-
-				if not have:
-					newItems += 1
-					have = self.target_table(
-							state       = 'new',            # Should be set automatically.
-							source_site = self.plugin_key,
-							first_seen  = datetime.datetime.now(),
-							**link
-						)
-
-					sess.add(have)
-
-					if newItems % 1000 == 0:
-						self.log.info("Added %s rows, doing incremental commit!", newItems)
-						sess.commit()
-				try:
-					self.update_tags(tags=tags, row=have)
-				except ScrapeExceptions.UnwantedContentError:
-					self.log.info("How does something have masked tags on insertion?")
-					sess.delete(have)
+		for idx in range(0, len(items), self.ingest_chunk_size):
+			chunk = items[idx:idx+self.ingest_chunk_size]
+			with self.db.session_context() as sess:
+				newItems += self._insert_link_chunk(sess, chunk)
+
+			if self.use_known_ids:
+				self.known_ids.update(link["source_id"] for link, _ in chunk)
+
+			if len(items) > self.ingest_chunk_size:
+				self.log.info("Processed %s of %s items (%s new)", min(idx + self.ingest_chunk_size, len(items)), len(items), newItems)
 
 		if self.mon_con:
 			self.mon_con.incr('new_links', newItems)
@@ -110,13 +221,127 @@ class LoaderBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 
 		return newItems
 
+	@property
+	def known_ids(self):
+		'''
+		Index of the source_ids this plugin already has in the DB. Loaded (with
+		a single streamed query) the first time it's used in a run, then kept
+		up to date as items are inserted.
+		'''
+		if self._known_ids is None:
+			tbl = self.target_table.__table__
+			stmt = sa.select([tbl.c.source_id])                    \
+				.where(tbl.c.source_site == self.plugin_key)         \
+				.execution_options(stream_results=True)
+
+			with self.db.session_context(commit=False) as sess:
+				res = sess.execute(stmt)
+				self._known_ids = KnownIdIndex.KnownIdIndex(row[0] for row in res)
+
+			self.log.info("Loaded %s known source IDs", len(self._known_ids))
+		return self._known_ids
+
+	def all_known(self, items):
+		'''
+		True if every item in a page of feed results is already in the DB.
+		Feeds that page newest-first can use this to stop paging early.
+		'''
+		if not items:
+			return False
+		return all(item["source_id"] in self.known_ids for item in items)
+
+	# ---------------------------------------------------------------------------------------------------------------------------------------------------------
+	# Conditional fetching
+	# ---------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	def get_page_if_changed(self, url, addlHeaders=None):
+		'''
+		Fetch `url`, returning its content, or None if it hasn't changed since
+		the last successful feed run. That's either a 304 in response to a
+		conditional GET (using the stored ETag/Last-Modified), or a body that
+		hashes the same as last time.
+
+		Validators for pages fetched here are only saved once the run has gone
+		through (see _commit_http_cache()), so a run that fails part way
+		doesn't cause the next one to skip pages it never finished processing.
+		'''
+		cache = self.http_cache
+		if not cache:
+			return self.wg.getpage(url, addlHeaders=addlHeaders)
+
+		meta, headers = cache.conditional_headers(url)
+		headers.update(addlHeaders or {})
+
+		self.http_cache_stats['requests'] += 1
+		try:
+			# WebRequest reports a 304 as a failed fetch, so with the default
+			# retries it would be retried (and slept on) several times over.
+			content, handle = self.wg.getpage(url, addlHeaders=headers, returnMultiple=True, retryQuantity=1)
+		except (WebRequest.FetchFailureError, urllib.error.HTTPError) as e:
+			if getattr(e, 'err_code', getattr(e, 'code', None)) == 304:
+				self._http_cache_hit('not_modified', url)
+				return None
+
+			# Anything else gets the usual retries. Unconditionally, so a
+			# 304 can't come back through them.
+			self.log.warning("Conditional fetch of %s failed (%s). Retrying.", url, e)
+			content, handle = self.wg.getpage(url, addlHeaders=addlHeaders, returnMultiple=True)
+
+		content_hash = HttpCache.body_hash(content)
+		resp_headers = getattr(handle, 'headers', None) or {}
+		self._http_cache_pending[url] = {
+				'etag'          : resp_headers.get('ETag'),
+				'last_modified' : resp_headers.get('Last-Modified'),
+				'content_hash'  : content_hash,
+			}
+
+		if meta and meta.get('body_hash') == content_hash:
+			self._http_cache_hit('unchanged', url)
+			return None
+
+		self.http_cache_stats['changed'] += 1
+		if self.mon_con:
+			self.mon_con.incr('http_cache.changed', 1)
+		return content
+
+	def get_soup_if_changed(self, url, addlHeaders=None):
+		'''
+		get_page_if_changed(), parsed. None if the page hasn't changed.
+		'''
+		content = self.get_page_if_changed(url, addlHeaders=addlHeaders)
+		if content is None:
+			return None
+		return bs4.BeautifulSoup(content, "lxml")
+
+	def _http_cache_hit(self, kind, url):
+		self.log.info("Page at %s is unchanged (%s). Skipping.", url, kind.replace("_", " "))
+		self.http_cache_stats[kind] += 1
+		if self.mon_con:
+			self.mon_con.incr('http_cache.%s' % kind, 1)
+
+	def _commit_http_cache(self):
+		cache = self.http_cache
+		if cache:
+			for url, meta in self._http_cache_pending.items():
+				cache.put(url, **meta)
+		self._http_cache_pending = {}
+
+		requests = self.http_cache_stats['requests']
+		if requests:
+			hits = self.http_cache_stats['not_modified'] + self.http_cache_stats['unchanged']
+			self.log.info("HTTP cache: %s of %s feed pages unchanged (%0.1f%%, %s not modified, %s same content)",
+					hits, requests, 100.0 * hits / requests,
+					self.http_cache_stats['not_modified'], self.http_cache_stats['unchanged'])
+
 	def do_fetch_feeds(self, *args, **kwargs):
+		self._known_ids = None
 		self._resetStuckItems()
 		# dat = self.getFeed(list(range(50)))
 		self.setup()
 		dat = self.get_feed(*args, **kwargs)
 		self.log.info("Found %s total items", len(dat))
 		self._process_links_into_db(dat)
+		self._commit_http_cache()
 
 
 	def go(self, *args, **kwargs):
@@ -44,10 +44,15 @@ class FeedLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase):
 		return ret
 
 
-	def getItems(self, url):
+	def getItems(self, url, conditional=False):
 		ret = []
 
-		soup = self.wg.getSoup(url)
+		if conditional:
+			soup = self.get_soup_if_changed(url)
+			if soup is None:
+				return ret
+		else:
+			soup = self.wg.getSoup(url)
 
 		if soup.find("div", class_='span8'):
 			mainDiv = soup.find("div", class_='span8')
@@ -107,7 +112,9 @@ class FeedLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase):
 		while 1:
 
 
-			pages = self.getItems(self.seriesBase.format(num=cnt))
+			# Historical runs walk every page, so only a regular run (which
+			# just looks at the first page) can skip an unchanged one.
+			pages = self.getItems(self.seriesBase.format(num=cnt), conditional=not historical)
 
 
 			if not pages:
@@ -81,28 +81,12 @@ class ContentLoader(MangaCMS.ScrapePlugins.RetreivalBase.RetreivalBase):
 		return image_urls
 
 
-	def getImages(self, source_url):
-
-		imageUrls = self.getImageUrls(source_url)
-
-		images = []
-
-		image_counter = 1
-		for imgUrl, referrerUrl in imageUrls:
-			imageContent, imageName = self.wg.getFileAndName(imgUrl, addlHeaders={'Referer': referrerUrl})
-			img_postf = urllib.parse.urlsplit(imgUrl).path.split("/")[-1]
-			imageName = "{:04d} - {} {}".format(image_counter, imageName, img_postf)
-			self.log.info("Found %s byte image named %s", len(imageContent), imageName)
-			images.append([imageName, imageContent])
-			image_counter += 1
-
-			fType = magic.from_buffer(imageContent, mime=True)
-
-			if not 'image' in fType:
-				raise MangaCMS.ScrapePlugins.ScrapeExceptions.ContentNotAvailableYetError(
-					"Empty/failed image return - File isn't an image? Detected type: %s" % fType)
-
-		return images
+	def fetch_page(self, page_idx, url, referrer):
+		imageContent, imageName = self.wg.getFileAndName(url, addlHeaders={'Referer': referrer})
+		img_postf = urllib.parse.urlsplit(url).path.split("/")[-1]
+		imageName = "{:04d} - {} {}".format(page_idx + 1, imageName, img_postf)
+		self.log.info("Found %s byte image named %s", len(imageContent), imageName)
+		return imageName, imageContent
 
 
 	def get_link(self, link_row_id):
@@ -117,15 +101,15 @@ class ContentLoader(MangaCMS.ScrapePlugins.RetreivalBase.RetreivalBase):
 		try:
 			self.log.info( "Should retreive url - %s", source_url)
 
-			images = self.getImages(source_url)
+			imageUrls = self.getImageUrls(source_url)
 
-			if not images:
+			if not imageUrls:
 				with self.row_context(dbid=link_row_id) as row:
 					row.state = 'error'
 					row.err_str = "error-404"
 					return
 
-			self.save_manga_image_set(link_row_id, series_name, chapter_name, images)
+			self.save_manga_image_set(link_row_id, series_name, chapter_name, self.fetch_pages(imageUrls))
 
 
 		except Exception:
@@ -5,6 +5,9 @@ runStatus.preloadDicts = False
 
 
 
+import queue
+import traceback
+import concurrent.futures
 import http.cookiejar
 import urllib.parse
 import time
@@ -32,6 +35,14 @@ class FeedLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase):
 	urlBase    = "https://mangadex.org/"
 	seriesBase = "https://mangadex.org/updates"
 
+	# Series pages are fetched in parallel by get_feed(). Requests to the site
+	# go through the shared rate limit budget (see LoaderBase), so the threads
+	# (and any other process crawling it) stay under two requests a second.
+	series_fetch_threads        = 4
+	rate_limit_requests_per_sec = 2
+	rate_limit_burst            = 2
+	feed_write_batch            = 250
+
 	def setup(self):
 		now = int(time.time() * 1000)
 
@@ -201,23 +212,76 @@ class FeedLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase):
 
 		return ret
 
+	def _fetch_series_worker(self, url, out_q):
+		'''
+		Fetch and parse one series page, and hand the chapters to the writer
+		in get_feed() through `out_q`. Failures (and series skipped because
+		we're shutting down) are put on the queue as None, so the writer always
+		gets exactly one result per series.
+		'''
+		items = None
+		try:
+			if runStatus.run:
+				items = self.getChapterLinkFromSeriesPage(url)
+		except Exception:
+			self.log.error("Failed to fetch series page %s", url)
+			for line in traceback.format_exc().split("\n"):
+				self.log.error(line)
+		finally:
+			# Always, even for a BaseException, or get_feed() blocks forever.
+			out_q.put((url, items))
+
+	def _drop_known(self, items):
+		'''
+		Filter out chapters that are already in the DB and have no tags to
+		merge. Known chapters with tags are kept, so _process_links_into_db()
+		can still pick the tags up.
+		'''
+		return [item for item in items if item.get("tags") or item["source_id"] not in self.known_ids]
+
 	def get_feed(self):
 		toScan = self.getUpdatedSeriesPages()
 
-
-		for url in toScan:
-			ret = []
-			items = self.getChapterLinkFromSeriesPage(url)
-			for item in items:
-				if item in ret:
-					raise ValueError("Duplicate items in ret?")
-				ret.append(item)
-
-			self._process_links_into_db(ret)
+		# Series pages are fetched and parsed in a small thread pool. This thread
+		# collects the chapters off the queue and writes them out in batches,
+		# rather than opening a DB session per series.
+		out_q   = queue.Queue()
+		pending = []
+		with concurrent.futures.ThreadPoolExecutor(max_workers=self.series_fetch_threads) as executor:
+			for url in toScan:
+				executor.submit(self._fetch_series_worker, url, out_q)
+
+			for dummy_x in range(len(toScan)):
+				url, items = out_q.get()
+				if items is None:
+					continue
+
+				ret = []
+				for item in items:
+					if item in ret:
+						raise ValueError("Duplicate items in ret?")
+					ret.append(item)
+
+				ret = self._drop_known(ret)
+				if not ret:
+					self.log.info("No new chapters for series at %s", url)
+					continue
+
+				pending.extend(ret)
+				if len(pending) >= self.feed_write_batch:
+					self._process_links_into_db(pending)
+					pending = []
+
+		if pending:
+			self._process_links_into_db(pending)
 
 		return []
 
-	def get_history(self):
+	def get_history(self, incremental=False):
+		'''
+		Walk the full title index. With `incremental`, stop at the first index
+		page where every chapter of every series is already known.
+		'''
 		idx = 0
 		found = 0
 		have_spages = True
@@ -227,9 +291,10 @@ class FeedLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase):
 			idx += 100
 			main_div = soup.find("div", class_='row')
 			tmp_list = []
+			page_known = True
 			if main_div:
 				divs = main_div.find_all("div", class_='col-sm-6')
-				self.log.info("Found %s series links")
+				self.log.info("Found %s series links", len(divs))
 				for row in divs:
 					if row.a:
 						surl = urllib.parse.urljoin(self.urlBase, row.a['href'])
@@ -242,11 +307,25 @@ class FeedLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase):
 								raise ValueError("Duplicate items in ret?")
 							ret.append(item)
 							found += 1
+
+						if any(item["source_id"] not in self.known_ids for item in ret):
+							page_known = False
+
+						ret = self._drop_known(ret)
+						if not ret:
+							continue
+
 						self._process_links_into_db(ret)
 						self.log.info("Found %s items so far", found)
 
 
 			have_spages = len(tmp_list)
+			if incremental and have_spages and page_known:
+				self.log.info("Everything on title page %s is already known. Stopping.", idx - 100)
+				break
+			if not runStatus.run:
+				self.log.info( "Breaking due to exit flag being set")
+				break
 
 
 
@@ -34,7 +34,9 @@ class FeedLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase):
 	def getUpdatedSeries(self, url):
 		ret = set()
 
-		soup = self.wg.getSoup(url)
+		soup = self.get_soup_if_changed(url)
+		if soup is None:
+			return ret
 
 		if soup.find("div", class_='manga_updates'):
 			mainDiv = soup.find("div", class_='manga_updates')
@@ -116,7 +118,9 @@ class FeedLoader(MangaCMS.ScrapePlugins.LoaderBase.LoaderBase):
 
 	def getChapterLinkFromSeriesPage(self, seriesUrl):
 		ret = []
-		soup = self.wg.getSoup(seriesUrl)
+		soup = self.get_soup_if_changed(seriesUrl)
+		if soup is None:
+			return ret
 		soup = self.checkAdult(soup)
 
 		seriesInfo = self.getSeriesInfoFromSoup(soup)
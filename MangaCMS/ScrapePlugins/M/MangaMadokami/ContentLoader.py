@@ -43,6 +43,8 @@ class ContentLoader(MangaCMS.ScrapePlugins.RetreivalBase.RetreivalBase):
 
 
 	retreival_threads = 2
+	retreival_threads_min = 1
+	retreival_threads_max = 6
 
 	urlBase = "https://manga.madokami.al/"
 
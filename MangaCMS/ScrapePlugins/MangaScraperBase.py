@@ -15,12 +15,16 @@ import traceback
 import contextlib
 
 
+import sqlalchemy as sa
 from sqlalchemy import or_
+from sqlalchemy import func
 
 import nameTools as nt
 import MangaCMS.db as mdb
 import MangaCMS.lib.LogMixin
 import MangaCMS.lib.MonitorMixin
+import MangaCMS.lib.TagFilter
+import MangaCMS.lib.RateLimit
 import MangaCMS.ScrapePlugins.ScrapeExceptions
 
 class MangaScraperDbMixin(MangaCMS.lib.LogMixin.LoggerMixin):
@@ -58,14 +62,20 @@ class MangaScraperDbMixin(MangaCMS.lib.LogMixin.LoggerMixin):
 			self.shouldCanonize = True
 			self.target_table = self.db.MangaReleases
 			self.target_tags_table = self.db.MangaTags
+			self.target_tags_link = self.db.manga_releases_tags_link
+			self.target_file_tags_link = self.db.manga_files_tags_link
 		elif self.is_hentai:
 			self.shouldCanonize = False
 			self.target_table = self.db.HentaiReleases
 			self.target_tags_table = self.db.HentaiTags
+			self.target_tags_link = self.db.hentai_releases_tags_link
+			self.target_file_tags_link = self.db.hentai_files_tags_link
 		elif self.is_book:
 			self.shouldCanonize = False
 			self.target_table = self.db.BookReleases
 			self.target_tags_table = None
+			self.target_tags_link = None
+			self.target_file_tags_link = None
 		else:
 			raise RuntimeError("No mode?")
 
@@ -122,6 +132,18 @@ class MangaScraperDbMixin(MangaCMS.lib.LogMixin.LoggerMixin):
 
 
 
+	def pending_post_process(self, release_id):
+		'''
+		SQL predicate for release rows (`release_id` is their id column) that
+		are waiting on the post-processing queue. They sit in 'processing'
+		until their job is done, and mustn't be reset or reclaimed meanwhile.
+		'''
+		tbl = self.db.PostProcessJob.__table__
+		return sa.exists()                                  \
+			.where(tbl.c.release_id == release_id)          \
+			.where(tbl.c.pron == (not self.is_manga))       \
+			.where(tbl.c.state.in_(['queued', 'running']))
+
 	def _resetStuckItems(self):
 		self.log.info("Resetting stuck downloads in DB")
 
@@ -133,7 +155,12 @@ class MangaScraperDbMixin(MangaCMS.lib.LogMixin.LoggerMixin):
 					self.target_table.state == 'processing',
 					self.target_table.state == 'missing',
 					))                                                  \
-				.update({"state" : 'new'})
+				.filter(or_(
+					self.target_table.lease_expires == None,
+					self.target_table.lease_expires < func.now(),
+					))                                                  \
+				.filter(~self.pending_post_process(self.target_table.id)) \
+				.update({"state" : 'new', "lease_owner" : None, "lease_expires" : None}, synchronize_session=False)
 			self.log.info("Reset updated %s rows!", res)
 
 		self.log.info("Download reset complete")
@@ -145,31 +172,69 @@ class MangaScraperDbMixin(MangaCMS.lib.LogMixin.LoggerMixin):
 
 class MangaScraperBase(MangaScraperDbMixin, MangaCMS.lib.LogMixin.LoggerMixin, MangaCMS.lib.MonitorMixin.MonitorMixin):
 
-	def update_tags(self, tags, row=None, dbid=None, url=None):
+	# Per-host request budget, shared by every thread and process running
+	# against the same host (see MangaCMS.lib.RateLimit.SharedTokenBucket).
+	# None means unlimited.
+	rate_limit_requests_per_sec = None
+	rate_limit_bytes_per_sec    = None
+	rate_limit_burst            = 1
+
+	def rate_limited_wg(self, wg):
+		'''
+		Route all of `wg`'s fetches through the plugin's rate limit budget, if it
+		declares one.
+		'''
+		if not (self.rate_limit_requests_per_sec or self.rate_limit_bytes_per_sec):
+			return wg
+
+		bucket = MangaCMS.lib.RateLimit.SharedTokenBucket(
+				requests_per_sec = self.rate_limit_requests_per_sec,
+				bytes_per_sec    = self.rate_limit_bytes_per_sec,
+				burst            = self.rate_limit_burst,
+			)
+		return MangaCMS.lib.RateLimit.RateLimitedWebGet(wg, bucket)
+
+	def _check_tags(self, tags):
 		assert isinstance(tags, (list, tuple)), "Tags must be a list or tuple"
 
 		assert all([len(tag) >= 2 for tag in tags]),    "All tags must be at least one character long. Bad tags: %s"  % [tag for tag in tags if len(tag) < 2]
 		assert all([len(tag) < 90 for tag in tags]),    "All tags must be less then 90 characters long. Bad tags: %s" % [(tag, len(tag)) for tag in tags if len(tag) >= 90]
 		assert all([type(tmp) == str for tmp in tags]), "All tags must be a string! Bad tags: %s"                     % [(tag, type(tag)) for tag in tags if type(tag) != str]
 
+	def _fix_tag(self, tag):
+		if (tag.startswith("large_") or tag.startswith("large-")) and 'insertions' not in tag:
+			tag = tag.replace("large_", "big-").replace("large-", "big-")
+		return tag
+
+	def _add_row_tags(self, sess, row, tags):
+		'''
+		Attach `tags` to `row` with a single bulk insert into the link table (tag ids
+		come from the tag registry), then return the row's full tag list.
+		'''
+		assert sess is not None, "update_tags() needs a row that's attached to a session!"
+
+		# Make sure the row has an id, and that any tag changes already pending
+		# on it are written before the link rows go in underneath the ORM.
+		sess.flush()
+
+		self.target_tags_table.registry.link(sess, self.target_tags_link, {row.id : [self._fix_tag(tag) for tag in tags]})
+
+		sess.expire(row, ['tags_rel'])
+		return list(row.tags)
+
+	def update_tags(self, tags, row=None, dbid=None, url=None):
+		self._check_tags(tags)
+
 		# Short circuit for no tags.
 		if not tags:
 			return
 
 		if row:
-			for tag in tags:
-				if (tag.startswith("large_") or tag.startswith("large-")) and 'insertions' not in tag:
-					tag= tag.replace("large_", "big-").replace("large-", "big-")
-				row.tags.add(tag)
-			row_tags = list(row.tags)
+			row_tags = self._add_row_tags(sa.orm.object_session(row), row, tags)
 
 		elif dbid or url:
-			with self.row_sess_context(dbid=dbid, url=url) as (sess_c, row_c):
-				for tag in tags:
-					tag_f = sess_c.merge(tag)
-					if not tag_f in row.tags:
-						row_c.tags.add(tag_f)
-				row_tags = list(row_c.tags)
+			with self.row_sess_context(dbid=dbid, url=url) as (row_c, sess_c):
+				row_tags = self._add_row_tags(sess_c, row_c, tags)
 		else:
 			raise RuntimeError("You need to pass a filter parameter (row, dbid, url) to update_tags()")
 
@@ -180,64 +245,31 @@ class MangaScraperBase(MangaScraperDbMixin, MangaCMS.lib.LogMixin.LoggerMixin, M
 	def wanted_from_tags(self, tags):
 
 		# Skip anything containing a skip tag and not also one of the
-		# keep tags.
-		have_keep_tags = any(
-				[
-						    keep_tags in tag
-						and tag != 'female-none'
-						and tag != 'schoolgirl'
-						and tag != 'tomgirl'
-						and tag != 'position-cowgirl'
-						and tag != 'schoolgirl-uniform'
-						and not tag.lower().startswith('artist-')
-						and not tag.lower().startswith('fetish-')
-						and not tag.lower().startswith('male-')
-						and not tag.lower().startswith("parody-")
-					for
-						tag
-					in
-						tags
-					for
-						keep_tags
-					in
-						settings.tags_keep
-				]
-			)
-		have_skip_tags = any([skip_tag in str(tags) for skip_tag in settings.skipTags])
+		# keep tags. The rules are compiled once, see MangaCMS.lib.TagFilter.
+		tag_filter = MangaCMS.lib.TagFilter.get_tag_filter()
 
-		if have_skip_tags and not have_keep_tags:
-			self.log.warning("Masked item tag (%s).", [skip_tag for skip_tag in settings.skipTags if skip_tag in tags])
-			self.log.warning("All item tag (%s).", [skip_tag for skip_tag in settings.skipTags])
+		if not tag_filter.wanted(tags):
+			self.log.warning("Masked item tag (%s).", tag_filter.masked_by(tags))
+			self.log.warning("All item tag (%s).", list(tag_filter.skip_tags))
 			return False
 
-		# print()
-		# self.log.info("Masked from tags: %s", [skip_tag for skip_tag in settings.skipTags if skip_tag in tags])
-		# self.log.info("Keep tags: %s", [
-		# 				tag
-		# 			for
-		# 				tag
-		# 			in
-		# 				tags
-		# 			for
-		# 				keep_tags
-		# 			in
-		# 				settings.tags_keep
-		# 			if
-		# 				    keep_tags in tag
-		# 				and tag != 'female-none'
-		# 				and tag != 'schoolgirl'
-		# 				and tag != 'tomgirl'
-		# 				and tag != 'position-cowgirl'
-		# 				and tag != 'schoolgirl-uniform'
-		# 				and not tag.lower().startswith('artist-')
-		# 				and not tag.lower().startswith('fetish-')
-		# 				and not tag.lower().startswith('male-')
-		# 				and not tag.lower().startswith("parody-")
-		# 	])
-		# self.log.info("All tags: %s", tags)
-
 		return True
 
+	def wanted_from_tags_batch(self, tag_lists):
+		'''
+		`wanted_from_tags()` for many rows at once. Returns a list of bools, in
+		the same order as `tag_lists`.
+		'''
+		tag_filter = MangaCMS.lib.TagFilter.get_tag_filter()
+		tag_lists  = list(tag_lists)
+		wanted     = tag_filter.wanted_many(tag_lists)
+
+		for tags, is_wanted in zip(tag_lists, wanted):
+			if not is_wanted:
+				self.log.warning("Masked item tag (%s).", tag_filter.masked_by(tags))
+
+		return wanted
+
 
 
 
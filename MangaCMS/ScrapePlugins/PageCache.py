@@ -0,0 +1,160 @@
+
+import os
+import os.path
+import json
+import time
+import uuid
+import logging
+import hashlib
+import threading
+
+import settings
+
+
+class PageCache(object):
+	'''
+	On-disk cache of fetched pages, keyed by source URL.
+
+	Used by RetreivalBase.fetch_pages(), so that when a chapter fails part way
+	through (rate limiting, content not available yet, a crash), the retry
+	only has to fetch the pages it didn't get the first time.
+
+	Each entry is a single file containing a one-line JSON header (url,
+	filename, creation time) followed by the page content. Entries older
+	than `ttl` seconds are treated as misses. The file mtime is bumped on
+	every hit, and when the cache grows past `max_bytes` the least recently
+	used entries are removed until it's back under 90% of the limit.
+	'''
+
+	def __init__(self, cache_dir, max_bytes, ttl):
+		self.log       = logging.getLogger("Main.PageCache")
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		self.ttl       = ttl
+
+		self.lock      = threading.Lock()
+		self.cur_bytes = None
+
+		os.makedirs(self.cache_dir, exist_ok=True)
+
+	def _path(self, url):
+		key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+		return os.path.join(self.cache_dir, key[:2], key + ".page")
+
+	def _entries(self):
+		for root, _, files in os.walk(self.cache_dir):
+			for fname in files:
+				if fname.endswith(".page"):
+					fpath = os.path.join(root, fname)
+					try:
+						st = os.stat(fpath)
+					except FileNotFoundError:
+						continue
+					yield fpath, st.st_size, st.st_mtime
+
+	def _remove(self, fpath):
+		try:
+			size = os.path.getsize(fpath)
+			os.unlink(fpath)
+		except FileNotFoundError:
+			return
+		with self.lock:
+			if self.cur_bytes is not None:
+				self.cur_bytes -= size
+
+	def get(self, url):
+		'''
+		Return a (filename, content) tuple for `url`, or None if it's not cached.
+		'''
+		fpath = self._path(url)
+		try:
+			with open(fpath, "rb") as fp:
+				header = json.loads(fp.readline().decode("utf-8"))
+				content = fp.read()
+		except (FileNotFoundError, ValueError):
+			return None
+
+		if header['url'] != url:
+			return None
+
+		if time.time() - header['created'] > self.ttl:
+			self._remove(fpath)
+			return None
+
+		try:
+			os.utime(fpath)
+		except FileNotFoundError:
+			pass
+
+		return header['name'], content
+
+	def put(self, url, name, content):
+		fpath = self._path(url)
+		os.makedirs(os.path.dirname(fpath), exist_ok=True)
+
+		header = json.dumps({'url' : url, 'name' : name, 'created' : time.time()}).encode("utf-8")
+
+		# Write-and-rename, so concurrent readers never see a partial entry.
+		tmp_path = "%s.%s.tmp" % (fpath, uuid.uuid4().hex)
+		with open(tmp_path, "wb") as fp:
+			fp.write(header)
+			fp.write(b"\n")
+			fp.write(content)
+		os.rename(tmp_path, fpath)
+
+		with self.lock:
+			if self.cur_bytes is None:
+				self.cur_bytes = sum(size for _, size, _ in self._entries())
+			else:
+				self.cur_bytes += len(header) + 1 + len(content)
+			over = self.cur_bytes > self.max_bytes
+
+		if over:
+			self.evict()
+
+	def discard(self, url):
+		self._remove(self._path(url))
+
+	def evict(self):
+		entries = sorted(self._entries(), key=lambda tmp: tmp[2])
+		total   = sum(size for _, size, _ in entries)
+		target  = self.max_bytes * 0.9
+		removed = 0
+
+		now = time.time()
+		for fpath, size, mtime in entries:
+			if total <= target and now - mtime < self.ttl:
+				break
+			try:
+				os.unlink(fpath)
+			except FileNotFoundError:
+				pass
+			total   -= size
+			removed += 1
+
+		with self.lock:
+			self.cur_bytes = total
+
+		self.log.info("Page cache eviction removed %s entries. Cache size: %0.2f MB", removed, total / (1024 * 1024))
+
+
+_PAGE_CACHE      = None
+_PAGE_CACHE_LOCK = threading.Lock()
+
+def get_page_cache():
+	'''
+	Process-wide page cache, or None if `settings.pageCacheDir` isn't set.
+	'''
+	global _PAGE_CACHE
+	cache_dir = getattr(settings, "pageCacheDir", None)
+	if not cache_dir:
+		return None
+
+	with _PAGE_CACHE_LOCK:
+		if _PAGE_CACHE is None:
+			_PAGE_CACHE = PageCache(
+					cache_dir = cache_dir,
+					max_bytes = getattr(settings, "pageCacheMaxBytes", 2 * 1024 * 1024 * 1024),
+					ttl       = getattr(settings, "pageCacheTtl", 60 * 60 * 24 * 7),
+				)
+		return _PAGE_CACHE
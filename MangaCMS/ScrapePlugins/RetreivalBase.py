@@ -6,9 +6,19 @@ import traceback
 import os
 import os.path
 import hashlib
+import re
+import uuid
+import random
 import mimetypes
+import threading
+import contextlib
+import collections
+import socket
+import urllib.parse
 from concurrent.futures import ThreadPoolExecutor
 import magic
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
 
 import WebRequest
 
@@ -18,17 +28,16 @@ import runStatus
 import nameTools as nt
 
 import MangaCMS.cleaner.processDownload
+import MangaCMS.cleaner.postProcessQueue
+import MangaCMS.lib.Aimd
+import MangaCMS.lib.HashingWriter
+import MangaCMS.lib.MemoryBudget
+import MangaCMS.lib.SeriesPriority
 import MangaCMS.ScrapePlugins.MangaScraperBase
+import MangaCMS.ScrapePlugins.PageCache
+import MangaCMS.ScrapePlugins.DownloadJob as DownloadJob
 import MangaCMS.ScrapePlugins.ScrapeExceptions as ScrapeExceptions
 
-def hash_file(filepath):
-
-	with open(filepath, "rb") as f:
-		hash_md5 = hashlib.md5()
-		hash_md5.update(f.read())
-		fhash = hash_md5.hexdigest()
-	return fhash
-
 def clean_filename(in_filename):
 	in_filename = in_filename.replace('.zip .zip', '.zip')
 	in_filename = in_filename.replace('.zip.zip', '.zip')
@@ -89,6 +98,174 @@ def prep_check_fq_filename(fqfilename):
 
 	return fqfilename
 
+# Per-host semaphores shared by every page fetcher in the process, so
+# concurrent chapters from the same plugin don't multiply the load on a host.
+_HOST_SEMAPHORES     = {}
+_HOST_SEMAPHORE_LOCK = threading.Lock()
+
+def get_host_semaphore(url, limit):
+	host = urllib.parse.urlsplit(url).netloc.lower()
+	with _HOST_SEMAPHORE_LOCK:
+		if host not in _HOST_SEMAPHORES:
+			_HOST_SEMAPHORES[host] = threading.BoundedSemaphore(limit)
+		return _HOST_SEMAPHORES[host]
+
+def fix_image_name(log, imageName, imageContent):
+	'''
+	Check that `imageContent` is actually an image, and make sure `imageName`
+	has an extension that matches the sniffed mimetype.
+	'''
+	assert isinstance(imageName, str)
+	assert isinstance(imageContent, bytes)
+
+	mtype = magic.from_buffer(imageContent, mime=True)
+	if imageName.lower().endswith(".png") and mtype == 'application/octet-stream':
+		# So libmagic is somehow misidentifiying pngs as being of type
+		# 'application/octet-stream'. Anyways, short circut that specific case.
+		pass
+	else:
+		assert "image" in mtype.lower(), "Image not in mimetype ('%s') of file '%s'?" % (mtype, imageName)
+
+	_, ext = os.path.splitext(imageName)
+	fext = mimetypes.guess_extension(mtype)
+	if fext == '.jpe':
+		fext = ".jpg"
+	if ext == '.jpeg':
+		ext = ".jpg"
+	if fext == '.jpeg':
+		fext = ".jpg"
+
+	if not ext:
+		log.warning("Missing extension in archive file: %s", imageName)
+		log.warning("Appending guessed file-extension %s", fext)
+		imageName += fext
+	elif fext != ext:
+		log.warning("Archive file extension %s mismatches guessed extension: %s", (imageName, ext), fext)
+		log.warning("Appending guessed file-extension %s", fext)
+		imageName += fext
+
+	return imageName
+
+
+class ImageArchiveSink(object):
+	'''
+	Write-through zip archive for downloaded pages.
+
+	Each page is validated and appended to a temporary archive in the
+	destination directory as soon as it's added, so only the page currently
+	being written has to be held in memory. `finalize()` closes the archive
+	and renames it to its final name. If the sink is used as a context manager
+	and is exited without being finalized, the partial file is removed.
+	'''
+
+	def __init__(self, fqfilename, log):
+		self.log        = log
+		self.fqfilename = prep_check_fq_filename(fqfilename)
+		self.final_path = None
+
+		# Digests and size of the archive, available once finalized.
+		self.fhash        = None
+		self.fhash_sha256 = None
+		self.fsize        = None
+
+		self.image_count = 0
+		self.byte_count  = 0
+
+		# The temporary file lives in the target directory so the final rename
+		# never crosses a filesystem boundary. The name is short, so overly long
+		# target filenames are only an issue at rename time.
+		filepath, _ = os.path.split(self.fqfilename)
+		self.tmp_path = os.path.join(filepath, ".partial-%s.zip" % uuid.uuid4().hex)
+		self.fp   = MangaCMS.lib.HashingWriter.HashingFileWriter(open(self.tmp_path, "xb"))
+		self.arch = zipfile.ZipFile(self.fp, "w")
+
+		self.log.info("Opened streaming archive for %s (temp file: %s)", self.fqfilename, self.tmp_path)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		if not self.final_path:
+			self.abort()
+
+	def add_image(self, imageName, imageContent):
+		assert self.arch, "Adding image to archive sink that has been closed!"
+
+		imageName = fix_image_name(self.log, imageName, imageContent)
+
+		self.log.info("	Image: %s (%s bytes)", imageName, len(imageContent))
+		self.arch.writestr(imageName, imageContent)
+
+		# The page is on disk now, so it no longer counts against the memory budget.
+		MangaCMS.lib.MemoryBudget.release(len(imageContent))
+
+		self.image_count += 1
+		self.byte_count  += len(imageContent)
+
+	def _close(self):
+		if self.arch:
+			self.arch.close()
+			self.arch = None
+		if self.fp:
+			self.fp.close()
+			self.fp = None
+
+	def abort(self):
+		if self.final_path:
+			return
+		self.log.warning("Discarding partial archive for %s (%s images written)", self.fqfilename, self.image_count)
+		try:
+			self._close()
+		except (IOError, OSError, ValueError):
+			pass
+		if os.path.exists(self.tmp_path):
+			os.unlink(self.tmp_path)
+
+	def finalize(self):
+		'''
+		Close the archive, and move it into place. Returns the final path
+		of the archive.
+		'''
+		if self.final_path:
+			return self.final_path
+
+		assert self.image_count >= 1, "No images written to archive for %s!" % self.fqfilename
+
+		# The zip central directory is only written when the archive is closed,
+		# so the digests aren't those of the finished file until then.
+		self.arch.close()
+		self.arch = None
+		self.fhash        = self.fp.hexdigest()
+		self.fhash_sha256 = self.fp.sha256_hexdigest()
+		self.fsize        = self.fp.size
+		self._close()
+
+		self.log.info("Saved %s images (%s bytes) to archive %s", self.image_count, self.byte_count, self.fqfilename)
+
+		fqfilename = self.fqfilename
+		filepath, fileN = os.path.split(fqfilename)
+		chop = len(fileN)-4
+
+		while 1:
+			fqfilename = insertCountIfFilenameExists(fqfilename)
+			try:
+				os.rename(self.tmp_path, fqfilename)
+				self.final_path = fqfilename
+				return fqfilename
+
+			except (IOError, OSError):
+				chop = chop - 1
+				if chop <= 0:
+					raise
+
+				filepath, fileN = os.path.split(fqfilename)
+
+				fileN = fileN[:chop]+fileN[-4:]
+				self.log.warn("Truncating file length to %s characters and re-encoding.", chop)
+				fileN = fileN.encode('utf-8','ignore').decode('utf-8')
+				fileN = nt.makeFilenameSafe(fileN)
+				fqfilename = os.path.join(filepath, fileN)
+
 
 class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 
@@ -100,19 +277,166 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 	itemLimit = 250
 	retreival_threads = 1
 
+	# AIMD concurrency tuning (see MangaCMS.lib.Aimd). If retreival_threads_max
+	# is set, the number of items fetched at once starts at retreival_threads
+	# and is adjusted between retreival_threads_min and retreival_threads_max,
+	# based on fetch latency, errors and rate limiting.
+	retreival_threads_min = 1
+	retreival_threads_max = None
+
+	# Concurrent page fetching (see fetch_pages()). page_fetch_threads is the
+	# number of pages of a single chapter in flight at once, page_fetch_per_host
+	# caps the in-flight requests to any one host across the whole process.
+	page_fetch_threads  = 4
+	page_fetch_per_host = 2
+	page_fetch_retries  = 3
+
+	# Consult the on-disk page cache (settings.pageCacheDir) before fetching
+	# pages, so a retried chapter only fetches the pages it's missing.
+	use_page_cache      = True
+
+	# In-flight byte budget (settings.fetchMemoryBudget/fetchHostMemoryBudget, see
+	# MangaCMS.lib.MemoryBudget). An item isn't started until there's room for
+	# fetch_size_estimate bytes, and its fetches are counted as they come back.
+	fetch_size_estimate = 16 * 1024 * 1024
+
+	# Opt-in work-claim queue (see claim_todo_links()). When enabled, items are
+	# claimed a batch at a time under a lease, so several processes (or hosts)
+	# can drain the same plugin's backlog without double-fetching.
+	use_work_claims  = False
+	claim_batch_size = 10
+	claim_lease_time = datetime.timedelta(hours=1)
+
+	# Retry scheduling for failed items (see _schedule_retry_row()). Transient
+	# failures are requeued after retry_base_delay, doubling each attempt up
+	# to retry_max_delay. After retry_max_attempts (or on a permanent failure)
+	# the item stays in the error state until it's reset by hand.
+	retry_max_attempts = 6
+	retry_base_delay   = datetime.timedelta(minutes=30)
+	retry_max_delay    = datetime.timedelta(days=2)
+
+	# Fetch watched, already-present and well rated series first (see
+	# todo_priority()). Only applies to manga plugins. Only the
+	# `series_priority_max_series` series with the most recent waiting items
+	# are scored, which bounds both the nameTools lookups and the CASE.
+	use_series_priority        = True
+	series_priority_max_series = 500
+
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
-		self.wg = WebRequest.WebGetRobust(logPath=self.logger_path+".Web")
+		self.wg = self.rate_limited_wg(WebRequest.WebGetRobust(logPath=self.logger_path+".Web"))
 		self.die = False
 
+		self.memory_budget = MangaCMS.lib.MemoryBudget.get_memory_budget()
+		if self.memory_budget:
+			self.wg = MangaCMS.lib.MemoryBudget.BudgetedWebGet(self.wg)
+
+		self.concurrency = None
+		if self.retreival_threads_max and self.retreival_threads_max > self.retreival_threads_min:
+			self.concurrency = MangaCMS.lib.Aimd.AimdController(
+					min_limit = self.retreival_threads_min,
+					max_limit = self.retreival_threads_max,
+					initial   = self.retreival_threads,
+					log       = self.log,
+				)
+
+		# Identifies this fetcher instance in work-claim leases.
+		self.lease_owner = "%s-%s-%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+		# The item each fetch thread is working on, the post-processing it has
+		# deferred to the post-processing queue (see processDownload()), the
+		# pages it's put in the page cache (see fetch_pages()), and the digests
+		# of the archives it's written (see _remember_hash()).
+		self._item_local = threading.local()
+
+		self.page_cache = MangaCMS.ScrapePlugins.PageCache.get_page_cache() if self.use_page_cache else None
+
 	@abc.abstractmethod
 	def get_link(self, link_row_id):
 		pass
 
-	# Provision for a delay. If checkDelay returns false, item is not enqueued
+	# Provision for a delay. Items posted less then `fetch_delay` (a timedelta)
+	# ago are not enqueued. This is applied in the todo query itself.
+	fetch_delay = None
+
+	def todo_delay_predicate(self):
+		'''
+		SQL predicate restricting which new items are eligible for fetching,
+		or None. Plugins with a delay more complex than `fetch_delay` can
+		override this.
+		'''
+		if self.fetch_delay:
+			return self.target_table.posted_at < sa.func.now() - self.fetch_delay
+		return None
+
+	def todo_state_predicate(self):
+		'''
+		SQL predicate for rows that are waiting to be fetched: new rows, and
+		errored rows whose retry has come due.
+		'''
+		return sa.or_(
+				self.target_table.state == 'new',
+				sa.and_(
+					self.target_table.state == 'error',
+					self.target_table.next_retry_at <= sa.func.now(),
+				)
+			)
+
+	def todo_priority(self, sess):
+		'''
+		SQL expression to order the todo queue by (highest first, then newest
+		first), or None to just take the newest items. Plugins can override
+		this to prioritize however they like.
+
+		The default scores the series with new items waiting (at most
+		`series_priority_max_series` of them, most recently posted first) via
+		MangaCMS.lib.SeriesPriority, and turns the scores into a CASE on
+		`series_name`, so the ordering and `itemLimit` cut-off still happen
+		in the query. Series past the cap are left unscored, but they'd be
+		the ones an `itemLimit` cut-off drops first anyways.
+		'''
+		if not (self.is_manga and self.use_series_priority):
+			return None
+
+		name_q = sess.query(self.target_table.series_name)                \
+			.filter(self.target_table.source_site == self.plugin_key)     \
+			.filter(self.todo_state_predicate())                          \
+			.filter(self.target_table.series_name != None)
+
+		delay = self.todo_delay_predicate()
+		if delay is not None:
+			name_q = name_q.filter(delay)
+
+		name_q = name_q                                                   \
+			.group_by(self.target_table.series_name)                      \
+			.order_by(sa.func.max(self.target_table.posted_at).desc())    \
+			.limit(self.series_priority_max_series)
+
+		series_names = [series_name for series_name, in name_q.all()]
+		scores = MangaCMS.lib.SeriesPriority.get_series_priority().scores(series_names)
+
+		self.log.info("%s of %s series with waiting items are prioritized", len(scores), len(series_names))
+		if not scores:
+			return None
+
+		return sa.case(scores, value=self.target_table.series_name, else_=0)
+
+	# Legacy python-side delay filter. If checkDelay returns false, item is not enqueued.
+	# Overriding this forces the todo query to return every new item so it can be
+	# filtered here, so prefer `fetch_delay`/`todo_delay_predicate()`.
 	def checkDelay(self, _):
 		return True
 
+	def download_job(self, link_row_id, state=None):
+		'''
+		Get a DownloadJob, for accumulating state changes to the row `link_row_id`
+		and writing them in as few round trips as possible.
+		'''
+		return DownloadJob.DownloadJob(self.db, self.target_table, link_row_id, state=state, log=self.log)
+
+	def _has_python_delay(self):
+		return type(self).checkDelay is not RetreivalBase.checkDelay
+
 	# And for logging in (if needed)
 	def setup(self):
 		pass
@@ -127,6 +451,19 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 		# Never upload hentai, but default to upoading otherwise.
 		kwargs[   "doUpload"] = self.is_manga and kwargs.get("doUpload", True)
 
+		if "fhash" not in kwargs and "archivePath" in kwargs:
+			written_hashes = getattr(self._item_local, "written_hashes", None) or {}
+			kwargs["fhash"] = written_hashes.pop(kwargs["archivePath"], None)
+
+		# With the post-processing queue enabled, the work is handed off (as a
+		# job written along with the item's final state in _finish_fetch()),
+		# rather than tying up the fetch thread. Calls made outside of an item
+		# fetch still run inline.
+		if getattr(settings, "postProcessQueue", False) and getattr(self._item_local, "post_process", None) is not None:
+			self.log.info("Deferring post-processing of %s to the post-processing queue", kwargs.get("archivePath"))
+			self._item_local.post_process.append(kwargs)
+			return ""
+
 		return MangaCMS.cleaner.processDownload.processDownload(**kwargs)
 
 	def _retreiveTodoLinksFromDB(self):
@@ -135,103 +472,173 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 
 		self.log.info( "Fetching items from db...",)
 
+		python_delay = self._has_python_delay()
+
 		with self.db.session_context() as sess:
 
-			res = sess.query(self.target_table)                            \
-				.filter(self.target_table.source_site == self.plugin_key)  \
-				.filter(self.target_table.state == 'new')                  \
-				.order_by(self.target_table.posted_at.desc())              \
-				.all()
+			# Only pull the columns we need, and let postgres do the ordering
+			# and limiting (this is served by the partial index on new rows).
+			res_q = sess.query(self.target_table.id, self.target_table.posted_at) \
+				.filter(self.target_table.source_site == self.plugin_key)          \
+				.filter(self.todo_state_predicate())
+
+			delay = self.todo_delay_predicate()
+			if delay is not None:
+				res_q = res_q.filter(delay)
+
+			priority = self.todo_priority(sess)
+			if priority is not None:
+				res_q = res_q.order_by(priority.desc(), self.target_table.posted_at.desc())
+			else:
+				res_q = res_q.order_by(self.target_table.posted_at.desc())
+
+			if self.itemLimit and not python_delay:
+				res_q = res_q.limit(self.itemLimit)
 
-			res = [(tmp.id, tmp.posted_at) for tmp in res]
+			res = res_q.all()
 
 			self.log.info("Query returned %s items", len(res))
 		self.log.info( "Done")
 
-		items = []
-		for item_row_id, posted_at in res:
-			if self.checkDelay(posted_at):
-				items.append((item_row_id, posted_at))
-
-		self.log.info( "Have %s new items to retreive in %s Downloader", len(items), self.plugin_key.title())
+		items = [(item_row_id, posted_at) for item_row_id, posted_at in res]
 
+		if python_delay:
+			items = [tmp for tmp in items if self.checkDelay(tmp[1])]
+			if self.itemLimit:
+				items = items[:self.itemLimit]
 
-		items = sorted(items, key=lambda k: k[1], reverse=True)
-		if self.itemLimit:
-			items = items[:self.itemLimit]
+		self.log.info( "Have %s new items to retreive in %s Downloader", len(items), self.plugin_key.title())
 
 		items = [tmp[0] for tmp in items]
 
 		return items
 
 	def sync_file_tags(self, link_row_id):
-		self.log.info("Synchronizing tags with file row")
 		with self.row_context(dbid=link_row_id) as row:
-			# Occurs if the row got deleted.
-			if not row:
-				return
-			if not row.file:
-				return
+			self._sync_file_tags_row(row)
 
-			release_list = row.file.manga_releases if self.is_manga else row.file.hentai_releases
-			file_tag_list = row.file.manga_tags if self.is_manga else row.file.hentai_tags
-			if not release_list:
-				return
+	def _sync_file_tags_row(self, row):
+		self.log.info("Synchronizing tags with file row")
+		# Occurs if the row got deleted.
+		if not row:
+			return
+		if not row.file:
+			return
+		if self.target_tags_table is None:
+			return
 
-			self.log.info("Found %s release rows associated with file with %s tag(s)", len(release_list), [len(tmp.tags) for tmp in release_list])
-			self.log.info("%s tags attached to file row before sync.", len(file_tag_list))
+		sess = sa.orm.object_session(row)
+		sess.flush()
 
-			for release in release_list:
-				for tag in release.tags:
-					file_tag_list.add(tag)
-			self.log.info("File has %s tags after synchronizing", len(file_tag_list))
+		# Copy the tag ids from every release pointing at this file straight
+		# across into the file's link table, rather than round-tripping each
+		# tag through the ORM.
+		rel_tbl   = self.target_table.__table__
+		rel_link  = self.target_tags_link
+		file_link = self.target_file_tags_link
 
+		src = sa.select([sa.literal(row.fileid, sa.BigInteger), rel_link.c.tags_id])            \
+			.select_from(rel_link.join(rel_tbl, rel_link.c.releases_id == rel_tbl.c.id))   \
+			.where(rel_tbl.c.fileid == row.fileid)                                         \
+			.distinct()
+		stmt = postgresql.insert(file_link)                     \
+			.from_select(['releases_id', 'tags_id'], src)       \
+			.on_conflict_do_nothing()
+		res = sess.execute(stmt)
 
-	def _fetch_link(self, link_row_id):
-		try:
-			if link_row_id is None:
-				self.log.error("Worker received null task! Wat?")
-				return
-			if self.die:
-				self.log.warning("Skipping job due to die flag!")
-				return
-			if not runStatus.run:
-				self.log.info( "Breaking due to exit flag being set")
-				return
+		sess.expire(row.file, ['manga_tags_rel' if self.is_manga else 'hentai_tags_rel'])
+		self.log.info("Added %s tag(s) to file row %s", res.rowcount, row.fileid)
 
-			with self.row_context(dbid=link_row_id) as row:
-				if row.state != 'new':
-					self.log.warning("Muliple fetch attemps for the same entry (%s) in plugin %s!", link_row_id, self.plugin_name)
-					return
 
-			self.log.info("Fetching content for release with ID: %s", link_row_id)
+	def _check_fetchable(self, link_row_id):
+		if link_row_id is None:
+			self.log.error("Worker received null task! Wat?")
+			return False
+		if self.die:
+			self.log.warning("Skipping job due to die flag!")
+			return False
+		if not runStatus.run:
+			self.log.info( "Breaking due to exit flag being set")
+			return False
 
-			status = self.get_link(link_row_id=link_row_id)
+		with self.row_sess_context(dbid=link_row_id) as row_tup:
+			row, sess = row_tup
+			claimed = row.state == 'fetching' and row.lease_owner == self.lease_owner
 
-			self.sync_file_tags(link_row_id=link_row_id)
+			# Retries come due by the database's clock, as in todo_state_predicate().
+			retry = False
+			if row.state == 'error' and row.next_retry_at:
+				retry = sess.query(self.target_table.next_retry_at <= sa.func.now())   \
+					.filter(self.target_table.id == link_row_id)                      \
+					.scalar()
 
-			ret1 = None
-			if status == 'phash-duplicate':
-				ret1 = self.mon_con.incr('phash_dup_items', 1)
-			elif status == 'binary-duplicate':
-				ret1 = self.mon_con.incr('bin_dup_items', 1)
+			if row.state != 'new' and not claimed and not retry:
+				self.log.warning("Muliple fetch attemps for the same entry (%s) in plugin %s!", link_row_id, self.plugin_name)
+				return False
 
-			# We /always/ send the "fetched_items" count entry.
-			# However, the deduped result is only send if the item is actually deduped.
-			ret2 = self.mon_con.incr('fetched_items', 1)
-			self.log.info("Retreival of release complete. Sending log results:")
-			if ret1:
-				self.log.info("	-> %s", ret1)
-			self.log.info("	-> %s", ret2)
+			if retry:
+				self.log.info("Retrying item %s (attempt %s). Last error: %s", link_row_id, row.retry_count + 1,
+						(row.err_str or "").strip().split("\n")[-1])
+				row.state = 'new'
+
+		self.log.info("Fetching content for release with ID: %s", link_row_id)
+		return True
 
+	def _finish_fetch(self, link_row_id, status, post_process=None):
+
+		# Tag sync, the finishing checks, retry scheduling (if the plugin
+		# marked the row failed) and queueing any deferred post-processing
+		# share one session.
+		with self.row_sess_context(dbid=link_row_id) as row_tup:
+			row, sess = row_tup
+			self._sync_file_tags_row(row)
+
+			if row:
+				self._schedule_retry_row(row)
 
 			# Finishing checks
-			with self.row_context(dbid=link_row_id) as row:
-				if row and row.state == "complete":
-					assert row.first_seen    > datetime.datetime.min, "Row first_seen column never set in plugin %s!" % self.plugin_name
-					assert row.posted_at     > datetime.datetime.min, "Row posted_at column never set in plugin %s!" % self.plugin_name
-					assert row.downloaded_at > datetime.datetime.min, "Row downloaded_at column never set in plugin %s!" % self.plugin_name
-					assert row.last_checked  > datetime.datetime.min, "Row last_checked column never set in plugin %s!" % self.plugin_name
+			if row and row.state == "complete":
+				assert row.first_seen    > datetime.datetime.min, "Row first_seen column never set in plugin %s!" % self.plugin_name
+				assert row.posted_at     > datetime.datetime.min, "Row posted_at column never set in plugin %s!" % self.plugin_name
+				assert row.downloaded_at > datetime.datetime.min, "Row downloaded_at column never set in plugin %s!" % self.plugin_name
+				assert row.last_checked  > datetime.datetime.min, "Row last_checked column never set in plugin %s!" % self.plugin_name
+
+			# The item isn't done until the queue has post-processed it, and the
+			# job is only visible to the queue once this commits, so it can't
+			# finish before the row is moved back to 'processing'.
+			if row and post_process:
+				for kwargs in post_process:
+					job_id = MangaCMS.cleaner.postProcessQueue.enqueue(sess, release_id=row.id, **kwargs)
+					self.log.info("Queued post-processing job %s for release %s", job_id, row.id)
+				if row.state == 'complete':
+					row.state = 'processing'
+
+		ret1 = None
+		if status == 'phash-duplicate':
+			ret1 = self.mon_con.incr('phash_dup_items', 1)
+		elif status == 'binary-duplicate':
+			ret1 = self.mon_con.incr('bin_dup_items', 1)
+
+		# We /always/ send the "fetched_items" count entry.
+		# However, the deduped result is only send if the item is actually deduped.
+		ret2 = self.mon_con.incr('fetched_items', 1)
+		self.log.info("Retreival of release complete. Sending log results:")
+		if ret1:
+			self.log.info("	-> %s", ret1)
+		self.log.info("	-> %s", ret2)
+
+	@contextlib.contextmanager
+	def _fetch_error_handler(self, link_row_id):
+		'''
+		Common error handling for a single item fetch.
+
+		Yields a dict, whose 'kind' is set to how the fetch ended up ('ok',
+		'skipped', 'unwanted', 'deferred', 'limited' or 'error'), for the
+		concurrency controller.
+		'''
+		outcome = {'kind' : 'ok'}
+		try:
+			yield outcome
 
 		except SystemExit:
 			self.die = True
@@ -244,38 +651,55 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 			self.die = True
 
 			# Reset the download, since failing because a keyboard interrupt is not a remote issue.
-			with self.row_context(dbid=link_row_id) as row:
-				row.state = 'new'
+			job = self.download_job(link_row_id)
+			job.reset()
+			job.flush()
 			raise
 
 		except ScrapeExceptions.UnwantedContentError:
+			outcome['kind'] = 'unwanted'
 			self.log.info("Row is unwanted! Deleting")
 			with self.row_sess_context(dbid=link_row_id) as row_tup:
 				row, sess = row_tup
 				sess.delete(row)
-			return False
 
 
 		except ScrapeExceptions.LimitedException as e:
+			outcome['kind'] = 'limited'
+
+			# If we've been running above the plugin's minimum concurrency, that's
+			# probably why. Back off (the controller handles that) and requeue the
+			# item, rather than giving up on the whole run.
+			if self.concurrency and self.concurrency.limit > self.concurrency.min_limit:
+				self.log.info("Remote site is rate limiting. Backing off.")
+				job = self.download_job(link_row_id)
+				job.reset()
+				job.flush()
+				return
+
 			self.log.info("Remote site is rate limiting. Exiting early.")
 			self.die = True
 			raise e
 
 
 		except ScrapeExceptions.ContentNotAvailableYetError as e:
+			outcome['kind'] = 'deferred'
 			self.log.info("Item seems to be missing content/not available. Deferring.")
-			return False
 
 		except KeyboardInterrupt:
 			self.log.critical("Keyboard Interrupt!")
 			self.log.critical(traceback.format_exc())
 
 			# Reset the download, since failing because a keyboard interrupt is not a remote issue.
-			with self.row_context(dbid=link_row_id) as row:
-				row.state = 'new'
+			job = self.download_job(link_row_id)
+			job.reset()
+			job.flush()
 			raise
 
-		except Exception:
+		except Exception as e:
+			outcome['kind'] = 'error'
+			outcome['exc']  = e
+			outcome['tb']   = traceback.format_exc()
 			ret = self.mon_con.incr('failed_items', 1)
 			self.log.critical("Sending log result: %s", ret)
 
@@ -284,14 +708,75 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 				self.log.critical(line)
 			traceback.print_exc()
 
+	def _fetch_link(self, link_row_id):
+		with self._fetch_error_handler(link_row_id) as outcome:
+			if not self._check_fetchable(link_row_id):
+				outcome['kind'] = 'skipped'
+				return outcome
+
+			self._item_local.post_process   = []
+			self._item_local.cached_pages   = []
+			self._item_local.written_hashes = {}
+			try:
+				with self._item_memory_reservation():
+					status = self.get_link(link_row_id=link_row_id)
+				post_process = self._item_local.post_process
+			finally:
+				self._item_local.post_process   = None
+				self._item_local.cached_pages   = None
+				self._item_local.written_hashes = None
+
+			self._finish_fetch(link_row_id, status, post_process)
+
+		if outcome['kind'] == 'error':
+			self.schedule_retry(link_row_id, outcome)
 
+		return outcome
+
+	def _item_memory_reservation(self):
+		'''
+		Hold a reservation against the memory budget (if there is one) for the
+		duration of a single item fetch. Blocks until the budget has room.
+		'''
+		if not self.memory_budget:
+			return contextlib.nullcontext()
+		return self.memory_budget.reservation(self.fetch_size_estimate)
+
+	def _fetch_link_tuned(self, link_row_id):
+		'''
+		_fetch_link(), run under the concurrency controller: wait for a free
+		slot, then report how the fetch went.
+		'''
+		with self.concurrency.slot():
+			start = time.monotonic()
+			try:
+				outcome = self._fetch_link(link_row_id)
+			except ScrapeExceptions.LimitedException:
+				self.concurrency.on_limited()
+				raise
+
+			kind = outcome['kind'] if outcome else 'error'
+			if kind == 'ok':
+				self.concurrency.on_success(time.monotonic() - start)
+			elif kind == 'limited':
+				self.concurrency.on_limited()
+			elif kind == 'error':
+				self.concurrency.on_error()
+			return outcome
+
+
+	def _max_retreival_threads(self):
+		if self.concurrency:
+			return self.concurrency.max_limit
+		return self.retreival_threads
 
 	def processTodoLinks(self, links):
 		if links:
 
-			with ThreadPoolExecutor(max_workers=self.retreival_threads) as executor:
+			fetch_link = self._fetch_link_tuned if self.concurrency else self._fetch_link
+			with ThreadPoolExecutor(max_workers=self._max_retreival_threads()) as executor:
 
-				futures = [executor.submit(self._fetch_link, link) for link in links]
+				futures = [executor.submit(fetch_link, link) for link in links]
 
 				while futures:
 					futures = [tmp for tmp in futures if not (tmp.done() or tmp.cancelled())]
@@ -304,6 +789,292 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 					time.sleep(1)
 
 
+	# ---------------------------------------------------------------------------------------------------------------------------------------------------------
+	# Retry scheduling
+	# ---------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	# HTTP status codes that mean retrying won't help.
+	PERMANENT_HTTP_CODES = (400, 401, 403, 404, 410, 451)
+
+	def classify_failure(self, exc=None, err_str=None):
+		'''
+		Decide whether a failed fetch is worth retrying. Returns 'permanent'
+		or 'transient'. `exc` is the exception that escaped get_link() (if
+		any), `err_str` whatever the plugin stored on the row.
+
+		Plugins with better knowledge of their site's failure modes can
+		override this.
+		'''
+		code = getattr(exc, 'err_code', None) or getattr(exc, 'code', None)
+		if isinstance(code, int):
+			return 'permanent' if code in self.PERMANENT_HTTP_CODES else 'transient'
+
+		if isinstance(exc, (ScrapeExceptions.NotMangaException, )):
+			return 'permanent'
+
+		# Plugins that catch errors themselves generally just store the traceback.
+		if err_str:
+			for code in self.PERMANENT_HTTP_CODES:
+				if re.search(r"\b(HTTP Error |err_code[=:] ?|code[=:] ?)%s\b" % code, err_str):
+					return 'permanent'
+			if "Not Found" in err_str or "Gone" in err_str:
+				return 'permanent'
+
+		return 'transient'
+
+	def retry_delay(self, retry_count):
+		delay = self.retry_base_delay * (2 ** (retry_count - 1))
+		delay = min(delay, self.retry_max_delay)
+		# Some jitter, so a batch of items that failed together doesn't come due together.
+		return delay * random.uniform(0.8, 1.2)
+
+	def _schedule_retry_row(self, row, exc=None):
+		'''
+		If `row` is in the error state, either schedule another attempt, or give
+		up on it if the failure is permanent or it's out of attempts. Otherwise,
+		clear any retry schedule it has. `exc` is the exception that escaped
+		get_link(), if any.
+
+		Works on a row in the caller's session, so it costs no extra round trip.
+		'''
+		if row.state != 'error':
+			if row.next_retry_at is not None:
+				row.next_retry_at = None
+			return
+
+		row.retry_count = (row.retry_count or 0) + 1
+		kind = self.classify_failure(exc, row.err_str)
+
+		if kind == 'permanent':
+			self.log.warning("Item %s failed permanently. Not retrying.", row.id)
+			row.next_retry_at = None
+		elif row.retry_count > self.retry_max_attempts:
+			self.log.warning("Item %s has failed %s times. Giving up.", row.id, row.retry_count)
+			row.next_retry_at = None
+		else:
+			# Scheduled by the database's clock, which is what todo_state_predicate()
+			# compares against.
+			delay = self.retry_delay(row.retry_count)
+			row.next_retry_at = sa.func.now() + delay
+			self.log.info("Item %s failed (attempt %s). Retrying in %s", row.id, row.retry_count, delay)
+
+		if self.mon_con:
+			self.mon_con.incr('failures.%s' % kind, 1)
+
+	def schedule_retry(self, link_row_id, outcome):
+		'''
+		Called when get_link() raised. Moves the item to the error state, and
+		schedules its retry (see _schedule_retry_row()). Items that finish
+		normally are handled in _finish_fetch().
+		'''
+		with self.row_context(dbid=link_row_id) as row:
+			if not row:
+				return
+
+			if row.state in ('new', 'fetching', 'processing'):
+				row.state   = 'error'
+				row.err_str = outcome.get('tb')
+
+			self._schedule_retry_row(row, outcome.get('exc'))
+
+	# ---------------------------------------------------------------------------------------------------------------------------------------------------------
+	# Work claims
+	# ---------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	def claim_todo_links(self, limit, exclude=None):
+		'''
+		Atomically claim up to `limit` new items for this plugin, moving them to
+		the `fetching` state under a lease owned by this fetcher. Rows whose
+		lease has expired (i.e. the fetcher that claimed them died) are
+		eligible to be claimed again. Rows locked by a concurrent claim are
+		skipped rather than waited on. Items are claimed in todo_priority()
+		order.
+
+		Returns a list of (row_id, posted_at) tuples, newest first.
+		'''
+		tbl = self.target_table.__table__
+
+		with self.db.session_context() as sess:
+			priority = self.todo_priority(sess)
+			order = [tbl.c.posted_at.desc()]
+			if priority is not None:
+				order.insert(0, priority.desc())
+
+			candidates = sa.select([tbl.c.id])                                  \
+				.where(tbl.c.source_site == self.plugin_key)                    \
+				.where(sa.or_(
+						self.todo_state_predicate(),
+						sa.and_(
+							tbl.c.state.in_(['fetching', 'processing']),
+							tbl.c.lease_expires < sa.func.now(),
+							~self.pending_post_process(tbl.c.id),
+						)
+					))                                                          \
+				.order_by(*order)                                               \
+				.limit(limit)                                                   \
+				.with_for_update(skip_locked=True)
+
+			delay = self.todo_delay_predicate()
+			if delay is not None:
+				candidates = candidates.where(delay)
+
+			if exclude:
+				candidates = candidates.where(~tbl.c.id.in_(list(exclude)))
+
+			stmt = tbl.update()                                                 \
+				.where(tbl.c.id.in_(candidates))                                \
+				.values(
+						state         = 'fetching',
+						lease_owner   = self.lease_owner,
+						lease_expires = sa.func.now() + self.claim_lease_time,
+					)                                                           \
+				.returning(tbl.c.id, tbl.c.posted_at)
+
+			claimed = [(row_id, posted_at) for row_id, posted_at in sess.execute(stmt)]
+
+		claimed.sort(key=lambda k: k[1], reverse=True)
+		self.log.info("Claimed %s items (lease owner: %s)", len(claimed), self.lease_owner)
+		return claimed
+
+	def release_claims(self, link_row_ids):
+		'''
+		Hand claimed (but unprocessed) items back to the queue.
+		'''
+		DownloadJob.bulk_transition(self.db, self.target_table, link_row_ids, 'new',
+				where         = [
+					self.target_table.lease_owner == self.lease_owner,
+					self.target_table.state       == 'fetching',
+				],
+				lease_owner   = None,
+				lease_expires = None,
+			)
+
+	def _process_claimed_links(self):
+		'''
+		Claim and process items a batch at a time, until the queue is empty,
+		`itemLimit` items have been processed, or we're told to stop.
+		Returns the number of items processed.
+		'''
+		processed = 0
+		deferred  = set()
+
+		while runStatus.run and not self.die:
+			want = self.claim_batch_size
+			if self.itemLimit:
+				want = min(want, self.itemLimit - processed)
+			if want <= 0:
+				break
+
+			claimed = self.claim_todo_links(limit=want, exclude=deferred)
+			if not claimed:
+				break
+
+			todo = [row_id for row_id, posted_at in claimed if self.checkDelay(posted_at)]
+			delayed = [row_id for row_id, posted_at in claimed if row_id not in todo]
+			if delayed:
+				deferred.update(delayed)
+				self.release_claims(delayed)
+
+			if todo:
+				self.processTodoLinks(todo)
+				processed += len(todo)
+
+		return processed
+
+	# ---------------------------------------------------------------------------------------------------------------------------------------------------------
+	# Page fetching
+	# ---------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	def fetch_page(self, page_idx, url, referrer):
+		'''
+		Fetch a single page of a chapter. Returns a (filename, content) tuple.
+		Plugins that need to do something other than a plain GET (or want to
+		name the pages differently) should override this.
+		'''
+		content, name = self.wg.getFileAndName(url, addlHeaders={'Referer': referrer})
+		return name, content
+
+	def check_page(self, url, imageName, imageContent):
+		'''
+		Validate a fetched page. Raising ContentNotAvailableYetError from here
+		defers the whole chapter (the same as raising it from get_link()).
+		'''
+		fType = magic.from_buffer(imageContent, mime=True)
+		if imageName.lower().endswith(".png") and fType == 'application/octet-stream':
+			return
+		if not 'image' in fType:
+			raise ScrapeExceptions.ContentNotAvailableYetError(
+				"Empty/failed image return from %s - File isn't an image? Detected type: %s" % (url, fType))
+
+	def _fetch_page_with_retries(self, page_idx, url, referrer):
+		if self.page_cache:
+			cached = self.page_cache.get(url)
+			if cached:
+				self.log.info("Using cached copy of page %s (%s)", page_idx, url)
+				MangaCMS.lib.MemoryBudget.charge(len(cached[1]))
+				return cached
+
+		host_sem = get_host_semaphore(url, self.page_fetch_per_host)
+
+		for attempt in range(1, self.page_fetch_retries + 1):
+			try:
+				with host_sem:
+					imageName, imageContent = self.fetch_page(page_idx, url, referrer)
+				self.check_page(url, imageName, imageContent)
+
+				if self.page_cache:
+					self.page_cache.put(url, imageName, imageContent)
+				return imageName, imageContent
+
+			except (ScrapeExceptions.ContentNotAvailableYetError,
+					ScrapeExceptions.LimitedException,
+					ScrapeExceptions.UnwantedContentError):
+				raise
+
+			except Exception:
+				if attempt >= self.page_fetch_retries:
+					raise
+				self.log.warning("Failed to fetch page %s (%s). Retrying (attempt %s of %s).",
+					page_idx, url, attempt, self.page_fetch_retries)
+				for line in traceback.format_exc().split("\n"):
+					self.log.warning(line)
+				time.sleep(2 ** attempt)
+
+	def fetch_pages(self, page_urls):
+		'''
+		Generator that fetches a list of (url, referrer) tuples concurrently, and
+		yields (filename, content) tuples in the same order as `page_urls`.
+
+		At most `page_fetch_threads` pages are in flight (or buffered) at any
+		time, so feeding the output straight into an image sink keeps memory
+		bounded. If the consumer stops early (or a page fails), outstanding
+		fetches are cancelled.
+		'''
+
+		# Pages are fetched on the executor's threads, but still count against
+		# the memory budget reservation of the item they're for.
+		fetch_page = MangaCMS.lib.MemoryBudget.bind(self._fetch_page_with_retries)
+
+		# Pages are only cached until the chapter they're for has been archived.
+		cached_pages = getattr(self._item_local, "cached_pages", None) if self.page_cache else None
+
+		executor = ThreadPoolExecutor(max_workers=self.page_fetch_threads)
+		pending = collections.deque()
+		try:
+			for page_idx, (url, referrer) in enumerate(page_urls):
+				if cached_pages is not None:
+					cached_pages.append(url)
+				pending.append(executor.submit(fetch_page, page_idx, url, referrer))
+				if len(pending) >= self.page_fetch_threads:
+					yield pending.popleft().result()
+
+			while pending:
+				yield pending.popleft().result()
+
+		finally:
+			for job in pending:
+				job.cancel()
+			executor.shutdown(wait=False)
 
 
 
@@ -358,13 +1129,32 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 			.scalar()
 		return have_row
 
-	def get_create_file_row(self, sess, row, fqfilename):
+	def _files_match(self, have, have_fqp, fqfilename, fsize, fhash_sha256):
+		'''
+		Check that the file `fqfilename` has the same contents as the file for
+		release-file row `have` (located at `have_fqp`).
+		'''
+
+		if getattr(settings, "trustFileDigests", False) and have.fsize and have.fhash_sha256 and fsize and fhash_sha256:
+			self.log.info("Using stored size and sha256 to check for a binary match.")
+			return have.fsize == fsize and have.fhash_sha256 == fhash_sha256
+
+		return MangaCMS.lib.HashingWriter.files_identical(have_fqp, fqfilename)
+
+	def get_create_file_row(self, sess, row, fqfilename, fhash=None, fsize=None, fhash_sha256=None):
 		'''
 		Given a path to a file, return a row for that file's contents.
 		If no row exits, it is created. If a row for another file
 		that has exactly matching contents, but a different name
 		is found, it is used preferentially.
 
+		If the caller already knows the md5 of the file (because it
+		was computed while writing it), it can be passed as `fhash`,
+		and the file won't be re-read to hash it. `fsize` and
+		`fhash_sha256` are stored on newly created rows, and allow
+		skipping the byte-for-byte comparison against an existing
+		file with the same md5 (if settings.trustFileDigests is set).
+
 		Return is a 2-tuple of (file_row, file_path).
 		File-path should be guaranteed to point to a valid file.
 
@@ -373,8 +1163,8 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 		of another existing file.
 		'''
 
-		# Round-trip via the filesystem because why not
-		fhash = hash_file(fqfilename)
+		if not fhash:
+			fhash, fhash_sha256, fsize = MangaCMS.lib.HashingWriter.digest_file(fqfilename)
 
 		have = self._get_existing_file_by_hash(sess, fhash)
 
@@ -387,16 +1177,16 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 				raise RuntimeError("Multiple instances of a releasefile created on same on-disk file!")
 			if os.path.exists(have_fqp):
 
-				with open(have_fqp, "rb") as fp1:
-					fc1 = fp1.read()
-				with open(fqfilename, "rb") as fp2:
-					fc2 = fp2.read()
-
-				if fc1 != fc2:
+				if not self._files_match(have, have_fqp, fqfilename, fsize, fhash_sha256):
 					self.log.error("Multiple instances of a releasefile with the same md5, but different contents?")
 					self.log.error("Files: %s, %s. Row id: %s", have_fqp, fqfilename, row.id)
 					raise RuntimeError("Multiple instances of a releasefile with the same md5, but different contents?")
 
+				# The contents match, so backfill the digests for older rows.
+				if fsize and fhash_sha256 and not have.fhash_sha256:
+					have.fsize        = fsize
+					have.fhash_sha256 = fhash_sha256
+
 				if fqfilename == have_fqp:
 					self.log.warning("Row for file-path already exists?.")
 					self.log.warning("Files: '%s', '%s'.", have_fqp, fqfilename)
@@ -416,6 +1206,9 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 
 				have.dirpath = dirpath
 				have.filename = filename
+				if fsize and fhash_sha256:
+					have.fsize        = fsize
+					have.fhash_sha256 = fhash_sha256
 
 
 				return have, fqfilename
@@ -423,9 +1216,11 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 		else:
 
 			new_row = self.db.ReleaseFile(
-					dirpath  = dirpath,
-					filename = filename,
-					fhash    = fhash
+					dirpath      = dirpath,
+					filename     = filename,
+					fhash        = fhash,
+					fsize        = fsize,
+					fhash_sha256 = fhash_sha256,
 				)
 
 			sess.add(new_row)
@@ -441,110 +1236,116 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 
 		chop = len(fileN)-4
 
-		while 1:
-			try:
-				with open(fqfilename, "wb") as fp:
-					fp.write(file_content)
+		try:
+			while 1:
+				try:
+					with open(fqfilename, "wb") as fp:
+						writer = MangaCMS.lib.HashingWriter.HashingFileWriter(fp)
+						writer.write(file_content)
 
-				file_row, have_fqp = self.get_create_file_row(sess, row, fqfilename)
-				row.fileid = file_row.id
+					file_row, have_fqp = self.get_create_file_row(sess, row, fqfilename,
+							fhash        = writer.hexdigest(),
+							fsize        = writer.size,
+							fhash_sha256 = writer.sha256_hexdigest(),
+						)
+					row.fileid = file_row.id
 
-				return have_fqp
-
-			except (IOError, OSError):
-				chop = chop - 1
-				filepath, fileN = os.path.split(fqfilename)
-
-				fileN = fileN[:chop]+fileN[-4:]
-				self.log.warn("Truncating file length to %s characters and re-encoding.", chop)
-				fileN = fileN.encode('utf-8','ignore').decode('utf-8')
-				fileN = nt.makeFilenameSafe(fileN)
-				fqfilename = os.path.join(filepath, fileN)
-				fqfilename = insertCountIfFilenameExists(fqfilename)
+					self._remember_hash(have_fqp, writer.hexdigest())
+					return have_fqp
 
+				except (IOError, OSError):
+					chop = chop - 1
+					filepath, fileN = os.path.split(fqfilename)
 
+					fileN = fileN[:chop]+fileN[-4:]
+					self.log.warn("Truncating file length to %s characters and re-encoding.", chop)
+					fileN = fileN.encode('utf-8','ignore').decode('utf-8')
+					fileN = nt.makeFilenameSafe(fileN)
+					fqfilename = os.path.join(filepath, fileN)
+					fqfilename = insertCountIfFilenameExists(fqfilename)
+		finally:
+			# Written out (or given up on), so the buffer no longer counts
+			# against the memory budget.
+			MangaCMS.lib.MemoryBudget.release(len(file_content))
 
 
-	def save_image_set(self, row, sess, fqfilename, image_list):
 
-		fqfilename = prep_check_fq_filename(fqfilename)
 
-		self.log.info("Saving to complete filepath: %s", fqfilename)
+	def image_sink(self, fqfilename):
+		'''
+		Open a streaming archive for `fqfilename`. Pages pushed into the returned
+		sink are written to disk immediately, so callers can add pages as they're
+		fetched rather than buffering an entire chapter. Pass the sink to
+		`save_image_sink()` once all pages have been added.
+		'''
+		return ImageArchiveSink(fqfilename, self.log)
 
-		filepath, fileN = os.path.split(fqfilename)
-		assert len(image_list) >= 1
-		chop = len(fileN)-4
+	def save_image_sink(self, row, sess, sink):
+		'''
+		Finalize a (fully populated) ImageArchiveSink, and attach the resulting
+		file to `row`. Returns the path of the file on disk (which may differ
+		from the sink path if the file turned out to be a binary duplicate).
+		'''
+		fqfilename = sink.finalize()
+		self._discard_cached_pages()
 
-		while 1:
-			try:
-				arch = zipfile.ZipFile(fqfilename, "w")
+		file_row, have_fqp = self.get_create_file_row(sess, row, fqfilename,
+				fhash        = sink.fhash,
+				fsize        = sink.fsize,
+				fhash_sha256 = sink.fhash_sha256,
+			)
+		row.fileid = file_row.id
 
+		self._remember_hash(have_fqp, sink.fhash)
+		return have_fqp
 
-				self.log.info("Saving %s images to archive %s", len(image_list), fqfilename)
-				for imageName, imageContent in image_list:
-					self.log.info("	Image: %s (%s bytes)", imageName, len(imageContent))
+	def _remember_hash(self, fqfilename, fhash):
+		'''
+		Keep the digest of an archive the current item just wrote, for
+		processDownload() to pick up, so nothing downstream has to read the
+		file back off disk just to hash it. Kept per-item, so digests an item
+		never got as far as processing go away with it.
+		'''
+		written_hashes = getattr(self._item_local, "written_hashes", None)
+		if written_hashes is not None:
+			written_hashes[fqfilename] = fhash
 
-				#Write all downloaded files to the archive.
-				for imageName, imageContent in image_list:
-					assert isinstance(imageName, str)
-					assert isinstance(imageContent, bytes)
-
-					mtype = magic.from_buffer(imageContent, mime=True)
-					if imageName.lower().endswith(".png") and mtype == 'application/octet-stream':
-						# So libmagic is somehow misidentifiying pngs as being of type
-						# 'application/octet-stream'. Anyways, short circut that specific case.
-						pass
-					else:
-						assert "image" in mtype.lower(), "Image not in mimetype ('%s') of file '%s'?" % (mtype, imageName)
-
-					_, ext = os.path.splitext(imageName)
-					fext = mimetypes.guess_extension(mtype)
-					if fext == '.jpe':
-						fext = ".jpg"
-					if ext == '.jpeg':
-						ext = ".jpg"
-					if fext == '.jpeg':
-						fext = ".jpg"
-
-					if not ext:
-						self.log.warning("Missing extension in archive file: %s", imageName)
-						self.log.warning("Appending guessed file-extension %s", fext)
-						imageName += fext
-					elif fext != ext:
-						self.log.warning("Archive file extension %s mismatches guessed extension: %s", (imageName, ext), fext)
-						self.log.warning("Appending guessed file-extension %s", fext)
-						imageName += fext
-
-
-					arch.writestr(imageName, imageContent)
-				arch.close()
-
-				file_row, have_fqp = self.get_create_file_row(sess, row, fqfilename)
-				row.fileid = file_row.id
-
-				return have_fqp
+	def _discard_cached_pages(self):
+		'''
+		The current item's pages are safely in an archive, so drop them from
+		the page cache.
+		'''
+		cached_pages = getattr(self._item_local, "cached_pages", None)
+		if not (self.page_cache and cached_pages):
+			return
+		for url in cached_pages:
+			self.page_cache.discard(url)
+		self.log.info("Dropped %s archived pages from the page cache", len(cached_pages))
+		del cached_pages[:]
 
-			except (IOError, OSError):
-				traceback.print_exc()
+	def save_image_set(self, row, sess, fqfilename, image_list):
+		'''
+		Write `image_list` (any iterable of (filename, content) tuples,
+		including generators) to an archive at `fqfilename`.
+		'''
 
+		self.log.info("Saving to complete filepath: %s", fqfilename)
 
-				chop = chop - 1
-				filepath, fileN = os.path.split(fqfilename)
+		with self.image_sink(fqfilename) as sink:
+			for imageName, imageContent in image_list:
+				sink.add_image(imageName, imageContent)
 
-				fileN = fileN[:chop]+fileN[-4:]
-				self.log.warn("Truncating file length to %s characters and re-encoding.", chop)
-				fileN = fileN.encode('utf-8','ignore').decode('utf-8')
-				fileN = nt.makeFilenameSafe(fileN)
-				fqfilename = os.path.join(filepath, fileN)
-				fqfilename = insertCountIfFilenameExists(fqfilename)
+			return self.save_image_sink(row, sess, sink)
 
 
 	def save_manga_image_set(self, row_id, series_name, chapter_name, image_list, source_name=None):
 			dlPath, newDir = self.locateOrCreateDirectoryForSeries(series_name)
 
-			with self.row_context(dbid=row_id) as row:
-				row.state = 'processing'
-				row.dirstate = 'created_dir' if newDir else "had_dir"
+			# The 'processing' transition is written along with the file row,
+			# and 'complete' as a single update, rather then each getting a
+			# session of their own.
+			job = self.download_job(row_id)
+			job.processing(dirstate = 'created_dir' if newDir else "had_dir")
 
 
 			chapName = chapter_name + (" [%s]" % source_name if source_name else "") + ".zip"
@@ -553,9 +1354,16 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 
 			self.log.info("Saving item to path: %s", fqFName)
 
-			with self.row_sess_context(dbid=row_id) as row_tup:
-				row, sess = row_tup
-				fqFName = self.save_image_set(row, sess, fqFName, image_list)
+			# image_list may be a generator that's fetching pages as it goes, so
+			# we only open the row session once the archive is fully written.
+			with self.image_sink(fqFName) as sink:
+				for imageName, imageContent in image_list:
+					sink.add_image(imageName, imageContent)
+
+				with self.row_sess_context(dbid=row_id) as row_tup:
+					row, sess = row_tup
+					job.apply(row)
+					fqFName = self.save_image_sink(row, sess, sink)
 
 			self.log.info("Processing download")
 			if self.is_manga:
@@ -567,16 +1375,21 @@ class RetreivalBase(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase):
 			else:
 				raise RuntimeError("Unknown type!")
 
-			with self.row_context(dbid=row_id) as row:
-				row.state         = 'complete'
-				row.downloaded_at = datetime.datetime.now()
-				row.last_checked  = datetime.datetime.now()
+			job.complete()
+			job.flush()
 			self.log.info("Download complete!")
 
 	def do_fetch_content(self):
 		if hasattr(self, 'setup'):
 			self.setup()
 
+		if self.use_work_claims:
+			if not self._process_claimed_links():
+				ret = self.mon_con.incr('fetched_items.count', 0)
+				self.log.info("No links to fetch. Sending null result: %s", ret)
+			self.log.info("ContentRetreiver for %s has finished.", self.plugin_name)
+			return
+
 		todo = self._retreiveTodoLinksFromDB()
 		if not runStatus.run:
 			return
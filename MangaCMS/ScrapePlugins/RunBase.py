@@ -70,6 +70,8 @@ class ScraperBase(metaclass=abc.ABCMeta):
 				last_error  = None,
 				run_time    = None,
 				last_output = None,
+				concurrency = None,
+				throughput  = None,
 			):
 		if pluginName is None:
 			pluginName = self.pluginName
@@ -90,6 +92,10 @@ class ScraperBase(metaclass=abc.ABCMeta):
 					have.run_time = run_time
 				if last_output is not None:
 					have.last_output = last_output
+				if concurrency is not None:
+					have.concurrency = concurrency
+				if throughput is not None:
+					have.throughput = throughput
 			else:
 				self.log.info("Plugin appears to be new. Adding initial row!")
 				new = db.PluginStatus(
@@ -99,6 +105,8 @@ class ScraperBase(metaclass=abc.ABCMeta):
 						last_error  = last_error,
 						run_time    = run_time,
 						last_output = last_output,
+						concurrency = concurrency,
+						throughput  = throughput,
 					)
 				sess.add(new)
 
@@ -146,3 +154,15 @@ class ScraperBase(metaclass=abc.ABCMeta):
 
 		cl = self.contentLoader()
 		cl.do_fetch_content()
+		self.record_concurrency(cl)
+
+	def record_concurrency(self, cl):
+		'''
+		Save the concurrency the content loader settled on (if it's tuning it),
+		and the throughput it got, in the plugin status table.
+		'''
+		if not getattr(cl, "concurrency", None):
+			return
+		self.log.info("Content loader finished at concurrency %s (peak %s), %0.2f items/minute",
+				cl.concurrency.limit, cl.concurrency.peak_limit, cl.concurrency.throughput())
+		self.update_status(concurrency=cl.concurrency.limit, throughput=cl.concurrency.throughput())
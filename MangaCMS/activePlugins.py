@@ -59,6 +59,9 @@ import MangaCMS.ScrapePlugins.H.NHentaiLoader.Run
 import MangaCMS.ScrapePlugins.H.HBrowseLoader.Run
 import MangaCMS.ScrapePlugins.B.BooksMadokami.Run
 
+import MangaCMS.cleaner.postProcessQueue
+import UploadPlugins.Madokami.uploadQueue
+
 # Convenience functions to make intervals clearer.
 def days(num):
 	return 60*60*24*num
@@ -74,6 +77,8 @@ def minutes(num):
 scrapePlugins = {
 	2   : (MangaCMSOld.ScrapePlugins.M.BuMonitor.Run,                       hours( 1)),
 	3   : (MangaCMSOld.ScrapePlugins.M.BuMonitor.Rescan,                    days(  7)),
+	4   : (MangaCMS.cleaner.postProcessQueue,                               minutes(5)),  # Drains the post-processing queue, if settings.postProcessQueue is on.
+	5   : (UploadPlugins.Madokami.uploadQueue,                              minutes(5)),  # Uploads queued files to Madokami.
 
 	11  : (MangaCMS.ScrapePlugins.M.McLoader.Run,                        hours(12)),  # every 12 hours, it's just a single scanlator site.
 	# 12  : (MangaCMSOld.ScrapePlugins.M.IrcGrabber.IrcEnqueueRun,            hours(12)),  # Queue up new items from IRC bots.
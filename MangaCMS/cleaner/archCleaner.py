@@ -56,6 +56,7 @@ class DamagedArchive(Exception):
 # (WIP)
 
 import MangaCMS.cleaner.processDownload
+import MangaCMS.lib.HashingWriter
 
 class ArchCleaner(object):
 
@@ -63,6 +64,9 @@ class ArchCleaner(object):
 	def __init__(self):
 		self.log = logging.getLogger(self.loggerPath)
 
+		# md5sums of any archives rebuilt by this cleaner, keyed by path.
+		self.rebuilt_hashes = {}
+
 		badIms = os.listdir(settings.badImageDir)
 
 		self.badHashes = []
@@ -160,10 +164,7 @@ class ArchCleaner(object):
 					archPath += ".zip"
 
 				self.log.info("Had advert. Rebuilding zip as '%s'.", archPath)
-				new_zfp = zipfile.ZipFile(archPath, "w")
-				for fileInfo, contents in files:
-					new_zfp.writestr(fileInfo, contents)
-				new_zfp.close()
+				self._write_zip(archPath, files)
 
 				if origPath != archPath:
 					os.remove(origPath)
@@ -234,10 +235,20 @@ class ArchCleaner(object):
 		# Now, recreate the zip file without the ad
 		self.log.info("Rebuilding zip without password.")
 
-		new_zfp = zipfile.ZipFile(zipPath, "w")
-		for fileInfo, contents in files:
-			new_zfp.writestr(fileInfo, contents)
-		new_zfp.close()
+		self._write_zip(zipPath, files)
+
+	def _write_zip(self, archPath, files):
+		'''
+		Write `files` to a new zip at `archPath`, hashing it as it's written.
+		'''
+		with open(archPath, "wb") as fp:
+			writer = MangaCMS.lib.HashingWriter.HashingFileWriter(fp)
+			new_zfp = zipfile.ZipFile(writer, "w")
+			for fileInfo, contents in files:
+				new_zfp.writestr(fileInfo, contents)
+			new_zfp.close()
+
+		self.rebuilt_hashes[archPath] = writer.hexdigest()
 
 
 	# Process a newly downloaded archive. If deleteDups is true, and the archive is duplicated, it is deleted.
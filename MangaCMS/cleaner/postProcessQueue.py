@@ -0,0 +1,245 @@
+
+# Durable queue of downloaded archives waiting for post-processing (archive
+# cleaning, dedup, upload), and the process pool that works through it.
+#
+# When `settings.postProcessQueue` is set, RetreivalBase.processDownload()
+# doesn't run DownloadProcessor inline on the fetch thread. Instead, the
+# call is recorded as a row in `post_process_jobs` (in the same transaction
+# that moves the release to 'processing'), and the Runner here picks it up,
+# runs it in a worker process, and marks the release 'complete'.
+
+import os
+import socket
+import uuid
+import logging
+import datetime
+import traceback
+import multiprocessing
+import concurrent.futures
+
+import sqlalchemy as sa
+
+import settings
+import runStatus
+
+import MangaCMS.db as db
+import MangaCMS.db.db_engine as db_engine
+import MangaCMS.cleaner.processDownload
+import MangaCMS.ScrapePlugins.RunBase
+
+
+def enqueue(sess, release_id=None, **kwargs):
+	'''
+	Queue a processDownload(**kwargs) call, in `sess`. `release_id` is the
+	release row to mark complete once it's done.
+
+	Returns the ID of the new job.
+	'''
+	job = db.PostProcessJob(
+			plugin_name  = kwargs.pop('plugin_name'),
+			pron         = kwargs.pop('pron', False),
+			release_id   = release_id,
+			archive_path = kwargs.pop('archivePath'),
+			series_name  = kwargs.pop('seriesName', None) or None,
+			do_upload    = bool(kwargs.pop('doUpload', True)),
+			fhash        = kwargs.pop('fhash', None),
+			extra_args   = kwargs or None,
+		)
+	sess.add(job)
+	sess.flush()
+	return job.id
+
+
+def _finish_job(job_id, max_attempts, result_tags=None, err_str=None):
+	'''
+	Record the outcome of a job, and move its release on from 'processing'.
+	Failed jobs are requeued until they've been tried `max_attempts` times.
+	'''
+	now = datetime.datetime.now()
+	with db.session_context() as sess:
+		job = sess.query(db.PostProcessJob).get(job_id)
+		release_table = db.HentaiReleases if job.pron else db.MangaReleases
+
+		job.lease_owner   = None
+		job.lease_expires = None
+
+		if err_str is None:
+			job.state       = 'complete'
+			job.result_tags = result_tags
+			job.finished_at = now
+			release_vals = {'state' : 'complete', 'last_checked' : now}
+		elif job.attempts < max_attempts:
+			job.state   = 'queued'
+			job.err_str = err_str
+			return
+		else:
+			job.state       = 'error'
+			job.err_str     = err_str
+			job.finished_at = now
+			release_vals = {'state' : 'error', 'err_str' : err_str}
+
+		if job.release_id:
+			tbl = release_table.__table__
+			sess.execute(
+					tbl.update()
+						.where(tbl.c.id == job.release_id)
+						.where(tbl.c.state == 'processing')
+						.values(**release_vals)
+				)
+
+
+def _init_worker():
+	# The worker was forked with the parent's pooled DB connections. Drop them
+	# (without closing them out from under the parent), so it makes its own.
+	try:
+		db_engine.engine.dispose(close=False)
+	except TypeError:
+		# SQLAlchemy < 1.4.33 has no `close` argument.
+		db_engine.engine.dispose()
+
+
+def run_job(job_id, max_attempts):
+	'''
+	Process a single job. Runs in a worker process.
+	'''
+	log = logging.getLogger("Main.PostProcess")
+
+	with db.session_context(commit=False) as sess:
+		job = sess.query(db.PostProcessJob).get(job_id)
+		kwargs = dict(job.extra_args or {})
+		kwargs.update(
+				plugin_name = job.plugin_name,
+				pron        = job.pron,
+				archivePath = job.archive_path,
+				seriesName  = job.series_name,
+				doUpload    = job.do_upload,
+				fhash       = job.fhash,
+			)
+
+	log.info("Post-processing job %s: %s", job_id, kwargs['archivePath'])
+	try:
+		result_tags = MangaCMS.cleaner.processDownload.processDownload(**kwargs)
+	except Exception:
+		log.error("Post-processing job %s failed!", job_id)
+		for line in traceback.format_exc().split("\n"):
+			log.error("	%s", line)
+		_finish_job(job_id, max_attempts, err_str=traceback.format_exc())
+		return False
+
+	_finish_job(job_id, max_attempts, result_tags=result_tags or "")
+	return True
+
+
+class PostProcessQueue(object):
+	'''
+	Drains `post_process_jobs` through a pool of `workers` processes.
+
+	Jobs are claimed a few at a time under a lease (the same way
+	RetreivalBase.claim_todo_links() claims releases), so several
+	queue runners can share the work, and jobs held by a runner that
+	died are picked up again once the lease runs out.
+	'''
+
+	lease_time   = datetime.timedelta(hours=1)
+	max_attempts = 3
+
+	def __init__(self, workers=None):
+		self.log         = logging.getLogger("Main.PostProcess")
+		self.workers     = workers or getattr(settings, "postProcessWorkers", 4)
+		self.lease_owner = "%s-%s-%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+	def claim(self, limit):
+		tbl = db.PostProcessJob.__table__
+
+		candidates = sa.select([tbl.c.id])                                  \
+			.where(sa.or_(
+					tbl.c.state == 'queued',
+					sa.and_(
+						tbl.c.state == 'running',
+						tbl.c.lease_expires < sa.func.now(),
+					)
+				))                                                          \
+			.order_by(tbl.c.created_at)                                     \
+			.limit(limit)                                                   \
+			.with_for_update(skip_locked=True)
+
+		stmt = tbl.update()                                                 \
+			.where(tbl.c.id.in_(candidates))                                \
+			.values(
+					state         = 'running',
+					attempts      = tbl.c.attempts + 1,
+					lease_owner   = self.lease_owner,
+					lease_expires = sa.func.now() + self.lease_time,
+				)                                                           \
+			.returning(tbl.c.id)
+
+		with db.session_context() as sess:
+			return [job_id for job_id, in sess.execute(stmt)]
+
+	def _submit(self, pool, job_id):
+		return pool.submit(run_job, job_id, self.max_attempts)
+
+	def run(self):
+		'''
+		Process jobs until the queue is empty, or we're told to stop.
+		Returns the number of jobs processed.
+		'''
+		processed = 0
+		pending = {}
+
+		pool = concurrent.futures.ProcessPoolExecutor(
+				max_workers = self.workers,
+				mp_context  = multiprocessing.get_context("fork"),
+				initializer = _init_worker,
+			)
+		try:
+			while runStatus.run:
+				free = self.workers - len(pending)
+				if free:
+					for job_id in self.claim(free):
+						pending[self._submit(pool, job_id)] = job_id
+
+				if not pending:
+					break
+
+				done, _ = concurrent.futures.wait(pending, timeout=5, return_when=concurrent.futures.FIRST_COMPLETED)
+				for fut in done:
+					job_id = pending.pop(fut)
+					processed += 1
+					try:
+						fut.result()
+					except Exception:
+						# The worker itself fell over (rather than the job raising,
+						# which run_job() handles), so the outcome was never recorded.
+						self.log.error("Worker for post-processing job %s died!", job_id)
+						for line in traceback.format_exc().split("\n"):
+							self.log.error("	%s", line)
+						_finish_job(job_id, self.max_attempts, err_str=traceback.format_exc())
+
+		finally:
+			pool.shutdown(wait=True)
+
+		self.log.info("Post-processing queue runner processed %s jobs", processed)
+		return processed
+
+
+class Runner(MangaCMS.ScrapePlugins.RunBase.ScraperBase):
+	loggerPath = "Main.PostProcess.Run"
+
+	pluginName = "PostProcessQueue"
+
+	# Not a scraper, so there's nothing to load feeds or content with.
+	feedLoader    = None
+	contentLoader = None
+
+	def _go(self):
+		PostProcessQueue().run()
+
+
+if __name__ == "__main__":
+	import utilities.testBase as tb
+
+	with tb.testSetup():
+
+		run = Runner()
+		run.go()
@@ -9,7 +9,8 @@ import runStatus
 import deduplicator.archChecker
 import MangaCMS.ScrapePlugins.MangaScraperBase
 import MangaCMS.cleaner.archCleaner as ac
-import UploadPlugins.Madokami.uploader as up
+import MangaCMS.lib.HashingWriter
+import UploadPlugins.Madokami.uploadQueue as ulq
 
 PHASH_DISTANCE = 4
 
@@ -29,7 +30,7 @@ class DownloadProcessor(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase
 	plugin_key  = None
 	plugin_type = 'Utility'
 
-	def _create_or_update_file_entry_path(self, oldPath, newPath, setDeleted=False, setDuplicate=False, setPhash=False, reuse_sess=None):
+	def _create_or_update_file_entry_path(self, oldPath, newPath, setDeleted=False, setDuplicate=False, setPhash=False, reuse_sess=None, new_fhash=None):
 		oldItemRoot, oldItemFile = os.path.split(oldPath)
 		newItemRoot, newItemFile = os.path.split(newPath)
 
@@ -47,10 +48,8 @@ class DownloadProcessor(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase
 				.scalar()
 
 			if not new_row:
-				hash_md5 = hashlib.md5()
-				with open(newPath, "rb") as f:
-					hash_md5.update(f.read())
-				fhash = hash_md5.hexdigest()
+				# Only go back to the disk if the caller doesn't already know the hash
+				fhash = new_fhash or MangaCMS.lib.HashingWriter.hash_file(newPath)
 
 				# Use an existing file row (if present), via the md5sum
 				new_row = sess.query(self.db.ReleaseFile)          \
@@ -123,11 +122,11 @@ class DownloadProcessor(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase
 					release.phash_duplicate = setPhash
 
 
-	def _crossLink(self, delItem, dupItem, isPhash=False):
+	def _crossLink(self, delItem, dupItem, isPhash=False, dupHash=None):
 		self.log.warning("Duplicate found! Cross-referencing file")
 		for x in range(5):
 			try:
-				self._create_or_update_file_entry_path(delItem, dupItem, setDeleted=True, setPhash=isPhash)
+				self._create_or_update_file_entry_path(delItem, dupItem, setDeleted=True, setPhash=isPhash, new_fhash=dupHash)
 				return
 			except Exception:
 				self.log.warning("Retrying file link operation")
@@ -141,8 +140,15 @@ class DownloadProcessor(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase
 				pathPositiveFilter = None,
 				crossReference     = True,
 				doUpload           = True,
+				fhash              = None,
 				**kwargs
 			):
+		'''
+		`fhash` is the md5 of `archivePath`, if the caller already has it
+		(e.g. because it was computed while the file was being written).
+		It's tracked through any rebuilding of the archive, and used in
+		place of re-reading the file whenever a row has to be created for it.
+		'''
 
 		if self.mon_con:
 			self.mon_con.incr('processed-download', 1)
@@ -171,8 +177,14 @@ class DownloadProcessor(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase
 			archCleaner = MangaCMS.cleaner.archCleaner.ArchCleaner()
 			try:
 				retTags, archivePath_updated = archCleaner.processNewArchive(archivePath, **kwargs)
+
+				# If the cleaner rebuilt the archive, any hash we were passed is stale,
+				# but the cleaner hashed the new file as it wrote it.
+				if archivePath_updated in archCleaner.rebuilt_hashes:
+					fhash = archCleaner.rebuilt_hashes[archivePath_updated]
+
 				if archivePath_updated != archivePath:
-					self._crossLink(archivePath, archivePath_updated)
+					self._crossLink(archivePath, archivePath_updated, dupHash=fhash)
 					archivePath = archivePath_updated
 
 			except Exception:
@@ -194,9 +206,9 @@ class DownloadProcessor(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase
 
 			phashThresh = phashThreshIn
 
+			dc = deduplicator.archChecker.ArchChecker(archivePath, phashDistance=phashThresh, pathPositiveFilter=pathPositiveFilter, lock=False)
 			while True:
-				dc = deduplicator.archChecker.ArchChecker(archivePath, phashDistance=phashThresh, pathPositiveFilter=pathPositiveFilter, lock=False)
-				retTagsTmp, bestMatch, intersections = dc.process(moveToPath=moveToPath)
+				retTagsTmp, bestMatch, intersections = dc.process(moveToPath=moveToPath, phashDistance=phashThresh)
 
 				if 'deleted' in retTagsTmp:
 					self.mon_con.incr('deleted-archive', 1)
@@ -233,17 +245,18 @@ class DownloadProcessor(MangaCMS.ScrapePlugins.MangaScraperBase.MangaScraperBase
 			# Since we don't want to upload archives that are either, we skip if retTags is anything other then ""
 			# Also, don't upload porn
 			if self.is_manga and (not retTags or retTags=="fewfiles") and seriesName and doUpload:
+				# The upload itself happens in the background (see UploadPlugins.Madokami.uploadQueue),
+				# so the tag (and the monitoring counter) is "upload-queued" rather than the
+				# old "uploaded". Nothing in the tree matches on the old tag. Whether the file
+				# actually made it up is in release_files.mk_upload_state (and the releases'
+				# `uploaded` flag) once the queue is done with it.
 				try:
-					self.log.info("Trying to upload file '%s'.", archivePath)
-					up.uploadFile(seriesName, archivePath)
-					retTags += " uploaded"
-					self.mon_con.incr('uploaded', 1)
-				except ConnectionRefusedError:
-					self.log.warning("Uploading file failed! Connection Refused!")
-					for line in traceback.format_exc().split("\n"):
-						self.log.error("	%s", line)
+					self.log.info("Queueing file '%s' for upload.", archivePath)
+					if ulq.enqueue(seriesName, archivePath):
+						retTags += " upload-queued"
+						self.mon_con.incr('upload-queued', 1)
 				except Exception:
-					self.log.error("Uploading file failed! Unknown Error!")
+					self.log.error("Queueing file for upload failed!")
 					for line in traceback.format_exc().split("\n"):
 						self.log.error("	%s", line)
 			else:
@@ -9,6 +9,10 @@ from .db_models import MangaTags
 from .db_models import HentaiTags
 from .db_models import ReleaseFile
 from .db_models import PluginStatus
+from .db_models import RateLimitBucket
+from .db_models import PostProcessJob
+from .db_models import MkUploadJob
+from .db_models import MkRemoteDir
 
 from .db_models import manga_files_tags_link
 from .db_models import manga_releases_tags_link
@@ -16,9 +20,13 @@ from .db_models import manga_releases_tags_link
 from .db_models import hentai_files_tags_link
 from .db_models import hentai_releases_tags_link
 
+from .db_tags import TagRegistry
+
 from .db_types import dlstate_enum
 from .db_types import file_type
 from .db_types import dir_type
+from .db_types import postproc_state_enum
+from .db_types import upload_state_enum
 
 from .db_base import Base
 
@@ -8,6 +8,7 @@ from sqlalchemy import Index
 from sqlalchemy import Column
 from sqlalchemy import Integer
 from sqlalchemy import BigInteger
+from sqlalchemy import Float
 from sqlalchemy import Text
 from sqlalchemy import Interval
 from sqlalchemy import Boolean
@@ -29,10 +30,13 @@ ischema_names['citext'] = citext.CIText
 
 
 from .db_engine import _session_factory
+from .db_tags import TagRegistry
 from .db_base import Base
 from .db_types import file_type
 from .db_types import dir_type
 from .db_types import dlstate_enum
+from .db_types import postproc_state_enum
+from .db_types import upload_state_enum
 
 
 ########################################################################################
@@ -62,19 +66,13 @@ class MangaTags(Base):
 
 	@classmethod
 	def get_or_create(cls, tag):
-		tmp = _session_factory.query(cls)    \
-			.filter(cls.tag == tag) \
-			.scalar()
-		if tmp:
-			_session_factory.expunge(tmp)
-			return tmp
-
-		# print("manga_tag_creator", tag)
-		tmp = cls(tag=tag)
-		_session_factory.add(tmp)
-		_session_factory.commit()
-		_session_factory.expunge(tmp)
-		return tmp
+		# The id comes out of the tag registry (cached, or created in the
+		# thread's session if needed), so this only queries for the tag row
+		# if it isn't already in the session's identity map.
+		sess = _session_factory()
+		return sess.query(cls).get(cls.registry.resolve_one(sess, tag))
+
+MangaTags.registry = TagRegistry(MangaTags)
 
 ########################################################################################
 
@@ -103,19 +101,13 @@ class HentaiTags(Base):
 
 	@classmethod
 	def get_or_create(cls, tag):
-		tmp = _session_factory.query(cls)    \
-			.filter(cls.tag == tag) \
-			.scalar()
-		if tmp:
-			_session_factory.expunge(tmp)
-			return tmp
+		# The id comes out of the tag registry (cached, or created in the
+		# thread's session if needed), so this only queries for the tag row
+		# if it isn't already in the session's identity map.
+		sess = _session_factory()
+		return sess.query(cls).get(cls.registry.resolve_one(sess, tag))
 
-		# print("hentai_tag_creator", tag)
-		tmp = cls(tag=tag)
-		_session_factory.add(tmp)
-		_session_factory.commit()
-		_session_factory.expunge(tmp)
-		return tmp
+HentaiTags.registry = TagRegistry(HentaiTags)
 
 
 ########################################################################################
@@ -146,9 +138,17 @@ class MangaReleases(Base):
 
 	additional_metadata = Column(sqlalchemy_jsonfield.JSONField())
 
-	fileid              = Column(BigInteger, ForeignKey('release_files.id'))
+	fileid              = Column(BigInteger, ForeignKey('release_files.id'), index=True)
 	file                = relationship('ReleaseFile', backref='manga_releases')
 
+	# Work-claim lease (see RetreivalBase.claim_todo_links())
+	lease_owner         = Column(Text)
+	lease_expires       = Column(DateTime)
+
+	# Retry scheduling for errored rows (see RetreivalBase.schedule_retry())
+	retry_count         = Column(Integer, nullable=False, default=0, server_default='0')
+	next_retry_at       = Column(DateTime)
+
 	tags_rel       = relationship('MangaTags',
 										secondary        = manga_releases_tags_link,
 										backref          = backref("manga_releases", lazy='dynamic'),
@@ -157,7 +157,9 @@ class MangaReleases(Base):
 
 	__table_args__ = (
 			UniqueConstraint('source_site', 'source_id'),
-			Index('manga_releases_source_site_id_idx', 'source_site', 'source_id')
+			Index('manga_releases_source_site_id_idx', 'source_site', 'source_id'),
+			Index('manga_releases_new_todo_idx', source_site, posted_at.desc(), postgresql_where=(state == 'new')),
+			Index('manga_releases_retry_todo_idx', source_site, next_retry_at, postgresql_where=(state == 'error')),
 		)
 
 
@@ -191,6 +193,14 @@ class HentaiReleases(Base):
 	fileid              = Column(BigInteger, ForeignKey('release_files.id'))
 	file                = relationship('ReleaseFile', backref='hentai_releases')
 
+	# Work-claim lease (see RetreivalBase.claim_todo_links())
+	lease_owner         = Column(Text)
+	lease_expires       = Column(DateTime)
+
+	# Retry scheduling for errored rows (see RetreivalBase.schedule_retry())
+	retry_count         = Column(Integer, nullable=False, default=0, server_default='0')
+	next_retry_at       = Column(DateTime)
+
 	tags_rel       = relationship('HentaiTags',
 										secondary=hentai_releases_tags_link,
 										backref=backref("hentai_releases", lazy='dynamic'),
@@ -199,7 +209,9 @@ class HentaiReleases(Base):
 
 	__table_args__ = (
 			UniqueConstraint('source_site', 'source_id'),
-			Index('hentai_releases_source_site_id_idx', 'source_site', 'source_id')
+			Index('hentai_releases_source_site_id_idx', 'source_site', 'source_id'),
+			Index('hentai_releases_new_todo_idx', source_site, posted_at.desc(), postgresql_where=(state == 'new')),
+			Index('hentai_releases_retry_todo_idx', source_site, next_retry_at, postgresql_where=(state == 'error')),
 		)
 
 
@@ -232,9 +244,19 @@ class BookReleases(Base):
 	fileid              = Column(BigInteger, ForeignKey('release_files.id'))
 	file                = relationship('ReleaseFile', backref='book_releases')
 
+	# Work-claim lease (see RetreivalBase.claim_todo_links())
+	lease_owner         = Column(Text)
+	lease_expires       = Column(DateTime)
+
+	# Retry scheduling for errored rows (see RetreivalBase.schedule_retry())
+	retry_count         = Column(Integer, nullable=False, default=0, server_default='0')
+	next_retry_at       = Column(DateTime)
+
 	__table_args__ = (
 			UniqueConstraint('source_site', 'source_id'),
-			Index('book_releases_source_site_id_idx', 'source_site', 'source_id')
+			Index('book_releases_source_site_id_idx', 'source_site', 'source_id'),
+			Index('book_releases_new_todo_idx', source_site, posted_at.desc(), postgresql_where=(state == 'new')),
+			Index('book_releases_retry_todo_idx', source_site, next_retry_at, postgresql_where=(state == 'error')),
 		)
 
 
@@ -248,10 +270,19 @@ class ReleaseFile(Base):
 	fhash          = Column(Text, nullable=False, index=True)
 	file_type      = Column(file_type, nullable=False, default="unknown")
 
+	# Only known for files written (or hashed) since these columns were added.
+	fsize          = Column(BigInteger)
+	fhash_sha256   = Column(Text)
+
 	was_duplicate       = Column(Boolean, default=False, nullable=False)
 
 	last_dup_check = Column(DateTime, nullable=False, default=datetime.datetime.min)
 
+	# Madokami upload status (see UploadPlugins.Madokami.uploadQueue). NULL for
+	# files that were never slated for upload.
+	mk_upload_state = Column(upload_state_enum)
+	mk_uploaded_at  = Column(DateTime)
+
 	manga_tags_rel       = relationship('MangaTags',
 										secondary=manga_files_tags_link,
 										backref=backref("release_files", lazy='dynamic'),
@@ -269,9 +300,107 @@ class ReleaseFile(Base):
 	__table_args__ = (
 			UniqueConstraint('dirpath', 'filename'),
 			UniqueConstraint('fhash'),
+			Index('release_files_mk_upload_pending_idx', 'id', postgresql_where=(mk_upload_state == 'pending')),
+		)
+
+
+
+class RateLimitBucket(Base):
+	'''
+	Shared per-host token buckets. See MangaCMS.lib.RateLimit.SharedTokenBucket.
+	'''
+	__tablename__ = 'rate_limit_buckets'
+	host           = Column(Text, primary_key=True)
+	tokens         = Column(Float, nullable=False, default=0)
+	byte_tokens    = Column(Float, nullable=False, default=0)
+	updated_at     = Column(DateTime, nullable=False)
+
+
+class PostProcessJob(Base):
+	'''
+	Downloaded archives waiting for (or undergoing) post-processing.
+	See MangaCMS.cleaner.postProcessQueue.
+	'''
+	__tablename__ = 'post_process_jobs'
+	id             = Column(BigInteger, primary_key=True)
+	state          = Column(postproc_state_enum, nullable=False, default='queued')
+
+	plugin_name    = Column(Text, nullable=False)
+	pron           = Column(Boolean, nullable=False, default=False)
+
+	# The release row to mark complete once the job is done (if any).
+	release_id     = Column(BigInteger)
+
+	archive_path   = Column(Text, nullable=False)
+	series_name    = Column(Text)
+	do_upload      = Column(Boolean, nullable=False, default=False)
+	fhash          = Column(Text)
+
+	# Any other keyword arguments to processDownload().
+	extra_args     = Column(sqlalchemy_jsonfield.JSONField())
+
+	attempts       = Column(Integer, nullable=False, default=0)
+	result_tags    = Column(Text)
+	err_str        = Column(Text)
+
+	created_at     = Column(DateTime, nullable=False, default=datetime.datetime.now)
+	finished_at    = Column(DateTime)
+
+	lease_owner    = Column(Text)
+	lease_expires  = Column(DateTime)
+
+	__table_args__ = (
+			Index('post_process_jobs_todo_idx', state, created_at, postgresql_where=(state.in_(['queued', 'running']))),
+			Index('post_process_jobs_pending_release_idx', release_id, postgresql_where=(state.in_(['queued', 'running']))),
+		)
+
+
+class MkUploadJob(Base):
+	'''
+	Files waiting to be uploaded to Madokami.
+	See UploadPlugins.Madokami.uploadQueue.
+	'''
+	__tablename__ = 'mk_upload_queue'
+	id             = Column(BigInteger, primary_key=True)
+	state          = Column(postproc_state_enum, nullable=False, default='queued')
+
+	series_name    = Column(Text, nullable=False)
+	file_path      = Column(Text, nullable=False, unique=True)
+	remote_path    = Column(Text)
+
+	attempts       = Column(Integer, nullable=False, default=0)
+	next_attempt   = Column(DateTime, nullable=False, default=datetime.datetime.now)
+	err_str        = Column(Text)
+
+	created_at     = Column(DateTime, nullable=False, default=datetime.datetime.now)
+	finished_at    = Column(DateTime)
+
+	lease_owner    = Column(Text)
+	lease_expires  = Column(DateTime)
+
+	__table_args__ = (
+			Index('mk_upload_queue_todo_idx', next_attempt, postgresql_where=(state.in_(['queued', 'running']))),
 		)
 
 
+class MkRemoteDir(Base):
+	'''
+	Local index of the directory tree on the Madokami server.
+	See UploadPlugins.Madokami.remoteIndex.
+	'''
+	__tablename__ = 'mk_remote_dirs'
+	path           = Column(Text, primary_key=True)
+	parent         = Column(Text, nullable=False, index=True)
+	name           = Column(Text, nullable=False)
+
+	canon_name     = Column(Text)
+	match_name     = Column(Text, index=True)
+
+	# Remote mtime as of the last time the directory was listed, or NULL if
+	# it's never been listed (or we've changed it since).
+	mtime          = Column(DateTime)
+	seen_at        = Column(DateTime, nullable=False, default=datetime.datetime.now)
+
 
 class PluginStatus(Base):
 	__tablename__ = 'plugin_status'
@@ -285,4 +414,9 @@ class PluginStatus(Base):
 	last_error     = Column(DateTime, nullable=False, default=datetime.datetime.min)
 	run_time       = Column(Interval, nullable=False, default=datetime.timedelta)
 
+	# Retrieval concurrency chosen by the AIMD controller on the last run, and
+	# the resulting throughput (items/minute).
+	concurrency    = Column(Integer)
+	throughput     = Column(Float)
+
 
@@ -0,0 +1,149 @@
+
+import logging
+import threading
+import collections
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+class TagRegistry(object):
+	'''
+	Tag text -> tag id lookups for one of the tags tables, with a process-local
+	LRU in front of the database.
+
+	Tags that aren't cached are resolved in bulk, in the caller's session: an
+	`INSERT ... ON CONFLICT (tag) DO NOTHING RETURNING` for the lot, then one
+	SELECT for the ones that already existed. Working in the caller's
+	transaction means the new tag rows are visible to it (the engine runs
+	at REPEATABLE READ, so rows committed by a separate transaction may not
+	be), and link rows pointing at them pass the foreign key check. A
+	concurrent insert of the same tag surfaces as a serialization failure
+	in the caller's transaction, like any other conflicting write.
+
+	Ids are only added to the cache once the session commits, so an id from
+	a transaction that's rolled back is never handed out.
+
+	The tag column is citext, so everything is keyed by the lower-cased tag.
+	Tags are never deleted during normal operation. If one is removed by hand
+	(e.g. utilities/cleanDb.py), call `invalidate()`.
+	'''
+
+	def __init__(self, tag_table, max_size=100000):
+		self.log       = logging.getLogger("Main.TagRegistry")
+		self.tag_table = tag_table
+		self.max_size  = max_size
+
+		self.lock      = threading.Lock()
+		self.cache     = collections.OrderedDict()
+
+	def _cache_get(self, key):
+		with self.lock:
+			tag_id = self.cache.get(key)
+			if tag_id is not None:
+				self.cache.move_to_end(key)
+			return tag_id
+
+	def _cache_put(self, key, tag_id):
+		with self.lock:
+			self.cache[key] = tag_id
+			self.cache.move_to_end(key)
+			while len(self.cache) > self.max_size:
+				self.cache.popitem(last=False)
+
+	def invalidate(self):
+		with self.lock:
+			self.cache.clear()
+
+	def _pending(self, sess):
+		'''
+		Ids resolved in `sess`'s current transaction, waiting for it to commit
+		before they go in the cache.
+		'''
+		key = ("tag_registry_pending", id(self))
+		if key not in sess.info:
+			sess.info[key] = {}
+
+			def on_commit(session):
+				pending = session.info.get(key) or {}
+				for tag_key, tag_id in pending.items():
+					self._cache_put(tag_key, tag_id)
+				pending.clear()
+
+			def on_rollback(session):
+				pending = session.info.get(key)
+				if pending:
+					pending.clear()
+
+			sa.event.listen(sess, "after_commit",   on_commit)
+			sa.event.listen(sess, "after_rollback", on_rollback)
+
+		return sess.info[key]
+
+	def resolve(self, sess, tags):
+		'''
+		Return a dict mapping the lower-cased form of each tag in `tags` to its
+		id, creating any tags that don't exist yet in `sess`'s transaction.
+		'''
+		ret    = {}
+		misses = {}
+		for tag in tags:
+			key = tag.lower()
+			tag_id = self._cache_get(key)
+			if tag_id is None:
+				misses[key] = tag
+			else:
+				ret[key] = tag_id
+
+		if not misses:
+			return ret
+
+		tbl = self.tag_table.__table__
+		stmt = postgresql.insert(tbl)                                     \
+			.values([{'tag' : tag} for tag in sorted(misses.values())])     \
+			.on_conflict_do_nothing(index_elements=['tag'])                 \
+			.returning(tbl.c.id, tbl.c.tag)
+		found = sess.execute(stmt).fetchall()
+
+		# The ones that weren't inserted already exist.
+		have     = set(tag.lower() for _, tag in found)
+		existing = [tag for key, tag in misses.items() if key not in have]
+		if existing:
+			found += sess.execute(sa.select([tbl.c.id, tbl.c.tag]).where(tbl.c.tag.in_(existing))).fetchall()
+
+		pending = self._pending(sess)
+		for tag_id, tag in found:
+			ret[tag.lower()] = tag_id
+			pending[tag.lower()] = tag_id
+
+		missing = [tag for key, tag in misses.items() if key not in ret]
+		assert not missing, "Tags %s could neither be inserted nor found in %s!" % (missing, tbl.name)
+
+		return ret
+
+	def resolve_one(self, sess, tag):
+		return self.resolve(sess, [tag])[tag.lower()]
+
+	def link(self, sess, link_table, owner_tags):
+		'''
+		Attach tags to rows through `link_table` (one of the *_tags_link tables),
+		as a single bulk insert. `owner_tags` is a dict of {row id : [tags]}.
+		Links that already exist are left alone.
+		Returns the number of link rows added.
+		'''
+		tag_ids = self.resolve(sess, set(tag for tags in owner_tags.values() for tag in tags))
+
+		links = set(
+				(owner_id, tag_ids[tag.lower()])
+			for
+				owner_id, tags in owner_tags.items()
+			for
+				tag in tags
+			)
+		if not links:
+			return 0
+
+		stmt = postgresql.insert(link_table)                                        \
+			.values([{'releases_id' : owner_id, 'tags_id' : tag_id} for owner_id, tag_id in links]) \
+			.on_conflict_do_nothing()
+		return sess.execute(stmt).rowcount
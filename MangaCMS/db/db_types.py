@@ -5,3 +5,5 @@ dlstate_enum   = ENUM('new', 'fetching', 'processing', 'complete', 'error', 'rem
 dir_type       = ENUM('had_dir', 'created_dir', 'unknown', name='dirtype_enum')
 file_type      = ENUM('manga', 'hentai', 'unknown', name='filetype_enum')
 
+postproc_state_enum = ENUM('queued', 'running', 'complete', 'error', name='postproc_state_enum')
+upload_state_enum   = ENUM('pending', 'uploaded', 'skipped', name='upload_state_enum')
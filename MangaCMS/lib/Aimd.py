@@ -0,0 +1,117 @@
+
+import time
+import logging
+import threading
+import contextlib
+
+
+class AimdController(object):
+	'''
+	Additive-increase/multiplicative-decrease control of how many fetches a
+	plugin has in flight at once.
+
+	`slot()` blocks until there are fewer than `limit` fetches running. Each
+	fetch then reports how it went:
+
+	 - Every `limit` consecutive successes (roughly one "round" at the current
+	   concurrency) raise the limit by one, up to `max_limit`.
+	 - An error, a rate-limit response, or latency drifting well above the
+	   fastest we've seen (`latency_factor` times the best smoothed latency)
+	   multiplies the limit by `decrease`, down to `min_limit`. Only one
+	   decrease is applied per round, since the fetches that were already in
+	   flight when things went bad will tend to fail together.
+	'''
+
+	def __init__(self, min_limit, max_limit, initial=None, decrease=0.5, latency_factor=2.0, log=None):
+		assert 1 <= min_limit <= max_limit, "Invalid concurrency bounds (%s, %s)" % (min_limit, max_limit)
+
+		self.log            = log or logging.getLogger("Main.Aimd")
+		self.min_limit      = min_limit
+		self.max_limit      = max_limit
+		self.limit          = max(min_limit, min(max_limit, initial or min_limit))
+		self.decrease       = decrease
+		self.latency_factor = latency_factor
+
+		self.cond           = threading.Condition()
+		self.in_flight      = 0
+		self.successes      = 0
+		self.last_decrease  = 0
+
+		self.latency_ewma   = None
+		self.best_latency   = None
+
+		self.started        = time.monotonic()
+		self.completed      = 0
+		self.failed         = 0
+		self.peak_limit     = self.limit
+
+	@contextlib.contextmanager
+	def slot(self):
+		with self.cond:
+			while self.in_flight >= self.limit:
+				self.cond.wait()
+			self.in_flight += 1
+		try:
+			yield
+		finally:
+			with self.cond:
+				self.in_flight -= 1
+				self.cond.notify_all()
+
+	def _set_limit(self, limit, reason):
+		limit = max(self.min_limit, min(self.max_limit, limit))
+		if limit != self.limit:
+			self.log.info("Concurrency %s -> %s (%s)", self.limit, limit, reason)
+			self.limit = limit
+			self.peak_limit = max(self.peak_limit, limit)
+			self.cond.notify_all()
+
+	def _back_off(self, reason):
+		now = time.monotonic()
+		# Fetches complete roughly `limit` at a time, so use the time it takes to
+		# get through one round as the minimum spacing between decreases.
+		round_time = (self.latency_ewma or 0)
+		if now - self.last_decrease < round_time:
+			return
+		self.last_decrease = now
+		self.successes = 0
+		self._set_limit(int(self.limit * self.decrease), reason)
+
+	def on_success(self, latency):
+		with self.cond:
+			self.completed += 1
+
+			if self.latency_ewma is None:
+				self.latency_ewma = latency
+			else:
+				self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency
+			if self.best_latency is None or self.latency_ewma < self.best_latency:
+				self.best_latency = self.latency_ewma
+
+			if self.latency_ewma > self.best_latency * self.latency_factor:
+				self._back_off("latency %0.1fs, best %0.1fs" % (self.latency_ewma, self.best_latency))
+				return
+
+			self.successes += 1
+			if self.successes >= self.limit:
+				self.successes = 0
+				self._set_limit(self.limit + 1, "%s fetches ok" % self.limit)
+
+	def on_error(self):
+		with self.cond:
+			self.failed += 1
+			self._back_off("fetch error")
+
+	def on_limited(self):
+		with self.cond:
+			self.failed += 1
+			self._back_off("rate limited")
+
+	def throughput(self):
+		'''
+		Successfully fetched items per minute since the controller was created.
+		'''
+		elapsed = time.monotonic() - self.started
+		if elapsed <= 0:
+			return 0.0
+		return self.completed * 60.0 / elapsed
@@ -0,0 +1,88 @@
+
+import os.path
+import hashlib
+
+# Read size for hashing files already on disk.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file(filepath):
+	'''
+	MD5sum a file on disk, reading it in fixed size chunks.
+	'''
+	hash_md5 = hashlib.md5()
+	with open(filepath, "rb") as f:
+		for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+			hash_md5.update(chunk)
+	return hash_md5.hexdigest()
+
+def digest_file(filepath):
+	'''
+	Compute the (md5, sha256, size) of a file on disk in a single pass.
+	'''
+	hash_md5    = hashlib.md5()
+	hash_sha256 = hashlib.sha256()
+	size        = 0
+	with open(filepath, "rb") as f:
+		for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+			hash_md5.update(chunk)
+			hash_sha256.update(chunk)
+			size += len(chunk)
+	return hash_md5.hexdigest(), hash_sha256.hexdigest(), size
+
+def files_identical(path_1, path_2):
+	'''
+	Byte-for-byte comparison of two files that never holds more than one
+	chunk of each in memory. Bails out on a size mismatch without reading
+	anything, and on the first differing chunk otherwise.
+	'''
+	if os.path.getsize(path_1) != os.path.getsize(path_2):
+		return False
+
+	with open(path_1, "rb") as fp1, open(path_2, "rb") as fp2:
+		while True:
+			chunk_1 = fp1.read(HASH_CHUNK_SIZE)
+			chunk_2 = fp2.read(HASH_CHUNK_SIZE)
+			if chunk_1 != chunk_2:
+				return False
+			if not chunk_1:
+				return True
+
+
+class HashingFileWriter(object):
+	'''
+	Write-only wrapper around a file object that MD5 and SHA-256 sums (and counts)
+	everything written through it, so the digest of a freshly written file is
+	available without reading it back off disk.
+
+	The wrapper is deliberately not seekable. When handed to `zipfile.ZipFile`,
+	that makes zipfile emit the archive strictly sequentially (using data
+	descriptors rather than seeking back to patch the local headers), so the
+	bytes that pass through `write()` are exactly the bytes of the final file.
+	'''
+
+	def __init__(self, fp):
+		self.fp     = fp
+		self.md5    = hashlib.md5()
+		self.sha256 = hashlib.sha256()
+		self.size   = 0
+
+	def write(self, data):
+		self.md5.update(data)
+		self.sha256.update(data)
+		self.size += len(data)
+		return self.fp.write(data)
+
+	def tell(self):
+		return self.size
+
+	def flush(self):
+		self.fp.flush()
+
+	def close(self):
+		self.fp.close()
+
+	def hexdigest(self):
+		return self.md5.hexdigest()
+
+	def sha256_hexdigest(self):
+		return self.sha256.hexdigest()
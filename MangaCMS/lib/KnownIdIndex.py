@@ -0,0 +1,47 @@
+
+import array
+import bisect
+import hashlib
+
+
+class KnownIdIndex(object):
+	'''
+	Compact membership index of the source_ids a plugin already has in the DB.
+
+	Each id is reduced to a 64-bit hash, and the hashes are kept in a sorted
+	`array('Q')` (8 bytes per id, rather than a few hundred for a set of
+	URL strings), searched with bisect. Ids added after the initial load go
+	into a small set alongside it.
+
+	A hash collision would make an unknown id look known. At 64 bits that's
+	around 1 in 10^13 per lookup against a million ids, which is an acceptable
+	price for not holding every URL in memory.
+	'''
+
+	def __init__(self, source_ids=()):
+		self._sorted = array.array('Q', sorted(set(self._key(source_id) for source_id in source_ids)))
+		self._added  = set()
+
+	@staticmethod
+	def _key(source_id):
+		# source_id is a text column, so plugins that hand in numeric ids
+		# match what comes back out of the DB.
+		return int.from_bytes(hashlib.blake2b(str(source_id).encode("utf-8"), digest_size=8).digest(), "little")
+
+	def __contains__(self, source_id):
+		key = self._key(source_id)
+		if key in self._added:
+			return True
+		idx = bisect.bisect_left(self._sorted, key)
+		return idx < len(self._sorted) and self._sorted[idx] == key
+
+	def __len__(self):
+		return len(self._sorted) + len(self._added)
+
+	def add(self, source_id):
+		if source_id not in self:
+			self._added.add(self._key(source_id))
+
+	def update(self, source_ids):
+		for source_id in source_ids:
+			self.add(source_id)
@@ -0,0 +1,351 @@
+
+import os
+import mmap
+import fcntl
+import struct
+import logging
+import functools
+import threading
+import contextlib
+
+import settings
+import runStatus
+
+from MangaCMS.lib.RateLimit import response_size
+
+
+class HostByteCounter(object):
+	'''
+	Count of in-flight bytes shared by every process on the host, kept in a
+	small memory-mapped file (under /dev/shm, usually) and guarded with flock.
+
+	Each process gets its own (pid, bytes) slot, and the total is the sum of the
+	slots of live processes, so a process that dies while holding bytes can't
+	leak them. A dead slot is cleared the next time anyone looks at it.
+
+	A counter that's inherited across a fork reopens the file in the child
+	(flock doesn't exclude processes sharing an open file), and the child
+	gets a slot of its own.
+	'''
+
+	SLOT_FORMAT = struct.Struct("<qq")
+	SLOTS       = 512
+
+	def __init__(self, path):
+		self.path = path
+		self.pid  = None
+		self._open()
+
+	def _open(self):
+		size = self.SLOT_FORMAT.size * self.SLOTS
+
+		self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+		if os.fstat(self.fd).st_size < size:
+			os.ftruncate(self.fd, size)
+		self.map  = mmap.mmap(self.fd, size)
+		self.slot = None
+		self.pid  = os.getpid()
+
+	@contextlib.contextmanager
+	def _locked(self):
+		if self.pid != os.getpid():
+			# Our copy of the parent's descriptor. Closing it doesn't affect the parent.
+			self.map.close()
+			os.close(self.fd)
+			self._open()
+		fcntl.flock(self.fd, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+	def _read(self, idx):
+		return self.SLOT_FORMAT.unpack_from(self.map, idx * self.SLOT_FORMAT.size)
+
+	def _write(self, idx, pid, nbytes):
+		self.SLOT_FORMAT.pack_into(self.map, idx * self.SLOT_FORMAT.size, pid, nbytes)
+
+	@staticmethod
+	def _alive(pid):
+		try:
+			os.kill(pid, 0)
+		except ProcessLookupError:
+			return False
+		except PermissionError:
+			pass
+		return True
+
+	def _total(self):
+		# Must be called with the lock held.
+		total = 0
+		for idx in range(self.SLOTS):
+			pid, nbytes = self._read(idx)
+			if not pid:
+				continue
+			if pid != self.pid and not self._alive(pid):
+				self._write(idx, 0, 0)
+				continue
+			if pid == self.pid:
+				self.slot = idx
+			total += nbytes
+		return total
+
+	def _own_slot(self):
+		# Must be called with the lock held.
+		if self.slot is not None and self._read(self.slot)[0] == self.pid:
+			return self.slot
+		for idx in range(self.SLOTS):
+			if not self._read(idx)[0]:
+				self._write(idx, self.pid, 0)
+				self.slot = idx
+				return idx
+		raise RuntimeError("No free slots in host byte counter %s!" % self.path)
+
+	def total(self):
+		with self._locked():
+			return self._total()
+
+	def try_add(self, nbytes, limit):
+		'''
+		Add `nbytes` to this process's count, if it fits under `limit` (or
+		nothing is in flight at all). Returns whether it was added.
+		'''
+		with self._locked():
+			total = self._total()
+			if total and total + nbytes > limit:
+				return False
+			idx = self._own_slot()
+			self._write(idx, self.pid, self._read(idx)[1] + nbytes)
+			return True
+
+	def add(self, nbytes):
+		with self._locked():
+			self._total()
+			idx = self._own_slot()
+			self._write(idx, self.pid, max(0, self._read(idx)[1] + nbytes))
+
+
+class Reservation(object):
+	'''
+	Bytes held against a MemoryBudget by one item fetch.
+
+	A reservation holds `floor` bytes (an estimate of the item's size) from
+	the moment it's admitted, or however many bytes have actually been
+	charged to it, whichever is larger.
+	'''
+
+	def __init__(self, budget, floor):
+		self.budget = budget
+		self.floor  = floor
+		self.used   = 0
+		self.held   = 0
+
+	def _resize(self):
+		# Must be called with the budget lock held.
+		new_held = max(self.floor, self.used) if self.held else 0
+		self.budget._adjust(new_held - self.held)
+		self.held = new_held
+
+	def charge(self, nbytes):
+		with self.budget.cond:
+			self.used += nbytes
+			self._resize()
+
+	def release(self, nbytes):
+		with self.budget.cond:
+			self.used = max(0, self.used - nbytes)
+			self._resize()
+
+	def wait(self):
+		self.budget.wait_for_headroom(self)
+
+
+class MemoryBudget(object):
+	'''
+	Limit on the bytes of fetched content held in memory at once.
+
+	Each item fetch takes a Reservation (see `reservation()`), which blocks
+	until the estimated size of the item fits in the budget. Content fetched
+	for the item is charged to it as it comes back, and released once it's
+	been written out, or when the item is done.
+
+	Once an item is running, the fetches it makes wait for the budget to have
+	room again, except for the oldest running item, which is always allowed
+	to go ahead so that something is always making progress.
+
+	`limit` is per process. If `host_counter` is given, `host_limit` applies
+	to the total across every process sharing that counter. Admission checks
+	both, mid-item waits only the per-process limit.
+	'''
+
+	def __init__(self, limit=None, host_counter=None, host_limit=None):
+		self.log          = logging.getLogger("Main.MemoryBudget")
+		self.limit        = limit
+		self.host_counter = host_counter
+		self.host_limit   = host_limit
+
+		self.cond         = threading.Condition()
+		self.in_flight    = 0
+		self.running      = []
+
+	def _fits(self, nbytes):
+		if not self.limit or not self.in_flight:
+			return True
+		return self.in_flight + nbytes <= self.limit
+
+	def _adjust(self, delta):
+		# Must be called with the lock held.
+		self.in_flight += delta
+		if self.host_counter:
+			self.host_counter.add(delta)
+		if delta < 0:
+			self.cond.notify_all()
+
+	def _admit(self, res):
+		waited = False
+		host_counted = False
+		with self.cond:
+			# If we're shutting down, stop waiting, and let the item go ahead (or
+			# notice runStatus itself) rather than hanging the shutdown.
+			while runStatus.run:
+				if self._fits(res.floor):
+					if not self.host_counter:
+						break
+					if self.host_counter.try_add(res.floor, self.host_limit):
+						host_counted = True
+						break
+				if not waited:
+					self.log.info("Memory budget exhausted (%s bytes in flight). Waiting.", self.in_flight)
+					waited = True
+				self.cond.wait(0.5)
+
+			if self.host_counter and not host_counted:
+				self.host_counter.add(res.floor)
+			self.in_flight += res.floor
+			res.held = res.floor
+			self.running.append(res)
+
+	def wait_for_headroom(self, res):
+		if not self.limit:
+			return
+		with self.cond:
+			while runStatus.run and self.in_flight > self.limit and self.running and self.running[0] is not res:
+				self.cond.wait(0.5)
+
+	@contextlib.contextmanager
+	def reservation(self, floor):
+		res = Reservation(self, floor)
+		self._admit(res)
+		try:
+			with using(res):
+				yield res
+		finally:
+			with self.cond:
+				self._adjust(-res.held)
+				res.held = 0
+				self.running.remove(res)
+
+
+_current = threading.local()
+
+def current_reservation():
+	return getattr(_current, "reservation", None)
+
+@contextlib.contextmanager
+def using(res):
+	'''
+	Make `res` the reservation that fetches on this thread are charged to.
+	'''
+	prev = current_reservation()
+	_current.reservation = res
+	try:
+		yield res
+	finally:
+		_current.reservation = prev
+
+def bind(func):
+	'''
+	Wrap `func` so it's charged to the calling thread's current reservation,
+	whatever thread it ends up being run on (e.g. in a ThreadPoolExecutor).
+	'''
+	res = current_reservation()
+	if res is None:
+		return func
+
+	@functools.wraps(func)
+	def bound(*args, **kwargs):
+		with using(res):
+			return func(*args, **kwargs)
+	return bound
+
+def charge(nbytes):
+	res = current_reservation()
+	if res:
+		res.charge(nbytes)
+
+def release(nbytes):
+	res = current_reservation()
+	if res:
+		res.release(nbytes)
+
+
+class BudgetedWebGet(object):
+	'''
+	Wraps a WebRequest.WebGetRobust (or RateLimitedWebGet) so that content
+	fetches wait for room in the current reservation's budget before they
+	go out, and are charged to it when they come back.
+	'''
+
+	FETCH_METHODS = (
+			'getpage',
+			'getFileAndName',
+			'getFileNameMime',
+			'getItem',
+		)
+
+	def __init__(self, wg):
+		self.wg = wg
+
+	def __getattr__(self, name):
+		attr = getattr(self.wg, name)
+		if name not in self.FETCH_METHODS:
+			return attr
+
+		@functools.wraps(attr)
+		def budgeted(*args, **kwargs):
+			res = current_reservation()
+			if res:
+				res.wait()
+			ret = attr(*args, **kwargs)
+			if res:
+				res.charge(response_size(ret))
+			return ret
+		return budgeted
+
+
+_MEMORY_BUDGET      = None
+_MEMORY_BUDGET_PID  = None
+_MEMORY_BUDGET_LOCK = threading.Lock()
+
+def get_memory_budget():
+	'''
+	Process-wide MemoryBudget, or None if neither `settings.fetchMemoryBudget`
+	nor `settings.fetchHostMemoryBudget` is set.
+
+	A forked child (e.g. a post-processing worker) gets a budget of its own,
+	rather than counting against its parent's in-flight bytes and slot.
+	'''
+	global _MEMORY_BUDGET, _MEMORY_BUDGET_PID
+	limit      = getattr(settings, "fetchMemoryBudget", None)
+	host_limit = getattr(settings, "fetchHostMemoryBudget", None)
+	if not (limit or host_limit):
+		return None
+
+	with _MEMORY_BUDGET_LOCK:
+		if _MEMORY_BUDGET is None or _MEMORY_BUDGET_PID != os.getpid():
+			host_counter = None
+			if host_limit:
+				host_counter = HostByteCounter(getattr(settings, "fetchHostMemoryBudgetFile", "/dev/shm/mangacms-fetch-budget"))
+			_MEMORY_BUDGET = MemoryBudget(limit, host_counter, host_limit)
+			_MEMORY_BUDGET_PID = os.getpid()
+		return _MEMORY_BUDGET
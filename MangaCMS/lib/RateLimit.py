@@ -0,0 +1,136 @@
+
+import time
+import logging
+import functools
+import urllib.parse
+
+import sqlalchemy as sa
+
+import runStatus
+import MangaCMS.db.db_engine as db_engine
+
+
+# Debit a host's bucket, refilling it for the time since it was last touched
+# first. Buckets are allowed to go negative: a negative balance is a queue of
+# callers that have already reserved the next tokens, and each one waits for
+# its own share of the deficit to refill. That keeps the whole thing to a single
+# statement, with the row lock held only for the duration of that statement.
+_DEBIT_SQL = sa.text('''
+	INSERT INTO rate_limit_buckets AS b
+			(host, tokens, byte_tokens, updated_at)
+		VALUES
+			(:host, :burst - :req_cost, :byte_burst - :byte_cost, clock_timestamp()::timestamp)
+	ON CONFLICT (host) DO UPDATE SET
+		tokens      = LEAST(:burst,      b.tokens      + EXTRACT(EPOCH FROM (clock_timestamp()::timestamp - b.updated_at)) * :rate)      - :req_cost,
+		byte_tokens = LEAST(:byte_burst, b.byte_tokens + EXTRACT(EPOCH FROM (clock_timestamp()::timestamp - b.updated_at)) * :byte_rate) - :byte_cost,
+		updated_at  = clock_timestamp()::timestamp
+	RETURNING tokens, byte_tokens
+''')
+
+
+class SharedTokenBucket(object):
+	'''
+	Per-host token bucket limiter, with the bucket state in the
+	`rate_limit_buckets` table, so the limit holds across every thread and
+	every scheduler process hitting the same host.
+
+	Each request takes one request token before it goes out, and the
+	size of the response is debited from the byte bucket after it comes
+	back. A request waits until both buckets are non-negative. Either
+	limit can be None (unlimited).
+
+	`burst` is how many requests' (or seconds' worth of bytes') credit a
+	bucket can accumulate while idle.
+	'''
+
+	def __init__(self, requests_per_sec=None, bytes_per_sec=None, burst=1):
+		self.log              = logging.getLogger("Main.RateLimit")
+		self.requests_per_sec = requests_per_sec
+		self.bytes_per_sec    = bytes_per_sec
+		self.burst            = burst
+
+	def _debit(self, host, req_cost, byte_cost):
+		params = {
+				'host'       : host,
+				'rate'       : self.requests_per_sec or 0,
+				'burst'      : self.burst if self.requests_per_sec else 0,
+				'req_cost'   : req_cost if self.requests_per_sec else 0,
+				'byte_rate'  : self.bytes_per_sec or 0,
+				'byte_burst' : self.bytes_per_sec * self.burst if self.bytes_per_sec else 0,
+				'byte_cost'  : byte_cost if self.bytes_per_sec else 0,
+			}
+
+		# Own short transaction, so the bucket row is never locked for the
+		# duration of some caller's session.
+		with db_engine.engine.begin() as conn:
+			return conn.execute(_DEBIT_SQL, params).fetchone()
+
+	def acquire(self, url):
+		host = urllib.parse.urlsplit(url).netloc.lower()
+		tokens, byte_tokens = self._debit(host, 1, 0)
+
+		delay = 0
+		if self.requests_per_sec and tokens < 0:
+			delay = max(delay, -tokens / self.requests_per_sec)
+		if self.bytes_per_sec and byte_tokens < 0:
+			delay = max(delay, -byte_tokens / self.bytes_per_sec)
+
+		if delay > 0:
+			self.log.info("Rate limiting requests to %s. Waiting %0.1f seconds", host, delay)
+			end = time.monotonic() + delay
+			while runStatus.run and time.monotonic() < end:
+				time.sleep(min(1, end - time.monotonic()))
+
+	def consume_bytes(self, url, nbytes):
+		if not self.bytes_per_sec or not nbytes:
+			return
+		host = urllib.parse.urlsplit(url).netloc.lower()
+		self._debit(host, 0, nbytes)
+
+
+def response_size(ret):
+	'''
+	Best guess at the size of whatever a WebGetRobust fetch method returned.
+	Content is either the return value itself, or the first item of a tuple.
+	Parsed pages (soup, json) aren't counted.
+	'''
+	if isinstance(ret, tuple) and ret:
+		ret = ret[0]
+	if isinstance(ret, (bytes, bytearray, str)):
+		return len(ret)
+	return 0
+
+
+class RateLimitedWebGet(object):
+	'''
+	Wraps a WebRequest.WebGetRobust instance so that every fetch goes through
+	a SharedTokenBucket. Everything else (cookie jar, WAF step-through, etc.)
+	is passed straight through.
+	'''
+
+	FETCH_METHODS = (
+			'getpage',
+			'getSoup',
+			'getJson',
+			'getFileAndName',
+			'getFileNameMime',
+			'getItem',
+			'getHead',
+		)
+
+	def __init__(self, wg, bucket):
+		self.wg     = wg
+		self.bucket = bucket
+
+	def __getattr__(self, name):
+		attr = getattr(self.wg, name)
+		if name not in self.FETCH_METHODS:
+			return attr
+
+		@functools.wraps(attr)
+		def limited(url, *args, **kwargs):
+			self.bucket.acquire(url)
+			ret = attr(url, *args, **kwargs)
+			self.bucket.consume_bytes(url, response_size(ret))
+			return ret
+		return limited
@@ -0,0 +1,122 @@
+
+import time
+import logging
+import threading
+
+import sqlalchemy as sa
+
+import nameTools as nt
+import MangaCMS.db.db_engine as db_engine
+
+
+class SeriesPriority(object):
+	'''
+	Scores manga series by how much we want their new chapters, so the fetch
+	queue can pull them ahead of everything else.
+
+	A series scores:
+
+	 - `watched_boost` if it's on one of the BuMonitor watch lists (a row in
+	   the `mangaseries` table with `buList` set).
+	 - `have_dir_boost` if we already have a directory for it in one of the
+	   manga folders (per `nameTools.dirNameProxy`).
+	 - The folder rating (`[++]`, `[-]` and so on, via `nameTools.extractRating`)
+	   times `rating_weight`. Negative ratings push a series down the queue.
+
+	Series we know nothing about score 0. The watch list is re-read at most
+	every `refresh_interval` seconds. Scores are cached until then too, since
+	each one costs a few nameTools lookups. At most `max_cached` are kept.
+	'''
+
+	watched_boost    = 4
+	have_dir_boost   = 2
+	rating_weight    = 1
+	refresh_interval = 60 * 10
+	max_cached       = 10000
+
+	def __init__(self):
+		self.log = logging.getLogger("Main.SeriesPriority")
+
+		self.lock          = threading.Lock()
+		self.last_refresh  = 0
+		self.watched_ids   = set()
+		self.watched_names = set()
+		self.score_cache   = {}
+
+	def _load_watch_list(self):
+		with db_engine.engine.begin() as conn:
+			have_table = conn.execute(
+					sa.text("SELECT 1 FROM pg_catalog.pg_tables WHERE tablename = 'mangaseries'")
+				).fetchone()
+			if not have_table:
+				self.log.warning("No mangaseries table. Watch lists will not affect fetch priority.")
+				return set(), set()
+
+			rows = conn.execute(
+					sa.text("SELECT buId, buName FROM mangaseries WHERE buList IS NOT NULL")
+				).fetchall()
+
+		watched_ids   = set(str(bu_id) for bu_id, _ in rows if bu_id)
+		watched_names = set(nt.prepFilenameForMatching(bu_name) for _, bu_name in rows if bu_name)
+		return watched_ids, watched_names
+
+	def refresh(self, force=False):
+		with self.lock:
+			if not force and time.time() < self.last_refresh + self.refresh_interval:
+				return
+			self.watched_ids, self.watched_names = self._load_watch_list()
+			self.score_cache  = {}
+			self.last_refresh = time.time()
+			self.log.info("Loaded %s watched series", len(self.watched_ids))
+
+	def is_watched(self, series_name):
+		mu_id = nt.getMangaUpdatesId(series_name)
+		if mu_id and str(mu_id) in self.watched_ids:
+			return True
+		return nt.prepFilenameForMatching(series_name) in self.watched_names
+
+	def score(self, series_name):
+		if not series_name:
+			return 0
+
+		ret = 0
+		if self.is_watched(series_name):
+			ret += self.watched_boost
+
+		have = nt.dirNameProxy[series_name]
+		if have['fqPath']:
+			ret += self.have_dir_boost
+			if have['rating']:
+				ret += nt.ratingStrToFloat(have['rating']) * self.rating_weight
+
+		return ret
+
+	def scores(self, series_names):
+		'''
+		Score each of `series_names`. Returns a dict of {series_name : score},
+		leaving out the ones that score 0.
+		'''
+		self.refresh()
+		cache = self.score_cache
+		ret = {}
+		for series_name in series_names:
+			score = cache.get(series_name)
+			if score is None:
+				score = self.score(series_name)
+				if len(cache) >= self.max_cached:
+					cache.clear()
+				cache[series_name] = score
+			if score:
+				ret[series_name] = score
+		return ret
+
+
+_SERIES_PRIORITY      = None
+_SERIES_PRIORITY_LOCK = threading.Lock()
+
+def get_series_priority():
+	global _SERIES_PRIORITY
+	with _SERIES_PRIORITY_LOCK:
+		if _SERIES_PRIORITY is None:
+			_SERIES_PRIORITY = SeriesPriority()
+		return _SERIES_PRIORITY
@@ -0,0 +1,206 @@
+
+import re
+import threading
+
+import settings
+
+# Tags that contain a keep tag, but shouldn't count as one.
+KEEP_EXCLUDED_TAGS = frozenset([
+		'female-none',
+		'schoolgirl',
+		'tomgirl',
+		'position-cowgirl',
+		'schoolgirl-uniform',
+	])
+
+# Tags (lower-cased) with one of these prefixes never count as a keep tag.
+KEEP_EXCLUDED_PREFIXES = (
+		'artist-',
+		'fetish-',
+		'male-',
+		'parody-',
+	)
+
+
+def _combined_re(patterns):
+	'''
+	One alternation matching any of `patterns` as a plain substring, or None
+	if there aren't any (an empty alternation would match everything).
+	Longest first, so a pattern is never shadowed by one of its own prefixes.
+	'''
+	patterns = sorted(set(patterns), key=len, reverse=True)
+	if not patterns:
+		return None
+	return re.compile("|".join(re.escape(pattern) for pattern in patterns))
+
+
+class TagFilter(object):
+	'''
+	The keep/skip tag rules from `wanted_from_tags()`, compiled once.
+
+	An item is unwanted if any skip tag appears in it, unless it also has a
+	keep tag. A "keep tag" is any tag containing one of the `keep_tags`
+	substrings that isn't in KEEP_EXCLUDED_TAGS or prefixed with one of
+	KEEP_EXCLUDED_PREFIXES.
+
+	Rather than testing every tag against every keep entry, and scanning
+	the tag list once per skip entry, each list is folded into a single
+	regex alternation, so each check is one pass of the regex engine.
+	'''
+
+	def __init__(self, keep_tags, skip_tags):
+		self.keep_tags = tuple(keep_tags)
+		self.skip_tags = tuple(skip_tags)
+
+		self.keep_re   = _combined_re(self.keep_tags)
+		self.skip_re   = _combined_re(self.skip_tags)
+
+	def is_keep_tag(self, tag):
+		if not self.keep_re:
+			return False
+		if tag in KEEP_EXCLUDED_TAGS or tag.lower().startswith(KEEP_EXCLUDED_PREFIXES):
+			return False
+		return bool(self.keep_re.search(tag))
+
+	def has_skip_tag(self, tags):
+		# Matched against the repr of the whole list, same as the original
+		# `skip_tag in str(tags)` check.
+		if not self.skip_re:
+			return False
+		return bool(self.skip_re.search(str(tags)))
+
+	def masked_by(self, tags):
+		'''
+		Skip tags that are present as whole tags in `tags`. Used for logging.
+		'''
+		return [skip_tag for skip_tag in self.skip_tags if skip_tag in tags]
+
+	def wanted(self, tags):
+		if not self.has_skip_tag(tags):
+			return True
+		return any(self.is_keep_tag(tag) for tag in tags)
+
+	def wanted_many(self, tag_lists):
+		'''
+		Batch form of `wanted()`. Takes an iterable of tag lists, and returns
+		a list of bools in the same order.
+
+		Only lists that hit a skip tag need the (more expensive) keep check,
+		and that's answered from a per-call memo, since the same tags turn up
+		across most of a feed.
+		'''
+		keep_memo = {}
+		ret = []
+		for tags in tag_lists:
+			if not self.has_skip_tag(tags):
+				ret.append(True)
+				continue
+
+			keep = False
+			for tag in tags:
+				is_keep = keep_memo.get(tag)
+				if is_keep is None:
+					is_keep = keep_memo[tag] = self.is_keep_tag(tag)
+				if is_keep:
+					keep = True
+					break
+			ret.append(keep)
+		return ret
+
+
+_TAG_FILTER      = None
+_TAG_FILTER_LOCK = threading.Lock()
+
+def get_tag_filter():
+	'''
+	TagFilter for the current `settings.tags_keep` / `settings.skipTags`.
+	It's rebuilt if either list has changed since it was compiled.
+	'''
+	global _TAG_FILTER
+	keep_tags = tuple(getattr(settings, "tags_keep", []))
+	skip_tags = tuple(getattr(settings, "skipTags",  []))
+
+	with _TAG_FILTER_LOCK:
+		if _TAG_FILTER is None or _TAG_FILTER.keep_tags != keep_tags or _TAG_FILTER.skip_tags != skip_tags:
+			_TAG_FILTER = TagFilter(keep_tags, skip_tags)
+		return _TAG_FILTER
+
+
+def _reference_wanted(tags, keep_tags, skip_tags):
+	'''
+	The original, uncompiled implementation. Only used by the benchmark below,
+	to check the compiled filter gives the same answers.
+	'''
+	have_keep_tags = any(
+			[
+					    keep_tag in tag
+					and tag != 'female-none'
+					and tag != 'schoolgirl'
+					and tag != 'tomgirl'
+					and tag != 'position-cowgirl'
+					and tag != 'schoolgirl-uniform'
+					and not tag.lower().startswith('artist-')
+					and not tag.lower().startswith('fetish-')
+					and not tag.lower().startswith('male-')
+					and not tag.lower().startswith("parody-")
+				for
+					tag
+				in
+					tags
+				for
+					keep_tag
+				in
+					keep_tags
+			]
+		)
+	have_skip_tags = any([skip_tag in str(tags) for skip_tag in skip_tags])
+
+	return not (have_skip_tags and not have_keep_tags)
+
+
+def benchmark(limit=20000):
+	'''
+	Time the compiled filter against the original implementation, on the
+	tag sets of the most recent `limit` hentai releases.
+	'''
+	import time
+	import MangaCMS.db as mdb
+
+	with mdb.session_context(commit=False) as sess:
+		rows = sess.query(mdb.HentaiReleases)          \
+			.order_by(mdb.HentaiReleases.id.desc())    \
+			.limit(limit)                              \
+			.all()
+		tag_lists = [list(row.tags) for row in rows]
+
+	keep_tags = tuple(getattr(settings, "tags_keep", []))
+	skip_tags = tuple(getattr(settings, "skipTags",  []))
+
+	print("%s tag sets, %s tags total. %s keep tags, %s skip tags." % (
+			len(tag_lists), sum(len(tmp) for tmp in tag_lists), len(keep_tags), len(skip_tags)))
+
+	start = time.perf_counter()
+	ref = [_reference_wanted(tags, keep_tags, skip_tags) for tags in tag_lists]
+	t_ref = time.perf_counter() - start
+
+	start = time.perf_counter()
+	tag_filter = TagFilter(keep_tags, skip_tags)
+	single = [tag_filter.wanted(tags) for tags in tag_lists]
+	t_single = time.perf_counter() - start
+
+	start = time.perf_counter()
+	batch = TagFilter(keep_tags, skip_tags).wanted_many(tag_lists)
+	t_batch = time.perf_counter() - start
+
+	assert ref == single, "Compiled filter disagrees with the reference implementation!"
+	assert ref == batch,  "Batch filter disagrees with the reference implementation!"
+
+	print("Reference: %0.3fs" % t_ref)
+	print("Compiled:  %0.3fs (%0.1fx)" % (t_single, t_ref / max(t_single, 1e-9)))
+	print("Batch:     %0.3fs (%0.1fx)" % (t_batch,  t_ref / max(t_batch,  1e-9)))
+	print("%s of %s wanted" % (sum(ref), len(ref)))
+
+
+if __name__ == "__main__":
+	import sys
+	benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -1,2 +1,15 @@
 
 from . import duper_test
+from . import archive_sink_test
+from . import upload_queue_test
+from . import dedup_pool_test
+from . import hashing_writer_test
+from . import tag_filter_test
+from . import aimd_test
+from . import page_cache_test
+from . import tag_registry_test
+from . import rate_limit_test
+from . import memory_budget_test
+from . import http_cache_test
+from . import known_id_index_test
+from . import series_priority_test
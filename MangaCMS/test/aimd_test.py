@@ -0,0 +1,111 @@
+
+import threading
+import unittest
+
+import MangaCMS.lib.Aimd as Aimd
+
+
+class TestAimd(unittest.TestCase):
+
+	def test_initial_limit_clamped(self):
+		self.assertEqual(Aimd.AimdController(2, 8).limit, 2)
+		self.assertEqual(Aimd.AimdController(2, 8, initial=5).limit, 5)
+		self.assertEqual(Aimd.AimdController(2, 8, initial=50).limit, 8)
+		with self.assertRaises(AssertionError):
+			Aimd.AimdController(0, 8)
+		with self.assertRaises(AssertionError):
+			Aimd.AimdController(8, 2)
+
+	def test_additive_increase(self):
+		aimd = Aimd.AimdController(1, 5, initial=2)
+
+		# One more per round of `limit` successes.
+		aimd.on_success(1.0)
+		self.assertEqual(aimd.limit, 2)
+		aimd.on_success(1.0)
+		self.assertEqual(aimd.limit, 3)
+		for dummy_idx in range(3):
+			aimd.on_success(1.0)
+		self.assertEqual(aimd.limit, 4)
+
+		for dummy_idx in range(20):
+			aimd.on_success(1.0)
+		self.assertEqual(aimd.limit, 5)
+		self.assertEqual(aimd.peak_limit, 5)
+		self.assertEqual(aimd.completed, 25)
+
+	def test_multiplicative_decrease(self):
+		aimd = Aimd.AimdController(1, 16, initial=8)
+		aimd.on_error()
+		self.assertEqual(aimd.limit, 4)
+		self.assertEqual(aimd.failed, 1)
+
+	def test_decrease_floor(self):
+		aimd = Aimd.AimdController(3, 16, initial=4)
+		aimd.on_limited()
+		self.assertEqual(aimd.limit, 3)
+
+	def test_one_decrease_per_round(self):
+		aimd = Aimd.AimdController(1, 16, initial=8)
+
+		# A round currently takes about 10s, so the in-flight fetches failing
+		# right after the first don't each halve the limit again.
+		aimd.on_success(10.0)
+		aimd.on_error()
+		aimd.on_error()
+		aimd.on_limited()
+		self.assertEqual(aimd.limit, 4)
+		self.assertEqual(aimd.failed, 3)
+
+	def test_latency_backoff(self):
+		aimd = Aimd.AimdController(1, 16, initial=8)
+		aimd.on_success(1.0)
+		aimd.on_success(1.0)
+		self.assertEqual(aimd.limit, 8)
+
+		# Smoothed latency rises past twice the best seen.
+		aimd.on_success(10.0)
+		self.assertEqual(aimd.limit, 4)
+		self.assertEqual(aimd.successes, 0)
+
+	def test_slot_limits_concurrency(self):
+		aimd = Aimd.AimdController(1, 4, initial=1)
+
+		entered = threading.Event()
+		def worker():
+			with aimd.slot():
+				entered.set()
+
+		with aimd.slot():
+			self.assertEqual(aimd.in_flight, 1)
+			thread = threading.Thread(target=worker, daemon=True)
+			thread.start()
+			self.assertFalse(entered.wait(0.2))
+
+		# Freed up when the first slot is released.
+		self.assertTrue(entered.wait(5))
+		thread.join(5)
+		self.assertEqual(aimd.in_flight, 0)
+
+	def test_raised_limit_wakes_waiters(self):
+		aimd = Aimd.AimdController(1, 4, initial=1)
+
+		entered = threading.Event()
+		def worker():
+			with aimd.slot():
+				entered.set()
+
+		with aimd.slot():
+			thread = threading.Thread(target=worker, daemon=True)
+			thread.start()
+			self.assertFalse(entered.wait(0.2))
+			aimd.on_success(1.0)
+			self.assertEqual(aimd.limit, 2)
+			self.assertTrue(entered.wait(5))
+		thread.join(5)
+
+	def test_throughput(self):
+		aimd = Aimd.AimdController(1, 4)
+		self.assertEqual(aimd.throughput(), 0.0)
+		aimd.on_success(1.0)
+		self.assertGreater(aimd.throughput(), 0.0)
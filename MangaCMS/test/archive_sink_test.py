@@ -0,0 +1,65 @@
+
+import os
+import shutil
+import hashlib
+import zipfile
+import logging
+import tempfile
+import unittest
+import unittest.mock
+
+import MangaCMS.ScrapePlugins.RetreivalBase as RetreivalBase
+
+
+class TestImageArchiveSink(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+		# The sink insists on writing into the configured download directories,
+		# and on the pages being real images. Neither matters here.
+		patches = [
+			unittest.mock.patch.object(RetreivalBase, "prep_check_fq_filename", lambda fqfilename: fqfilename),
+			unittest.mock.patch.object(RetreivalBase, "fix_image_name", lambda log, imageName, imageContent: imageName),
+		]
+		for patch in patches:
+			patch.start()
+			self.addCleanup(patch.stop)
+
+		self.log = logging.getLogger("Main.Test.Sink")
+
+	def _write_archive(self, pages):
+		sink = RetreivalBase.ImageArchiveSink(os.path.join(self.tmp_dir, "test.zip"), self.log)
+		with sink:
+			for name, content in pages:
+				sink.add_image(name, content)
+			path = sink.finalize()
+		return sink, path
+
+	def test_digests_match_file(self):
+		pages = [("%03d.jpg" % idx, os.urandom(100 + idx * 37)) for idx in range(12)]
+		sink, path = self._write_archive(pages)
+
+		with open(path, "rb") as fp:
+			content = fp.read()
+
+		self.assertEqual(sink.fhash,        hashlib.md5(content).hexdigest())
+		self.assertEqual(sink.fhash_sha256, hashlib.sha256(content).hexdigest())
+		self.assertEqual(sink.fsize,        len(content))
+		self.assertEqual(sink.fsize,        os.path.getsize(path))
+
+	def test_archive_contents(self):
+		pages = [("%03d.jpg" % idx, os.urandom(64)) for idx in range(5)]
+		dummy_sink, path = self._write_archive(pages)
+
+		with zipfile.ZipFile(path) as zfp:
+			self.assertEqual(zfp.namelist(), [name for name, dummy_content in pages])
+			for name, content in pages:
+				self.assertEqual(zfp.read(name), content)
+
+	def test_abort_removes_partial(self):
+		with RetreivalBase.ImageArchiveSink(os.path.join(self.tmp_dir, "test.zip"), self.log) as sink:
+			sink.add_image("001.jpg", os.urandom(64))
+
+		self.assertEqual(os.listdir(self.tmp_dir), [])
@@ -0,0 +1,99 @@
+
+import os
+import shutil
+import zipfile
+import tempfile
+import threading
+import unittest
+
+import deduplicator.archChecker
+import deduplicator.connectionPool as connectionPool
+import deduplicator.localServer as localServer
+
+
+class TestDedupPool(unittest.TestCase):
+	'''
+	The connection pool (and ArchChecker on top of it), run against the
+	stand-in dedup server.
+	'''
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+		self.pages = [("%03d.jpg" % idx, os.urandom(64)) for idx in range(4)]
+		self.original = self.make_zip("original.zip", self.pages)
+
+		self.server = localServer.make_server(port=0, scan_dirs=[self.tmp_dir])
+		thread = threading.Thread(target=self.server.start, daemon=True)
+		thread.start()
+		self.addCleanup(thread.join, 5)
+		self.addCleanup(self.server.close)
+
+		self.pool = connectionPool.DedupConnectionPool("localhost", self.server.port, size=2)
+		self.addCleanup(self.pool.close)
+
+	def make_zip(self, name, pages):
+		path = os.path.join(self.tmp_dir, name)
+		with zipfile.ZipFile(path, "w") as zfp:
+			for page_name, content in pages:
+				zfp.writestr(page_name, content)
+		return path
+
+	def check(self, path):
+		return deduplicator.archChecker.ArchChecker(path, pool=self.pool).process()
+
+	def test_duplicate_removed(self):
+		dup = self.make_zip("duplicate.zip", self.pages)
+		status, bestMatch, intersections = self.check(dup)
+
+		self.assertIn("deleted", status)
+		self.assertEqual(bestMatch, self.original)
+		self.assertFalse(os.path.exists(dup))
+
+		# Copied out of the connection, rather than a netref into it.
+		self.assertIs(type(intersections), dict)
+		self.assertEqual(intersections, {self.original : len(self.pages)})
+
+	def test_unique_kept(self):
+		unique = self.make_zip("unique.zip", [("001.jpg", os.urandom(64))])
+		status, bestMatch, intersections = self.check(unique)
+
+		self.assertEqual(status, "")
+		self.assertEqual(bestMatch, None)
+		self.assertEqual(intersections, {})
+		self.assertTrue(os.path.exists(unique))
+
+	def test_connection_reused(self):
+		with self.pool.connection() as first:
+			pass
+		with self.pool.connection() as second:
+			self.assertIs(second, first)
+
+		with self.pool.connection() as first:
+			with self.pool.connection() as second:
+				self.assertIsNot(second, first)
+		self.assertEqual(self.pool.idle.qsize(), 2)
+
+	def test_remote_error_returns_connection(self):
+		self.pool.acquire_timeout = 1
+
+		# More failing calls than there are connections. If any leaked, the
+		# later ones would time out waiting for a slot instead.
+		for dummy_idx in range(self.pool.size + 1):
+			with self.assertRaises(AttributeError):
+				self.pool.call("noSuchMethod")
+
+		self.assertEqual(self.pool.idle.qsize(), 1)
+		status, dummy_bestMatch, dummy_intersections = self.check(self.make_zip("unique.zip", [("001.jpg", os.urandom(64))]))
+		self.assertEqual(status, "")
+
+	def test_dead_connection_replaced(self):
+		with self.pool.connection() as first:
+			pass
+		first.conn.close()
+
+		with self.pool.connection() as second:
+			self.assertIsNot(second, first)
+			self.assertFalse(second.conn.closed)
+		self.assertEqual(self.pool.idle.qsize(), 1)
@@ -0,0 +1,80 @@
+
+import os
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import unittest
+
+import MangaCMS.lib.HashingWriter as HashingWriter
+
+
+class TestHashingWriter(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+	def path(self, name):
+		return os.path.join(self.tmp_dir, name)
+
+	def write_file(self, name, content):
+		with open(self.path(name), "wb") as fp:
+			fp.write(content)
+		return self.path(name)
+
+	def test_writer_digests(self):
+		chunks = [os.urandom(1000 + idx) for idx in range(10)]
+		with open(self.path("out.bin"), "wb") as fp:
+			writer = HashingWriter.HashingFileWriter(fp)
+			for chunk in chunks:
+				writer.write(chunk)
+				self.assertEqual(writer.tell(), writer.size)
+
+		with open(self.path("out.bin"), "rb") as fp:
+			content = fp.read()
+		self.assertEqual(content, b"".join(chunks))
+		self.assertEqual(writer.hexdigest(),        hashlib.md5(content).hexdigest())
+		self.assertEqual(writer.sha256_hexdigest(), hashlib.sha256(content).hexdigest())
+		self.assertEqual(writer.size,               len(content))
+
+	def test_writer_under_zipfile(self):
+		# Not seekable, so zipfile has to write the archive front to back, and
+		# the digest of what went through the writer is the digest of the file.
+		with open(self.path("out.zip"), "wb") as fp:
+			writer = HashingWriter.HashingFileWriter(fp)
+			with zipfile.ZipFile(writer, "w") as zfp:
+				for idx in range(5):
+					zfp.writestr("%03d.jpg" % idx, os.urandom(5000))
+
+		self.assertEqual(HashingWriter.digest_file(self.path("out.zip")),
+				(writer.hexdigest(), writer.sha256_hexdigest(), writer.size))
+		with zipfile.ZipFile(self.path("out.zip")) as zfp:
+			self.assertIsNone(zfp.testzip())
+
+	def test_hash_file(self):
+		# Bigger than a chunk, and not a multiple of one.
+		content = os.urandom(HashingWriter.HASH_CHUNK_SIZE * 2 + 123)
+		path = self.write_file("big.bin", content)
+
+		self.assertEqual(HashingWriter.hash_file(path), hashlib.md5(content).hexdigest())
+		self.assertEqual(HashingWriter.digest_file(path),
+				(hashlib.md5(content).hexdigest(), hashlib.sha256(content).hexdigest(), len(content)))
+
+	def test_empty_file(self):
+		path = self.write_file("empty.bin", b"")
+		self.assertEqual(HashingWriter.digest_file(path),
+				(hashlib.md5(b"").hexdigest(), hashlib.sha256(b"").hexdigest(), 0))
+
+	def test_files_identical(self):
+		content = os.urandom(HashingWriter.HASH_CHUNK_SIZE + 10)
+		path_1 = self.write_file("one.bin", content)
+		path_2 = self.write_file("two.bin", content)
+		self.assertTrue(HashingWriter.files_identical(path_1, path_2))
+
+		# Same size, differing in the last chunk.
+		path_3 = self.write_file("three.bin", content[:-1] + bytes([content[-1] ^ 0xFF]))
+		self.assertFalse(HashingWriter.files_identical(path_1, path_3))
+
+		path_4 = self.write_file("four.bin", content[:-1])
+		self.assertFalse(HashingWriter.files_identical(path_1, path_4))
@@ -0,0 +1,124 @@
+
+import shutil
+import logging
+import tempfile
+import unittest
+import unittest.mock
+import collections
+import urllib.error
+
+import MangaCMS.ScrapePlugins.HttpCache as HttpCache
+import MangaCMS.ScrapePlugins.LoaderBase as LoaderBase
+
+
+class StubHandle(object):
+	def __init__(self, headers):
+		self.headers = headers
+
+
+class StubWg(object):
+	'''
+	Answers with 304 if the request's If-None-Match matches the current
+	ETag, like a server would. `fail` requests error out with a 500 instead.
+	'''
+	def __init__(self):
+		self.content = b"<html>Feed page</html>"
+		self.etag    = '"v1"'
+		self.fail    = 0
+		self.calls   = []
+
+	def getpage(self, url, addlHeaders=None, returnMultiple=False, **kwargs):
+		self.calls.append((url, dict(addlHeaders or {}), kwargs))
+		if self.fail:
+			self.fail -= 1
+			raise urllib.error.HTTPError(url, 500, "Internal Server Error", {}, None)
+		if (addlHeaders or {}).get('If-None-Match') == self.etag:
+			raise urllib.error.HTTPError(url, 304, "Not Modified", {}, None)
+		return self.content, StubHandle({'ETag' : self.etag})
+
+
+class StubLoader(object):
+	get_page_if_changed = LoaderBase.LoaderBase.get_page_if_changed
+	_http_cache_hit     = LoaderBase.LoaderBase._http_cache_hit
+	_commit_http_cache  = LoaderBase.LoaderBase._commit_http_cache
+
+	def __init__(self, wg, cache):
+		self.log     = logging.getLogger("Main.Test")
+		self.mon_con = None
+		self.wg      = wg
+
+		self.http_cache = cache
+		self.http_cache_stats = collections.Counter()
+		self._http_cache_pending = {}
+
+
+class TestConditionalFetch(unittest.TestCase):
+
+	def setUp(self):
+		tmp_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, tmp_dir)
+
+		self.url    = "https://www.example.org/feed"
+		self.wg     = StubWg()
+		self.loader = StubLoader(self.wg, HttpCache.HttpCache(tmp_dir))
+
+	def test_not_modified(self):
+		self.assertEqual(self.loader.get_page_if_changed(self.url), self.wg.content)
+		self.loader._commit_http_cache()
+
+		self.assertIsNone(self.loader.get_page_if_changed(self.url))
+		self.assertEqual(self.loader.http_cache_stats['not_modified'], 1)
+
+		# The 304 isn't retried.
+		url, headers, kwargs = self.wg.calls[-1]
+		self.assertEqual(headers['If-None-Match'], '"v1"')
+		self.assertEqual(kwargs, {'retryQuantity' : 1})
+		self.assertEqual(len(self.wg.calls), 2)
+
+	def test_unchanged_body(self):
+		self.loader.get_page_if_changed(self.url)
+		self.loader._commit_http_cache()
+
+		# Server doesn't honour the ETag, but the content is the same.
+		self.wg.etag = '"v2"'
+		self.assertIsNone(self.loader.get_page_if_changed(self.url))
+		self.assertEqual(self.loader.http_cache_stats['unchanged'], 1)
+
+	def test_changed(self):
+		self.loader.get_page_if_changed(self.url)
+		self.loader._commit_http_cache()
+
+		self.wg.etag    = '"v2"'
+		self.wg.content = b"<html>New feed page</html>"
+		self.assertEqual(self.loader.get_page_if_changed(self.url), self.wg.content)
+		self.assertEqual(self.loader.http_cache_stats['changed'], 2)
+
+	def test_validators_saved_on_commit(self):
+		self.loader.get_page_if_changed(self.url)
+
+		# Not until the run has gone through.
+		self.assertEqual(self.loader.get_page_if_changed(self.url), self.wg.content)
+		self.loader._commit_http_cache()
+		self.assertIsNone(self.loader.get_page_if_changed(self.url))
+
+	def test_other_errors_retried(self):
+		self.loader.get_page_if_changed(self.url)
+		self.loader._commit_http_cache()
+
+		self.wg.fail = 1
+		self.wg.content = b"<html>New feed page</html>"
+		self.assertEqual(self.loader.get_page_if_changed(self.url), self.wg.content)
+
+		# Fetched again unconditionally, with the default retries.
+		url, headers, kwargs = self.wg.calls[-1]
+		self.assertNotIn('If-None-Match', headers)
+		self.assertEqual(kwargs, {})
+
+		# If that fails too, it's raised.
+		self.wg.fail = 2
+		with self.assertRaises(urllib.error.HTTPError):
+			self.loader.get_page_if_changed(self.url)
+
+	def test_disabled_without_setting(self):
+		with unittest.mock.patch.object(HttpCache.settings, "httpCacheDir", None, create=True):
+			self.assertIsNone(HttpCache.get_http_cache())
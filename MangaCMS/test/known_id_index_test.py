@@ -0,0 +1,52 @@
+
+import unittest
+
+import MangaCMS.lib.KnownIdIndex as KnownIdIndex
+
+
+class TestKnownIdIndex(unittest.TestCase):
+
+	def url(self, idx):
+		return "https://www.example.org/chapter/%s" % idx
+
+	def test_membership(self):
+		index = KnownIdIndex.KnownIdIndex(self.url(idx) for idx in range(100))
+		self.assertEqual(len(index), 100)
+		for idx in range(100):
+			self.assertIn(self.url(idx), index)
+		for idx in range(100, 200):
+			self.assertNotIn(self.url(idx), index)
+
+	def test_empty(self):
+		index = KnownIdIndex.KnownIdIndex()
+		self.assertEqual(len(index), 0)
+		self.assertNotIn(self.url(1), index)
+
+	def test_duplicates_collapsed(self):
+		index = KnownIdIndex.KnownIdIndex([self.url(1), self.url(1), self.url(2)])
+		self.assertEqual(len(index), 2)
+
+	def test_update(self):
+		index = KnownIdIndex.KnownIdIndex(self.url(idx) for idx in range(10))
+		index.add(self.url(10))
+		index.update(self.url(idx) for idx in range(5, 20))
+
+		for idx in range(20):
+			self.assertIn(self.url(idx), index)
+		self.assertNotIn(self.url(20), index)
+
+		# Ids that were already there aren't counted twice.
+		self.assertEqual(len(index), 20)
+
+	def test_non_str_ids(self):
+		index = KnownIdIndex.KnownIdIndex([1234, "5678"])
+		self.assertIn(1234, index)
+		self.assertIn(5678, index)
+
+		# Same as the text the DB gives back.
+		self.assertIn("1234", index)
+		self.assertNotIn(91011, index)
+
+		index.add(91011)
+		self.assertIn("91011", index)
+		self.assertEqual(len(index), 3)
@@ -0,0 +1,271 @@
+
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import MangaCMS.lib.MemoryBudget as MemoryBudget
+import MangaCMS.ScrapePlugins.RetreivalBase as RetreivalBase
+
+
+class StubWg(object):
+	cj = "cookie jar"
+
+	def getpage(self, url):
+		return b"x" * 100
+
+	def getSoup(self, url):
+		return object()
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+	def run_in_thread(self, func):
+		'''
+		Run `func` on another thread. Returns (started, done) events.
+		'''
+		started = threading.Event()
+		done    = threading.Event()
+		def worker():
+			started.set()
+			func()
+			done.set()
+		thread = threading.Thread(target=worker, daemon=True)
+		thread.start()
+		self.addCleanup(thread.join, 5)
+		return started, done
+
+	def test_reservation_holds_floor(self):
+		budget = MemoryBudget.MemoryBudget(limit=1000)
+		with budget.reservation(100) as res:
+			self.assertEqual(budget.in_flight, 100)
+
+			# Charges within the estimate don't change what's held.
+			res.charge(60)
+			self.assertEqual(budget.in_flight, 100)
+
+			# Beyond it, the actual usage is held.
+			res.charge(90)
+			self.assertEqual(budget.in_flight, 150)
+			res.release(90)
+			self.assertEqual(budget.in_flight, 100)
+
+		self.assertEqual(budget.in_flight, 0)
+		self.assertEqual(budget.running, [])
+
+	def test_released_on_exception(self):
+		budget = MemoryBudget.MemoryBudget(limit=1000)
+		with self.assertRaises(RuntimeError):
+			with budget.reservation(100) as res:
+				res.charge(500)
+				raise RuntimeError("Fetch failed")
+
+		self.assertEqual(budget.in_flight, 0)
+		self.assertEqual(budget.running, [])
+		self.assertIsNone(MemoryBudget.current_reservation())
+
+	def test_backpressure(self):
+		budget = MemoryBudget.MemoryBudget(limit=100)
+		first_done = threading.Event()
+
+		with budget.reservation(80):
+			def second():
+				with budget.reservation(50):
+					self.assertTrue(first_done.is_set())
+			started, done = self.run_in_thread(second)
+			self.assertTrue(started.wait(5))
+
+			# Doesn't fit until the first item is done.
+			self.assertFalse(done.wait(0.3))
+			first_done.set()
+
+		self.assertTrue(done.wait(5))
+		self.assertEqual(budget.in_flight, 0)
+
+	def test_oversized_item_admitted_alone(self):
+		budget = MemoryBudget.MemoryBudget(limit=100)
+
+		# Bigger than the whole budget, but with nothing else in flight it has
+		# to be let through, or it would never run.
+		with budget.reservation(500):
+			self.assertEqual(budget.in_flight, 500)
+
+			def small():
+				with budget.reservation(10):
+					pass
+			dummy_started, done = self.run_in_thread(small)
+			self.assertFalse(done.wait(0.3))
+
+		self.assertTrue(done.wait(5))
+		self.assertEqual(budget.in_flight, 0)
+
+	def test_oldest_item_never_waits(self):
+		budget = MemoryBudget.MemoryBudget(limit=100)
+		young_admitted = threading.Event()
+		young_fetch    = threading.Event()
+		young_fetched  = threading.Event()
+
+		with budget.reservation(40) as old:
+			def young():
+				with budget.reservation(40) as res:
+					young_admitted.set()
+					young_fetch.wait(5)
+					res.wait()
+					young_fetched.set()
+			self.run_in_thread(young)
+			self.assertTrue(young_admitted.wait(5))
+
+			# Over the limit. The oldest item still goes ahead, the younger one waits.
+			old.charge(200)
+			old.wait()
+			young_fetch.set()
+			self.assertFalse(young_fetched.wait(0.3))
+
+			old.release(200)
+			self.assertTrue(young_fetched.wait(5))
+
+	def test_charge_follows_thread(self):
+		budget = MemoryBudget.MemoryBudget(limit=1000)
+		with budget.reservation(10) as res:
+			MemoryBudget.charge(100)
+			self.assertEqual(res.used, 100)
+
+			# Work handed to another thread is charged to the same item, if bound.
+			bound = MemoryBudget.bind(lambda: MemoryBudget.charge(50))
+			thread = threading.Thread(target=bound)
+			thread.start()
+			thread.join()
+			self.assertEqual(res.used, 150)
+
+			MemoryBudget.release(150)
+			self.assertEqual(res.used, 0)
+
+		# Outside of a reservation, nothing to charge.
+		MemoryBudget.charge(100)
+		self.assertIsNone(MemoryBudget.current_reservation())
+
+	def test_budgeted_wg(self):
+		budget = MemoryBudget.MemoryBudget(limit=1000)
+		wg = MemoryBudget.BudgetedWebGet(StubWg())
+		self.assertEqual(wg.cj, "cookie jar")
+
+		with budget.reservation(10) as res:
+			self.assertEqual(wg.getpage("https://www.example.org/"), b"x" * 100)
+			self.assertEqual(res.used, 100)
+
+			# Parsed pages aren't content, and aren't budgeted.
+			wg.getSoup("https://www.example.org/")
+			self.assertEqual(res.used, 100)
+
+		# Fine without a reservation too.
+		self.assertEqual(wg.getpage("https://www.example.org/"), b"x" * 100)
+
+	def test_save_archive_releases_on_error(self):
+		patch = unittest.mock.patch.object(RetreivalBase, "prep_check_fq_filename", lambda fqfilename: fqfilename)
+		patch.start()
+		self.addCleanup(patch.stop)
+
+		tmp_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, tmp_dir)
+
+		def get_create_file_row(*args, **kwargs):
+			raise RuntimeError("DB went away")
+		fetcher = unittest.mock.Mock(log=logging.getLogger("Main.Test"), get_create_file_row=get_create_file_row)
+
+		budget = MemoryBudget.MemoryBudget(limit=1000)
+		content = os.urandom(300)
+		with budget.reservation(10) as res:
+			MemoryBudget.charge(len(content))
+			with self.assertRaises(RuntimeError):
+				RetreivalBase.RetreivalBase.save_archive(fetcher, None, None, os.path.join(tmp_dir, "test.zip"), content)
+			self.assertEqual(res.used, 0)
+
+
+class TestHostByteCounter(unittest.TestCase):
+
+	def setUp(self):
+		tmp_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, tmp_dir)
+		self.path = os.path.join(tmp_dir, "budget")
+
+	def dead_pid(self):
+		pid = os.fork()
+		if not pid:
+			os._exit(0)
+		os.waitpid(pid, 0)
+		return pid
+
+	def test_try_add(self):
+		counter = MemoryBudget.HostByteCounter(self.path)
+		self.assertTrue(counter.try_add(80, 100))
+		self.assertFalse(counter.try_add(30, 100))
+		self.assertTrue(counter.try_add(20, 100))
+		self.assertEqual(counter.total(), 100)
+
+		counter.add(-100)
+		self.assertEqual(counter.total(), 0)
+
+		# With nothing in flight, anything fits.
+		self.assertTrue(counter.try_add(500, 100))
+
+	def test_never_negative(self):
+		counter = MemoryBudget.HostByteCounter(self.path)
+		counter.add(10)
+		counter.add(-50)
+		self.assertEqual(counter.total(), 0)
+
+	def test_dead_process_cleared(self):
+		counter = MemoryBudget.HostByteCounter(self.path)
+		counter.add(10)
+
+		pid = self.dead_pid()
+		with counter._locked():
+			counter._write(counter.SLOTS - 1, pid, 1000)
+		self.assertEqual(counter.total(), 10)
+		self.assertEqual(counter._read(counter.SLOTS - 1), (0, 0))
+
+	def test_forked_child_uses_own_slot(self):
+		counter = MemoryBudget.HostByteCounter(self.path)
+		counter.add(10)
+		parent_slot = counter.slot
+
+		read_fd, write_fd = os.pipe()
+		pid = os.fork()
+		if not pid:
+			try:
+				os.close(read_fd)
+				counter.add(100)
+				os.write(write_fd, ("%s %s %s" % (counter.slot, counter.total(), counter._read(parent_slot)[1])).encode("ascii"))
+			finally:
+				os._exit(0)
+
+		os.close(write_fd)
+		child_slot, child_total, parent_bytes = [int(tmp) for tmp in os.read(read_fd, 100).split()]
+		os.close(read_fd)
+		os.waitpid(pid, 0)
+
+		self.assertNotEqual(child_slot, parent_slot)
+		self.assertEqual(child_total, 110)
+		self.assertEqual(parent_bytes, 10)
+
+		# And once the child is gone, its bytes are too.
+		self.assertEqual(counter.total(), 10)
+
+	def test_budget_per_process(self):
+		settings = MemoryBudget.settings
+		with unittest.mock.patch.object(settings, "fetchMemoryBudget", 1000, create=True),       \
+				unittest.mock.patch.object(settings, "fetchHostMemoryBudget", None, create=True), \
+				unittest.mock.patch.object(MemoryBudget, "_MEMORY_BUDGET", None),                \
+				unittest.mock.patch.object(MemoryBudget, "_MEMORY_BUDGET_PID", None):
+			budget = MemoryBudget.get_memory_budget()
+			self.assertIs(MemoryBudget.get_memory_budget(), budget)
+
+			with unittest.mock.patch.object(MemoryBudget.os, "getpid", return_value=os.getpid() + 1):
+				self.assertIsNot(MemoryBudget.get_memory_budget(), budget)
+
+		with unittest.mock.patch.object(settings, "fetchMemoryBudget", None, create=True),       \
+				unittest.mock.patch.object(settings, "fetchHostMemoryBudget", None, create=True):
+			self.assertIsNone(MemoryBudget.get_memory_budget())
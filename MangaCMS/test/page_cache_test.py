@@ -0,0 +1,103 @@
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import MangaCMS.ScrapePlugins.PageCache as PageCache
+
+
+class TestPageCache(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+	def make_cache(self, max_bytes=1024 * 1024, ttl=60 * 60):
+		return PageCache.PageCache(os.path.join(self.tmp_dir, "cache"), max_bytes, ttl)
+
+	def url(self, idx):
+		return "https://www.example.org/chapter/1/page/%03d.jpg" % idx
+
+	def set_last_used(self, cache, url, age):
+		last_used = time.time() - age
+		os.utime(cache._path(url), (last_used, last_used))
+
+	def test_put_get(self):
+		cache = self.make_cache()
+		content = os.urandom(1000)
+		cache.put(self.url(1), "001.jpg", content)
+
+		self.assertEqual(cache.get(self.url(1)), ("001.jpg", content))
+		self.assertEqual(cache.get(self.url(2)), None)
+
+	def test_expired_entry_is_a_miss(self):
+		cache = self.make_cache(ttl=60)
+		cache.put(self.url(1), "001.jpg", os.urandom(1000))
+
+		with unittest.mock.patch.object(PageCache.time, "time", return_value=time.time() + 120):
+			self.assertEqual(cache.get(self.url(1)), None)
+		self.assertFalse(os.path.exists(cache._path(self.url(1))))
+
+	def test_discard(self):
+		cache = self.make_cache()
+		cache.put(self.url(1), "001.jpg", os.urandom(1000))
+		cache.put(self.url(2), "002.jpg", os.urandom(1000))
+		size = os.path.getsize(cache._path(self.url(1)))
+		before = cache.cur_bytes
+
+		cache.discard(self.url(1))
+		self.assertEqual(cache.get(self.url(1)), None)
+		self.assertEqual(cache.cur_bytes, before - size)
+
+		# Discarding something that isn't there is fine.
+		cache.discard(self.url(1))
+		self.assertEqual(cache.cur_bytes, before - size)
+
+	def test_evicts_least_recently_used(self):
+		cache = self.make_cache()
+		for idx in range(3):
+			cache.put(self.url(idx), "%03d.jpg" % idx, os.urandom(1000))
+			self.set_last_used(cache, self.url(idx), 300 - idx * 100)
+
+		# Hitting the oldest entry makes it the most recently used.
+		self.assertIsNotNone(cache.get(self.url(0)))
+
+		# Room for three entries (with some slack), but not four.
+		entry_size = os.path.getsize(cache._path(self.url(0)))
+		cache.max_bytes = int(entry_size * 3.5)
+		cache.put(self.url(3), "003.jpg", os.urandom(1000))
+
+		self.assertIsNotNone(cache.get(self.url(0)))
+		self.assertIsNone(cache.get(self.url(1)))
+		self.assertIsNotNone(cache.get(self.url(2)))
+		self.assertIsNotNone(cache.get(self.url(3)))
+		self.assertLessEqual(cache.cur_bytes, cache.max_bytes * 0.9)
+		self.assertEqual(cache.cur_bytes, sum(size for dummy_path, size, dummy_mtime in cache._entries()))
+
+	def test_evicts_down_to_target(self):
+		cache = self.make_cache()
+		for idx in range(10):
+			cache.put(self.url(idx), "%03d.jpg" % idx, os.urandom(1000))
+			self.set_last_used(cache, self.url(idx), 1000 - idx * 10)
+
+		entry_size = os.path.getsize(cache._path(self.url(0)))
+		cache.max_bytes = entry_size * 5
+		cache.evict()
+
+		# Down to 90% of the limit, keeping the newest.
+		remaining = [idx for idx in range(10) if os.path.exists(cache._path(self.url(idx)))]
+		self.assertEqual(remaining, [6, 7, 8, 9])
+
+	def test_evict_removes_expired(self):
+		cache = self.make_cache(ttl=60)
+		cache.put(self.url(1), "001.jpg", os.urandom(1000))
+		cache.put(self.url(2), "002.jpg", os.urandom(1000))
+		self.set_last_used(cache, self.url(1), 120)
+
+		# Well under the size limit, but the stale entry still goes.
+		cache.evict()
+		self.assertFalse(os.path.exists(cache._path(self.url(1))))
+		self.assertTrue(os.path.exists(cache._path(self.url(2))))
@@ -0,0 +1,225 @@
+
+import uuid
+import datetime
+import unittest
+import unittest.mock
+
+import MangaCMS.lib.logSetup
+import MangaCMS.lib.RateLimit as RateLimit
+from MangaCMS import db as mdb
+from MangaCMS.db import db_models as db_models
+
+import settings
+assert "test" in settings.NEW_DATABASE_DB_NAME.lower(), "Running tests on non-test database!"
+
+
+class FakeClock(object):
+	'''
+	Stands in for the `time` module in RateLimit, so waits are recorded
+	rather than slept through.
+	'''
+	def __init__(self):
+		self.now = 1000.0
+		self.slept = 0.0
+
+	def monotonic(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.now += seconds
+		self.slept += seconds
+
+
+class StubWg(object):
+	def __init__(self):
+		self.cj = "cookie jar"
+		self.calls = []
+
+	def getpage(self, url, *args, **kwargs):
+		self.calls.append(("getpage", url, args, kwargs))
+		return b"x" * 100
+
+	def getFileAndName(self, url, *args, **kwargs):
+		self.calls.append(("getFileAndName", url, args, kwargs))
+		return b"y" * 50, "file.zip"
+
+	def getSoup(self, url, *args, **kwargs):
+		self.calls.append(("getSoup", url, args, kwargs))
+		return object()
+
+	def getJson(self, url, *args, **kwargs):
+		raise ValueError("Bad json")
+
+
+class StubBucket(object):
+	def __init__(self):
+		self.events = []
+
+	def acquire(self, url):
+		self.events.append(("acquire", url))
+
+	def consume_bytes(self, url, nbytes):
+		self.events.append(("consume", url, nbytes))
+
+
+class TestRateLimitedWebGet(unittest.TestCase):
+
+	def setUp(self):
+		self.wg     = StubWg()
+		self.bucket = StubBucket()
+		self.limited = RateLimit.RateLimitedWebGet(self.wg, self.bucket)
+
+	def test_fetch_charged(self):
+		url = "https://www.example.org/page"
+		self.assertEqual(self.limited.getpage(url, addlHeaders={'a' : 'b'}), b"x" * 100)
+		self.assertEqual(self.wg.calls, [("getpage", url, (), {'addlHeaders' : {'a' : 'b'}})])
+		self.assertEqual(self.bucket.events, [("acquire", url), ("consume", url, 100)])
+
+	def test_tuple_result_charged(self):
+		url = "https://www.example.org/file"
+		self.assertEqual(self.limited.getFileAndName(url), (b"y" * 50, "file.zip"))
+		self.assertEqual(self.bucket.events, [("acquire", url), ("consume", url, 50)])
+
+	def test_parsed_result_not_counted(self):
+		url = "https://www.example.org/page"
+		self.limited.getSoup(url)
+		self.assertEqual(self.bucket.events, [("acquire", url), ("consume", url, 0)])
+
+	def test_failed_fetch(self):
+		url = "https://www.example.org/json"
+		with self.assertRaises(ValueError):
+			self.limited.getJson(url)
+
+		# The request went out, so it's charged, but there's no response to count.
+		self.assertEqual(self.bucket.events, [("acquire", url)])
+
+	def test_passthrough(self):
+		self.assertEqual(self.limited.cj, "cookie jar")
+		self.assertEqual(self.bucket.events, [])
+
+	def test_response_size(self):
+		self.assertEqual(RateLimit.response_size(b"abc"), 3)
+		self.assertEqual(RateLimit.response_size("abcd"), 4)
+		self.assertEqual(RateLimit.response_size((b"abcde", "name", "mime")), 5)
+		self.assertEqual(RateLimit.response_size(()), 0)
+		self.assertEqual(RateLimit.response_size(None), 0)
+		self.assertEqual(RateLimit.response_size({'json' : True}), 0)
+
+
+class TestSharedTokenBucket(unittest.TestCase):
+
+	def setUp(self):
+		MangaCMS.lib.logSetup.DISABLE_REENTRANT_WARNING=True
+		MangaCMS.lib.logSetup.initLogging(logToDb=False)
+
+		self.host = "test-%s.example.org" % uuid.uuid4().hex
+		self.url  = "https://%s/page" % self.host
+		self.addCleanup(self.dropRows)
+
+		self.clock = FakeClock()
+		patch = unittest.mock.patch.object(RateLimit, "time", self.clock)
+		patch.start()
+		self.addCleanup(patch.stop)
+
+	def dropRows(self):
+		with mdb.session_context() as sess:
+			sess.query(db_models.RateLimitBucket)                          \
+				.filter(db_models.RateLimitBucket.host == self.host)       \
+				.delete(synchronize_session=False)
+
+	def idle_for(self, seconds):
+		'''
+		Pretend the bucket was last touched `seconds` ago.
+		'''
+		with mdb.session_context() as sess:
+			sess.query(db_models.RateLimitBucket)                          \
+				.filter(db_models.RateLimitBucket.host == self.host)       \
+				.update({'updated_at' : db_models.RateLimitBucket.updated_at - datetime.timedelta(seconds=seconds)}, synchronize_session=False)
+
+	def test_new_bucket_starts_full(self):
+		bucket = RateLimit.SharedTokenBucket(requests_per_sec=1, burst=3)
+		tokens, byte_tokens = bucket._debit(self.host, 1, 0)
+		self.assertAlmostEqual(tokens, 2, delta=0.1)
+		self.assertEqual(byte_tokens, 0)
+
+	def test_goes_negative(self):
+		# Only a handful of milliseconds pass between debits, at one token
+		# a second, so refill is negligible.
+		bucket = RateLimit.SharedTokenBucket(requests_per_sec=1, burst=2)
+		for expected in (1, 0, -1, -2):
+			tokens, dummy_byte_tokens = bucket._debit(self.host, 1, 0)
+			self.assertAlmostEqual(tokens, expected, delta=0.1)
+
+	def test_refill(self):
+		bucket = RateLimit.SharedTokenBucket(requests_per_sec=2, burst=10)
+		for dummy_idx in range(10):
+			bucket._debit(self.host, 1, 0)
+
+		# Five seconds at two a second.
+		self.idle_for(5)
+		tokens, dummy_byte_tokens = bucket._debit(self.host, 0, 0)
+		self.assertAlmostEqual(tokens, 10, delta=0.2)
+
+	def test_refill_capped_at_burst(self):
+		bucket = RateLimit.SharedTokenBucket(requests_per_sec=1, burst=3)
+		bucket._debit(self.host, 1, 0)
+		self.idle_for(1000)
+		tokens, dummy_byte_tokens = bucket._debit(self.host, 1, 0)
+		self.assertEqual(tokens, 2)
+
+	def test_byte_budget(self):
+		bucket = RateLimit.SharedTokenBucket(bytes_per_sec=1000, burst=2)
+		bucket.acquire(self.url)
+		bucket.consume_bytes(self.url, 500)
+		tokens, byte_tokens = bucket._debit(self.host, 0, 0)
+
+		# No request limit, so requests aren't counted.
+		self.assertEqual(tokens, 0)
+		self.assertAlmostEqual(byte_tokens, 1500, delta=50)
+
+	def test_request_budget_ignores_bytes(self):
+		bucket = RateLimit.SharedTokenBucket(requests_per_sec=1, burst=3)
+		bucket.consume_bytes(self.url, 10 ** 9)
+		bucket.acquire(self.url)
+		tokens, byte_tokens = bucket._debit(self.host, 0, 0)
+		self.assertAlmostEqual(tokens, 2, delta=0.1)
+		self.assertEqual(byte_tokens, 0)
+
+	def test_acquire_waits_for_deficit(self):
+		bucket = RateLimit.SharedTokenBucket(requests_per_sec=2, burst=1)
+		bucket.acquire(self.url)
+		self.assertEqual(self.clock.slept, 0)
+
+		# Second and third callers queue behind each other, half a second apart.
+		bucket.acquire(self.url)
+		self.assertAlmostEqual(self.clock.slept, 0.5, delta=0.1)
+		bucket.acquire(self.url)
+		self.assertAlmostEqual(self.clock.slept, 0.5 + 1.0, delta=0.2)
+
+	def test_acquire_waits_for_bytes(self):
+		bucket = RateLimit.SharedTokenBucket(bytes_per_sec=1000, burst=1)
+		bucket.acquire(self.url)
+		bucket.consume_bytes(self.url, 3000)
+		self.assertEqual(self.clock.slept, 0)
+
+		# 2000 bytes in the red, at 1000 a second.
+		bucket.acquire(self.url)
+		self.assertAlmostEqual(self.clock.slept, 2.0, delta=0.1)
+
+	def test_hosts_are_separate(self):
+		bucket = RateLimit.SharedTokenBucket(requests_per_sec=1, burst=1)
+		bucket.acquire(self.url)
+		bucket.acquire("https://%s/other/path" % self.host.upper())
+		self.assertGreater(self.clock.slept, 0.5)
+
+		other_host = "other-" + self.host
+		self.addCleanup(self._drop_host, other_host)
+		slept = self.clock.slept
+		bucket.acquire("https://%s/page" % other_host)
+		self.assertEqual(self.clock.slept, slept)
+
+	def _drop_host(self, host):
+		with mdb.session_context() as sess:
+			sess.query(db_models.RateLimitBucket)                          \
+				.filter(db_models.RateLimitBucket.host == host)            \
+				.delete(synchronize_session=False)
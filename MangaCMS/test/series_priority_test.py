@@ -0,0 +1,166 @@
+
+import uuid
+import logging
+import datetime
+import unittest
+import unittest.mock
+
+import MangaCMS.lib.logSetup
+import MangaCMS.lib.SeriesPriority as SeriesPriority
+import MangaCMS.ScrapePlugins.RetreivalBase as RetreivalBase
+from MangaCMS import db as mdb
+
+import settings
+assert "test" in settings.NEW_DATABASE_DB_NAME.lower(), "Running tests on non-test database!"
+
+
+class StubNameTools(object):
+	'''
+	Stands in for nameTools. `dirs` maps series names to their folder rating
+	(or "" for an unrated folder), and lookups are counted.
+	'''
+	def __init__(self, dirs):
+		self.dirs    = dirs
+		self.lookups = 0
+
+	def getMangaUpdatesId(self, series_name):
+		self.lookups += 1
+		return None
+
+	def prepFilenameForMatching(self, series_name):
+		return series_name.lower()
+
+	def ratingStrToFloat(self, rating):
+		return float(len(rating))
+
+	@property
+	def dirNameProxy(self):
+		return self
+
+	def __getitem__(self, series_name):
+		if series_name in self.dirs:
+			return {'fqPath' : "/manga/" + series_name, 'rating' : self.dirs[series_name]}
+		return {'fqPath' : None, 'rating' : None}
+
+
+class TestSeriesPriority(unittest.TestCase):
+
+	def setUp(self):
+		self.nt = StubNameTools({'Have' : "", 'Rated' : "+++"})
+		patch = unittest.mock.patch.object(SeriesPriority, "nt", self.nt)
+		patch.start()
+		self.addCleanup(patch.stop)
+
+		self.priority = SeriesPriority.SeriesPriority()
+		self.priority._load_watch_list = lambda: (set(), set(['watched']))
+
+	def test_scores(self):
+		scores = self.priority.scores(['Watched', 'Have', 'Rated', 'Unknown'])
+		self.assertEqual(scores, {'Watched' : 4, 'Have' : 2, 'Rated' : 5})
+
+	def test_scores_cached(self):
+		self.priority.scores(['Watched', 'Have', 'Unknown'])
+		lookups = self.nt.lookups
+		self.assertEqual(self.priority.scores(['Watched', 'Have', 'Unknown']), {'Watched' : 4, 'Have' : 2})
+		self.assertEqual(self.nt.lookups, lookups)
+
+		# Until the watch list is reloaded.
+		self.priority.refresh(force=True)
+		self.priority.scores(['Watched', 'Have', 'Unknown'])
+		self.assertEqual(self.nt.lookups, lookups * 2)
+
+	def test_cache_bounded(self):
+		self.priority.max_cached = 10
+		self.priority.scores(["Series %s" % idx for idx in range(25)])
+		self.assertLessEqual(len(self.priority.score_cache), 10)
+
+
+class StubPriority(object):
+	def __init__(self, scores):
+		self.scores_for = scores
+		self.asked      = []
+
+	def scores(self, series_names):
+		self.asked.extend(series_names)
+		return {name : self.scores_for[name] for name in series_names if self.scores_for.get(name)}
+
+
+class TodoFetcher(object):
+	_retreiveTodoLinksFromDB = RetreivalBase.RetreivalBase._retreiveTodoLinksFromDB
+	_has_python_delay        = RetreivalBase.RetreivalBase._has_python_delay
+	checkDelay               = RetreivalBase.RetreivalBase.checkDelay
+	todo_priority            = RetreivalBase.RetreivalBase.todo_priority
+	todo_state_predicate     = RetreivalBase.RetreivalBase.todo_state_predicate
+	todo_delay_predicate     = RetreivalBase.RetreivalBase.todo_delay_predicate
+
+	is_manga                   = True
+	use_series_priority        = True
+	series_priority_max_series = 500
+	fetch_delay                = None
+	itemLimit                  = None
+
+	def __init__(self, plugin_key):
+		self.log          = logging.getLogger("Main.Test")
+		self.db           = mdb
+		self.target_table = mdb.MangaReleases
+		self.plugin_key   = plugin_key
+
+
+class TestTodoOrdering(unittest.TestCase):
+
+	def setUp(self):
+		MangaCMS.lib.logSetup.DISABLE_REENTRANT_WARNING=True
+		MangaCMS.lib.logSetup.initLogging(logToDb=False)
+
+		self.fetcher = TodoFetcher("test-%s" % uuid.uuid4().hex)
+		self.addCleanup(self.dropRows)
+
+		self.priority = StubPriority({'Watched' : 4, 'Have' : 2})
+		patch = unittest.mock.patch.object(SeriesPriority, "get_series_priority", lambda: self.priority)
+		patch.start()
+		self.addCleanup(patch.stop)
+
+		# Newest first: the unscored series, then the two scored ones.
+		now = datetime.datetime.now()
+		self.ids    = {}
+		self.by_age = []
+		with mdb.session_context() as sess:
+			for age, series_name in enumerate(['Unknown', 'Unknown', 'Have', 'Watched', 'Have', 'Watched']):
+				row = mdb.MangaReleases(
+						source_site = self.fetcher.plugin_key,
+						source_id   = uuid.uuid4().hex,
+						state       = 'new',
+						first_seen  = now,
+						posted_at   = now - datetime.timedelta(hours=age),
+						series_name = series_name,
+					)
+				sess.add(row)
+				sess.flush()
+				self.ids.setdefault(series_name, []).append(row.id)
+				self.by_age.append(row.id)
+
+	def dropRows(self):
+		with mdb.session_context() as sess:
+			sess.query(mdb.MangaReleases)                                           \
+				.filter(mdb.MangaReleases.source_site == self.fetcher.plugin_key)   \
+				.delete(synchronize_session=False)
+
+	def test_priority_order(self):
+		# Highest score first, newest first within a score.
+		self.assertEqual(self.fetcher._retreiveTodoLinksFromDB(), self.ids['Watched'] + self.ids['Have'] + self.ids['Unknown'])
+		self.assertEqual(sorted(self.priority.asked), ['Have', 'Unknown', 'Watched'])
+
+	def test_item_limit(self):
+		self.fetcher.itemLimit = 3
+		self.assertEqual(self.fetcher._retreiveTodoLinksFromDB(), self.ids['Watched'] + self.ids['Have'][:1])
+
+	def test_scored_series_capped(self):
+		# Only the series with the most recent items get scored.
+		self.fetcher.series_priority_max_series = 2
+		self.assertEqual(self.fetcher._retreiveTodoLinksFromDB(), self.ids['Have'] + self.ids['Unknown'] + self.ids['Watched'])
+		self.assertEqual(sorted(self.priority.asked), ['Have', 'Unknown'])
+
+	def test_disabled(self):
+		self.fetcher.use_series_priority = False
+		self.assertEqual(self.fetcher._retreiveTodoLinksFromDB(), self.by_age)
+		self.assertEqual(self.priority.asked, [])
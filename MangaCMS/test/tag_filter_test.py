@@ -0,0 +1,70 @@
+
+import random
+import unittest
+
+import MangaCMS.lib.TagFilter as TagFilter
+
+
+KEEP_TAGS = ['female', 'girl', 'yuri']
+SKIP_TAGS = ['male-only', 'guro', 'scat', 'gu']
+
+
+class TestTagFilter(unittest.TestCase):
+
+	def setUp(self):
+		self.tag_filter = TagFilter.TagFilter(KEEP_TAGS, SKIP_TAGS)
+
+	def test_no_skip_tag(self):
+		self.assertTrue(self.tag_filter.wanted(['female-glasses', 'full-color']))
+		self.assertTrue(self.tag_filter.wanted([]))
+
+	def test_skip_tag(self):
+		self.assertFalse(self.tag_filter.wanted(['guro', 'full-color']))
+		self.assertEqual(self.tag_filter.masked_by(['guro', 'full-color']), ['guro'])
+
+	def test_skip_tag_is_a_substring_match(self):
+		# As with the original check, a skip tag anywhere in the list counts.
+		self.assertTrue(self.tag_filter.has_skip_tag(['big-scatter']))
+		self.assertEqual(self.tag_filter.masked_by(['big-scatter']), [])
+
+	def test_keep_tag_overrides_skip_tag(self):
+		self.assertTrue(self.tag_filter.wanted(['guro', 'yuri']))
+		self.assertTrue(self.tag_filter.wanted(['guro', 'female-glasses']))
+
+	def test_excluded_keep_tags(self):
+		for tag in TagFilter.KEEP_EXCLUDED_TAGS:
+			self.assertFalse(self.tag_filter.is_keep_tag(tag), tag)
+			self.assertFalse(self.tag_filter.wanted(['guro', tag]), tag)
+
+		for tag in ['artist-girlfriend', 'Fetish-female', 'male-girl', 'PARODY-yuri']:
+			self.assertFalse(self.tag_filter.is_keep_tag(tag), tag)
+
+	def test_empty_lists(self):
+		# An empty alternation would match everything.
+		tag_filter = TagFilter.TagFilter([], [])
+		self.assertTrue(tag_filter.wanted(['guro']))
+		self.assertFalse(tag_filter.is_keep_tag('female'))
+
+		tag_filter = TagFilter.TagFilter([], SKIP_TAGS)
+		self.assertFalse(tag_filter.wanted(['guro', 'yuri']))
+
+	def test_regex_characters_escaped(self):
+		tag_filter = TagFilter.TagFilter(['c++'], ['a.b'])
+		self.assertFalse(tag_filter.has_skip_tag(['axb']))
+		self.assertTrue(tag_filter.has_skip_tag(['a.b']))
+		self.assertTrue(tag_filter.is_keep_tag('c++'))
+		self.assertFalse(tag_filter.is_keep_tag('ccc'))
+
+	def test_matches_reference(self):
+		vocab = list(TagFilter.KEEP_EXCLUDED_TAGS) + KEEP_TAGS + SKIP_TAGS + [
+				'artist-yuri', 'male-girl', 'full-color', 'big-scatter', 'female-glasses',
+				'schoolgirl-uniform', 'tankoubon', 'guro-lite', 'x',
+			]
+		rng = random.Random(1234)
+		tag_lists = [rng.sample(vocab, rng.randint(0, 6)) for dummy_idx in range(2000)]
+
+		expected = [TagFilter._reference_wanted(tags, KEEP_TAGS, SKIP_TAGS) for tags in tag_lists]
+		self.assertEqual([self.tag_filter.wanted(tags) for tags in tag_lists], expected)
+		self.assertEqual(self.tag_filter.wanted_many(tag_lists), expected)
+		self.assertIn(True, expected)
+		self.assertIn(False, expected)
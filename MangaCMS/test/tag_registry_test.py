@@ -0,0 +1,114 @@
+
+import uuid
+import unittest
+
+import MangaCMS.lib.logSetup
+from MangaCMS import db as mdb
+from MangaCMS.db import db_models as db_models
+
+import settings
+assert "test" in settings.NEW_DATABASE_DB_NAME.lower(), "Running tests on non-test database!"
+
+
+class TestTagRegistry(unittest.TestCase):
+
+	def setUp(self):
+		MangaCMS.lib.logSetup.DISABLE_REENTRANT_WARNING=True
+		MangaCMS.lib.logSetup.initLogging(logToDb=False)
+
+		self.prefix = "test-tag-%s" % uuid.uuid4().hex
+		self.registry = db_models.HentaiTags.registry
+		self.addCleanup(self.dropRows)
+
+	def dropRows(self):
+		with mdb.session_context() as sess:
+			file_ids = sess.query(db_models.ReleaseFile.id).filter(db_models.ReleaseFile.dirpath == self.prefix)
+			link_tbl = db_models.hentai_files_tags_link
+			sess.execute(link_tbl.delete().where(link_tbl.c.releases_id.in_(file_ids.subquery())))
+			sess.query(db_models.ReleaseFile)                                      \
+				.filter(db_models.ReleaseFile.dirpath == self.prefix)              \
+				.delete(synchronize_session=False)
+			sess.query(db_models.HentaiTags)                                       \
+				.filter(db_models.HentaiTags.tag.like(self.prefix + "%"))          \
+				.delete(synchronize_session=False)
+		self.registry.invalidate()
+
+	def tag(self, name):
+		return "%s-%s" % (self.prefix, name)
+
+	def make_file(self, name):
+		with mdb.session_context() as sess:
+			row = db_models.ReleaseFile(dirpath=self.prefix, filename=name, fhash=uuid.uuid4().hex)
+			sess.add(row)
+			sess.flush()
+			return row.id
+
+	def get_tags(self, file_id):
+		with mdb.session_context(commit=False) as sess:
+			return set(sess.query(db_models.ReleaseFile).get(file_id).hentai_tags)
+
+	def test_new_tag_on_loaded_row(self):
+		file_id = self.make_file("one.zip")
+
+		with mdb.session_context() as sess:
+			row = sess.query(db_models.ReleaseFile).get(file_id)
+			self.assertEqual(set(row.hentai_tags), set())
+
+			# Neither tag exists yet, and the session already has a snapshot.
+			row.hentai_tags.add(self.tag("a"))
+			row.hentai_tags.add(self.tag("b"))
+
+		self.assertEqual(self.get_tags(file_id), set([self.tag("a"), self.tag("b")]))
+		self.assertIsNotNone(self.registry._cache_get(self.tag("a").lower()))
+
+	def test_new_tag_after_flush(self):
+		with mdb.session_context() as sess:
+			row = db_models.ReleaseFile(dirpath=self.prefix, filename="one.zip", fhash=uuid.uuid4().hex)
+			sess.add(row)
+			sess.flush()
+			row.hentai_tags.add(self.tag("a"))
+			file_id = row.id
+
+		self.assertEqual(self.get_tags(file_id), set([self.tag("a")]))
+
+	def test_link(self):
+		file_ids = [self.make_file("%s.zip" % idx) for idx in range(3)]
+
+		with mdb.session_context() as sess:
+			# Touch the table first, so the session's snapshot predates the tags.
+			sess.query(db_models.HentaiTags).first()
+
+			added = self.registry.link(sess, db_models.hentai_files_tags_link, {
+					file_ids[0] : [self.tag("a"), self.tag("b")],
+					file_ids[1] : [self.tag("b"), self.tag("c")],
+				})
+			self.assertEqual(added, 4)
+
+			# Already linked, so nothing new.
+			added = self.registry.link(sess, db_models.hentai_files_tags_link, {file_ids[0] : [self.tag("a")]})
+			self.assertEqual(added, 0)
+
+		self.assertEqual(self.get_tags(file_ids[0]), set([self.tag("a"), self.tag("b")]))
+		self.assertEqual(self.get_tags(file_ids[1]), set([self.tag("b"), self.tag("c")]))
+		self.assertEqual(self.get_tags(file_ids[2]), set())
+
+	def test_existing_tag(self):
+		with mdb.session_context() as sess:
+			tag_id = self.registry.resolve_one(sess, self.tag("a"))
+		self.registry.invalidate()
+
+		with mdb.session_context() as sess:
+			self.assertEqual(self.registry.resolve(sess, [self.tag("A")]), {self.tag("a").lower() : tag_id})
+
+	def test_rolled_back_ids_not_cached(self):
+		class Abort(Exception):
+			pass
+
+		with self.assertRaises(Abort):
+			with mdb.session_context() as sess:
+				self.registry.resolve_one(sess, self.tag("a"))
+				raise Abort()
+
+		self.assertIsNone(self.registry._cache_get(self.tag("a").lower()))
+		with mdb.session_context(commit=False) as sess:
+			self.assertEqual(sess.query(db_models.HentaiTags).filter(db_models.HentaiTags.tag == self.tag("a")).count(), 0)
@@ -0,0 +1,283 @@
+
+import os
+import uuid
+import shutil
+import datetime
+import tempfile
+import unittest
+
+import MangaCMS.lib.logSetup
+from MangaCMS import db as mdb
+from MangaCMS.db import db_models as db_models
+
+import UploadPlugins.Madokami.uploadQueue as uploadQueue
+
+import settings
+assert "test" in settings.NEW_DATABASE_DB_NAME.lower(), "Running tests on non-test database!"
+
+
+class FakeSftp(object):
+	'''
+	Stand-in for a paramiko SFTPClient, backed by a local directory.
+	'''
+
+	# Number of puts that fail before they start working.
+	fail_puts = 0
+
+	def __init__(self, root):
+		self.root   = root
+		self.closed = False
+
+	def _local(self, path):
+		return os.path.join(self.root, path.lstrip("/"))
+
+	def mkdir(self, path):
+		os.makedirs(self._local(path))
+
+	def put(self, local_path, remote_path):
+		if FakeSftp.fail_puts:
+			FakeSftp.fail_puts -= 1
+			raise IOError("Fake upload failure")
+		shutil.copy(local_path, self._local(remote_path))
+
+	def close(self):
+		self.closed = True
+
+
+class FakeSsh(object):
+	def close(self):
+		pass
+
+
+class FakeUploader(object):
+	'''
+	Just enough of MkUploader for the upload queue, working against the
+	session it gets from `connect`.
+	'''
+
+	instances = []
+
+	def __init__(self, connect):
+		self.ssh, self.sftp = connect(log=None)
+		self.pending_dirs = set()
+		FakeUploader.instances.append(self)
+
+	def is_connected(self):
+		return bool(self.sftp and not self.sftp.closed)
+
+	def close(self):
+		if self.sftp:
+			self.sftp.close()
+
+	def resolveUploadDirectory(self, seriesName, filePath, create=True):
+		ulDir = "/Manga/%s" % seriesName
+		if not os.path.exists(self.sftp._local(ulDir)):
+			self.pending_dirs.add(ulDir)
+		return ulDir
+
+	def create_pending_dirs(self):
+		for ulDir in self.pending_dirs:
+			if not os.path.exists(self.sftp._local(ulDir)):
+				self.sftp.mkdir(ulDir)
+		self.pending_dirs = set()
+
+	def uploadToDirectory(self, seriesName, filePath, ulDir, db_commit=True, attempts=50):
+		fqUploadPath = os.path.join(ulDir, os.path.basename(filePath))
+		self.sftp.put(filePath, fqUploadPath)
+		return fqUploadPath
+
+
+class TestUploadQueue(unittest.TestCase):
+
+	def setUp(self):
+		MangaCMS.lib.logSetup.DISABLE_REENTRANT_WARNING=True
+		MangaCMS.lib.logSetup.initLogging(logToDb=False)
+
+		self.local_dir  = tempfile.mkdtemp()
+		self.remote_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.local_dir)
+		self.addCleanup(shutil.rmtree, self.remote_dir)
+		self.addCleanup(self.dropRows)
+
+		FakeSftp.fail_puts = 0
+		FakeUploader.instances = []
+
+	def dropRows(self):
+		with mdb.session_context() as sess:
+			sess.query(db_models.MkUploadJob)                                  \
+				.filter(db_models.MkUploadJob.file_path.like(self.local_dir + "/%")) \
+				.delete(synchronize_session=False)
+			sess.query(db_models.ReleaseFile)                                  \
+				.filter(db_models.ReleaseFile.dirpath == self.local_dir)       \
+				.delete(synchronize_session=False)
+
+	def fake_connect(self, log=None):
+		return FakeSsh(), FakeSftp(self.remote_dir)
+
+	def worker(self, sessions=2):
+		return uploadQueue.UploadWorker(sessions=sessions, connect=self.fake_connect, make_uploader=FakeUploader)
+
+	def make_file(self, name, with_row=True):
+		fpath = os.path.join(self.local_dir, name)
+		with open(fpath, "wb") as fp:
+			fp.write(os.urandom(128))
+		if with_row:
+			with mdb.session_context() as sess:
+				sess.add(db_models.ReleaseFile(dirpath=self.local_dir, filename=name, fhash=uuid.uuid4().hex))
+		return fpath
+
+	def get_job(self, fpath):
+		with mdb.session_context(commit=False) as sess:
+			job = sess.query(db_models.MkUploadJob).filter(db_models.MkUploadJob.file_path == fpath).one()
+			sess.expunge(job)
+			return job
+
+	def get_upload_state(self, fpath):
+		dirpath, filename = os.path.split(fpath)
+		with mdb.session_context(commit=False) as sess:
+			return sess.query(db_models.ReleaseFile.mk_upload_state)       \
+				.filter(db_models.ReleaseFile.dirpath == dirpath)           \
+				.filter(db_models.ReleaseFile.filename == filename)         \
+				.scalar()
+
+	def make_due(self, fpath):
+		with mdb.session_context() as sess:
+			sess.query(db_models.MkUploadJob)                              \
+				.filter(db_models.MkUploadJob.file_path == fpath)          \
+				.update({'next_attempt' : datetime.datetime.now() - datetime.timedelta(minutes=1)})
+
+	def test_upload(self):
+		files = [self.make_file("chapter %s.zip" % idx) for idx in range(5)]
+		for fpath in files:
+			self.assertTrue(uploadQueue.enqueue("Test Series", fpath))
+			self.assertEqual(self.get_upload_state(fpath), 'pending')
+
+		self.assertEqual(self.worker().run(), len(files))
+
+		for fpath in files:
+			job = self.get_job(fpath)
+			self.assertEqual(job.state, 'complete')
+			self.assertEqual(job.attempts, 1)
+			self.assertEqual(job.remote_path, "/Manga/Test Series/%s" % os.path.basename(fpath))
+			self.assertTrue(os.path.exists(os.path.join(self.remote_dir, job.remote_path.lstrip("/"))))
+			self.assertEqual(self.get_upload_state(fpath), 'uploaded')
+
+		# The batch shares the pooled sessions, rather than one each.
+		self.assertLessEqual(len(FakeUploader.instances), 2)
+
+	def test_enqueue_twice(self):
+		fpath = self.make_file("chapter.zip")
+		uploadQueue.enqueue("Test Series", fpath)
+		self.worker().run()
+
+		# Already uploaded, so it isn't queued again.
+		uploadQueue.enqueue("Test Series", fpath)
+		self.assertEqual(self.get_job(fpath).state, 'complete')
+		self.assertEqual(self.get_upload_state(fpath), 'uploaded')
+
+	def test_failed_upload_backs_off(self):
+		fpath = self.make_file("chapter.zip")
+		uploadQueue.enqueue("Test Series", fpath)
+
+		FakeSftp.fail_puts = 1
+		before = datetime.datetime.now()
+		self.assertEqual(self.worker().run(), 1)
+
+		job = self.get_job(fpath)
+		self.assertEqual(job.state, 'queued')
+		self.assertEqual(job.attempts, 1)
+		self.assertTrue(job.err_str)
+		self.assertGreater(job.next_attempt, before + uploadQueue.UploadWorker.base_delay * 0.8)
+		self.assertEqual(self.get_upload_state(fpath), 'pending')
+
+		# Not due yet.
+		self.assertEqual(self.worker().claim(), [])
+
+		self.make_due(fpath)
+		self.assertEqual(self.worker().run(), 1)
+		job = self.get_job(fpath)
+		self.assertEqual(job.state, 'complete')
+		self.assertEqual(job.attempts, 2)
+		self.assertEqual(self.get_upload_state(fpath), 'uploaded')
+
+	def test_gives_up_after_max_attempts(self):
+		fpath = self.make_file("chapter.zip")
+		uploadQueue.enqueue("Test Series", fpath)
+
+		FakeSftp.fail_puts = 2
+		worker = self.worker()
+		worker.max_attempts = 2
+		worker.run()
+		self.make_due(fpath)
+		worker = self.worker()
+		worker.max_attempts = 2
+		worker.run()
+
+		job = self.get_job(fpath)
+		self.assertEqual(job.state, 'error')
+		self.assertEqual(job.attempts, 2)
+
+		# Queueing it again starts it over.
+		uploadQueue.enqueue("Test Series", fpath)
+		job = self.get_job(fpath)
+		self.assertEqual(job.state, 'queued')
+		self.assertEqual(job.attempts, 0)
+
+	def test_missing_file(self):
+		fpath = self.make_file("chapter.zip")
+		uploadQueue.enqueue("Test Series", fpath)
+		os.unlink(fpath)
+
+		self.worker().run()
+		self.assertEqual(self.get_job(fpath).state, 'error')
+		self.assertEqual(self.get_upload_state(fpath), 'skipped')
+
+	def test_expired_lease_reclaimed(self):
+		expired = self.make_file("expired.zip")
+		held    = self.make_file("held.zip")
+		for fpath in (expired, held):
+			uploadQueue.enqueue("Test Series", fpath)
+
+		now = datetime.datetime.now()
+		with mdb.session_context() as sess:
+			for fpath, lease_expires in ((expired, now - datetime.timedelta(minutes=1)), (held, now + datetime.timedelta(hours=1))):
+				sess.query(db_models.MkUploadJob)                          \
+					.filter(db_models.MkUploadJob.file_path == fpath)      \
+					.update({'state' : 'running', 'lease_owner' : 'dead-worker', 'lease_expires' : lease_expires, 'attempts' : 1})
+
+		claimed = self.worker().claim()
+		self.assertEqual([job['file_path'] for job in claimed], [expired])
+		self.assertEqual(claimed[0]['attempts'], 2)
+
+	def test_retry_delay(self):
+		worker = self.worker()
+		for attempts in range(1, 12):
+			expected = min(worker.max_delay, worker.base_delay * (2 ** (attempts - 1)))
+			delay = worker.retry_delay(attempts)
+			self.assertGreaterEqual(delay, expected * 0.9)
+			self.assertLessEqual(delay, expected * 1.1)
+
+	def test_pool_reuse(self):
+		pool = uploadQueue.UploaderPool(2, connect=self.fake_connect, make_uploader=FakeUploader)
+
+		with pool.uploader() as first:
+			pass
+		with pool.uploader() as second:
+			self.assertIs(second, first)
+
+		# Two at once need two sessions.
+		with pool.uploader() as first:
+			with pool.uploader() as second:
+				self.assertIsNot(second, first)
+		self.assertEqual(pool.created, 2)
+
+		# Dropped sessions are replaced, not handed out.
+		for up in FakeUploader.instances:
+			up.sftp.closed = True
+		with pool.uploader() as third:
+			self.assertTrue(third.is_connected())
+			self.assertNotIn(third, FakeUploader.instances[:2])
+		self.assertEqual(pool.created, 1)
+
+		pool.close()
+		self.assertEqual(pool.created, 0)
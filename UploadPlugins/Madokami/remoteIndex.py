@@ -0,0 +1,211 @@
+
+import os
+import stat
+import logging
+import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+import nameTools as nt
+import MangaCMS.db as db
+
+
+FAKEDIRS_URL = "https://manga.madokami.al/stupidapi/fakedirs"
+
+# The root row's `seen_at` records when the whole tree was last loaded.
+ROOT = "/"
+
+
+def normalize_path(path):
+	path = path.strip()
+	if path.startswith("./"):
+		path = path[1:]
+	if not path.startswith("/"):
+		path = "/" + path
+	if len(path) > 1:
+		path = path.rstrip("/")
+	return path
+
+
+def _entry(path, now, mtime=None):
+	parent, name = os.path.split(path)
+	canon_name = nt.getCanonicalMangaUpdatesName(name) if name else None
+	return {
+			'path'       : path,
+			'parent'     : parent,
+			'name'       : name,
+			'canon_name' : canon_name,
+			'match_name' : nt.prepFilenameForMatching(canon_name) if canon_name else None,
+			'mtime'      : mtime,
+			'seen_at'    : now,
+		}
+
+
+class RemoteDirIndex(object):
+	'''
+	Index of the directories on the Madokami server (in `mk_remote_dirs`),
+	with each directory's canonical series name, so finding where a series
+	lives is a local query rather than a walk of the remote tree.
+
+	 - `refresh()` reloads the tree from the fakedirs listing at most every
+	   `refresh_interval`. Only directories that have appeared since the last
+	   load have their names looked up, and ones that have gone are dropped.
+	 - `list_dir()` is the targeted fallback for a miss: it lists a single
+	   directory over SFTP, but only if its mtime has changed since it was
+	   last listed.
+	 - `added()`, `touched()` and `removed()` keep the index in step with the
+	   changes we make ourselves (mkdir, put, rename).
+	'''
+
+	refresh_interval = datetime.timedelta(hours=6)
+
+	def __init__(self, fetch_tree, log=None):
+		'''
+		`fetch_tree` is a callable returning the fakedirs listing (a newline
+		separated list of directory paths).
+		'''
+		self.fetch_tree = fetch_tree
+		self.log        = log or logging.getLogger("Main.Manga.Mk.Up.Index")
+		self.tbl        = db.MkRemoteDir.__table__
+
+	def _upsert(self, sess, entries, update_mtime=False):
+		if not entries:
+			return
+		stmt = postgresql.insert(self.tbl)
+		if update_mtime:
+			stmt = stmt.on_conflict_do_update(
+					index_elements = [self.tbl.c.path],
+					set_           = {'mtime' : stmt.excluded.mtime, 'seen_at' : stmt.excluded.seen_at},
+				)
+		else:
+			stmt = stmt.on_conflict_do_nothing()
+		sess.execute(stmt, entries)
+
+	def last_refresh(self):
+		with db.session_context(commit=False) as sess:
+			return sess.execute(sa.select([self.tbl.c.seen_at]).where(self.tbl.c.path == ROOT)).scalar()
+
+	def refresh(self, force=False):
+		now = datetime.datetime.now()
+		last = self.last_refresh()
+		if not force and last and last > now - self.refresh_interval:
+			return False
+
+		self.log.info("Refreshing remote directory index (last refreshed: %s)", last)
+		listing = self.fetch_tree()
+		remote = set(normalize_path(line) for line in listing.split("\n") if line.strip() and line.strip() != ".")
+		remote.discard(ROOT)
+
+		with db.session_context() as sess:
+			have = set(path for path, in sess.execute(sa.select([self.tbl.c.path]).where(self.tbl.c.path != ROOT)))
+
+			new  = remote - have
+			gone = have - remote
+
+			self._upsert(sess, [_entry(path, now) for path in sorted(new)])
+			if gone:
+				sess.execute(self.tbl.delete().where(self.tbl.c.path.in_(list(gone))))
+
+			self._upsert(sess, [_entry(ROOT, now)], update_mtime=True)
+
+		self.log.info("Remote directory index has %s directories (%s new, %s removed)", len(remote), len(new), len(gone))
+		return True
+
+	def entries_under(self, prefix):
+		'''
+		(path, name, canon_name, match_name) for every indexed directory
+		below `prefix`.
+		'''
+		prefix = normalize_path(prefix)
+		like = (prefix.rstrip("/") + "/").replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+		with db.session_context(commit=False) as sess:
+			return sess.execute(
+					sa.select([self.tbl.c.path, self.tbl.c.name, self.tbl.c.canon_name, self.tbl.c.match_name])
+						.where(self.tbl.c.path.like(like))
+						.order_by(self.tbl.c.path)
+				).fetchall()
+
+	def find(self, match_name, prefix=ROOT, depth=None):
+		'''
+		Paths of the directories below `prefix` for the series `match_name`
+		(as returned by nt.prepFilenameForMatching()). If `depth` is set, only
+		directories that are `depth` levels below the root are considered.
+		'''
+		if not match_name:
+			return []
+
+		prefix = normalize_path(prefix).rstrip("/") + "/"
+		with db.session_context(commit=False) as sess:
+			paths = [path for path, in sess.execute(
+					sa.select([self.tbl.c.path])
+						.where(self.tbl.c.match_name == match_name)
+						.order_by(self.tbl.c.path)
+				)]
+
+		paths = [path for path in paths if path.startswith(prefix)]
+		if depth is not None:
+			paths = [path for path in paths if path.count("/") == depth]
+		return paths
+
+	def list_dir(self, sftp, path):
+		'''
+		Bring the index entries for the children of `path` up to date, by
+		listing it over SFTP. Skipped if the directory hasn't been modified
+		since it was last listed. Returns whether it was listed.
+		'''
+		path = normalize_path(path)
+		now = datetime.datetime.now()
+		mtime = datetime.datetime.fromtimestamp(sftp.stat(path).st_mtime)
+
+		with db.session_context(commit=False) as sess:
+			have_mtime = sess.execute(sa.select([self.tbl.c.mtime]).where(self.tbl.c.path == path)).scalar()
+		if have_mtime and have_mtime == mtime:
+			return False
+
+		self.log.info("Listing remote directory %s", path)
+		children = [
+				_entry(os.path.join(path, attr.filename), now)
+			for
+				attr in sftp.listdir_attr(path)
+			if
+				stat.S_ISDIR(attr.st_mode) and attr.filename not in (".", "..")
+			]
+
+		with db.session_context() as sess:
+			self._upsert(sess, children)
+			sess.execute(
+					self.tbl.delete()
+						.where(self.tbl.c.parent == path)
+						.where(~self.tbl.c.path.in_([child['path'] for child in children]) if children else sa.true())
+				)
+			self._upsert(sess, [_entry(path, now, mtime=mtime)], update_mtime=True)
+		return True
+
+	def added(self, path):
+		'''
+		We've created the directory `path`.
+		'''
+		path = normalize_path(path)
+		with db.session_context() as sess:
+			self._upsert(sess, [_entry(path, datetime.datetime.now())])
+		self.touched(os.path.dirname(path))
+
+	def touched(self, path):
+		'''
+		We've changed the contents of `path`, so its listing is out of date.
+		'''
+		path = normalize_path(path)
+		with db.session_context() as sess:
+			sess.execute(self.tbl.update().where(self.tbl.c.path == path).values(mtime=None))
+
+	def removed(self, path):
+		'''
+		We've removed (or moved away) the directory `path`.
+		'''
+		path = normalize_path(path)
+		like = path.rstrip("/").replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "/%"
+		with db.session_context() as sess:
+			sess.execute(self.tbl.delete().where(sa.or_(self.tbl.c.path == path, self.tbl.c.path.like(like))))
+		self.touched(os.path.dirname(path))
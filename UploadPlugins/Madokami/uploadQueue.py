@@ -0,0 +1,406 @@
+
+# Background upload service for Madokami.
+#
+# processDownload() just records the file in the `mk_upload_queue` table
+# (see enqueue()). The UploadWorker works through that queue holding a small
+# pool of logged-in MkUploader sessions, rather than logging in (and opening
+# a DB connection) again for every file.
+#
+# Whether each file has made it up is tracked on its ReleaseFile row
+# (`mk_upload_state`), so finding the files that still need uploading (see
+# pending_uploads()) is a single indexed query.
+
+import os
+import time
+import queue
+import socket
+import uuid
+import random
+import logging
+import datetime
+import threading
+import traceback
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+import psycopg2
+
+import settings
+import runStatus
+
+import MangaCMS.db as db
+import MangaCMS.ScrapePlugins.RunBase
+import UploadPlugins.Madokami.uploader as uploader
+
+
+def set_upload_state(sess, file_path, state):
+	'''
+	Set the upload state of the ReleaseFile for `file_path` (if there is
+	one, and it's not in that state already). Uploaded files also mark the
+	manga releases they belong to.
+	'''
+	rf = db.ReleaseFile.__table__
+	dirpath, filename = os.path.split(file_path)
+
+	values = {'mk_upload_state' : state}
+	if state == 'uploaded':
+		values['mk_uploaded_at'] = datetime.datetime.now()
+
+	file_ids = [file_id for file_id, in sess.execute(
+			rf.update()
+				.where(rf.c.dirpath == dirpath)
+				.where(rf.c.filename == filename)
+				.where(rf.c.mk_upload_state.is_distinct_from(state))
+				.values(**values)
+				.returning(rf.c.id)
+		)]
+
+	if state == 'uploaded' and file_ids:
+		mr = db.MangaReleases.__table__
+		sess.execute(mr.update().where(mr.c.fileid.in_(file_ids)).values(uploaded=True))
+
+
+def pending_uploads():
+	'''
+	(series_name, file_path) for every file that's waiting to be uploaded,
+	but isn't in the upload queue (i.e. was never queued, or the queue gave
+	up on it).
+	'''
+	rf = db.ReleaseFile.__table__
+	mr = db.MangaReleases.__table__
+	tbl = db.MkUploadJob.__table__
+
+	file_path = rf.c.dirpath + "/" + rf.c.filename
+
+	series_name = sa.select([mr.c.series_name])                            \
+		.where(mr.c.fileid == rf.c.id)                                     \
+		.where(mr.c.series_name != None)                                   \
+		.limit(1)                                                          \
+		.as_scalar()
+
+	queued = sa.exists()                                                   \
+		.where(tbl.c.file_path == file_path)                               \
+		.where(tbl.c.state.in_(['queued', 'running']))
+
+	stmt = sa.select([series_name, file_path])                             \
+		.where(rf.c.mk_upload_state == 'pending')                          \
+		.where(~queued)                                                    \
+		.order_by(rf.c.id)
+
+	with db.session_context(commit=False) as sess:
+		return [(series, path) for series, path in sess.execute(stmt)]
+
+
+def requeue_missing(log=None):
+	'''
+	Put every file from pending_uploads() back in the upload queue. Files
+	that no longer exist (or have lost their series) are marked 'skipped'.
+
+	Returns the number of files queued.
+	'''
+	log = log or logging.getLogger("Main.Manga.Mk.Up.Queue")
+	missing = pending_uploads()
+	log.info("Found %s files that need to be uploaded", len(missing))
+
+	queued = 0
+	for series_name, file_path in missing:
+		if series_name and os.path.exists(file_path):
+			if enqueue(series_name, file_path):
+				queued += 1
+		else:
+			log.warning("Can't upload %s (series: %s). Skipping", file_path, series_name)
+			with db.session_context() as sess:
+				set_upload_state(sess, file_path, 'skipped')
+	return queued
+
+
+def enqueue(series_name, file_path):
+	'''
+	Queue `file_path` for upload into the directory for `series_name`.
+	A file that's already queued (or uploaded) isn't queued again, but one
+	that gave up with an error is reset and retried.
+
+	Returns False if the series is on the no-upload list.
+	'''
+	if series_name.lower() in [tmp.lower() for tmp in settings.mkSettings.get('noUpload', [])]:
+		with db.session_context() as sess:
+			set_upload_state(sess, file_path, 'skipped')
+		return False
+
+	now = datetime.datetime.now()
+	tbl = db.MkUploadJob.__table__
+	stmt = postgresql.insert(tbl)                                  \
+		.values(
+				state        = 'queued',
+				series_name  = series_name,
+				file_path    = file_path,
+				attempts     = 0,
+				next_attempt = now,
+				created_at   = now,
+			)
+	stmt = stmt.on_conflict_do_update(
+				index_elements = [tbl.c.file_path],
+				set_           = {
+						'state'        : 'queued',
+						'series_name'  : stmt.excluded.series_name,
+						'attempts'     : 0,
+						'next_attempt' : now,
+						'err_str'      : None,
+					},
+				where          = (tbl.c.state == 'error'),
+			)
+	stmt = stmt.returning(tbl.c.id)
+
+	with db.session_context() as sess:
+		if sess.execute(stmt).fetchall():
+			set_upload_state(sess, file_path, 'pending')
+		else:
+			# Already in the queue, so the file's state follows the queue's.
+			state = sess.execute(sa.select([tbl.c.state]).where(tbl.c.file_path == file_path)).scalar()
+			set_upload_state(sess, file_path, 'uploaded' if state == 'complete' else 'pending')
+	return True
+
+
+class UploaderPool(object):
+	'''
+	Up to `size` connected MkUploader instances, handed out one at a time.
+
+	Sessions are only opened when there isn't an idle one to hand out, and
+	any that have dropped their connection (or did so while in use) are
+	thrown away and replaced.
+
+	`make_uploader` is called with `connect` to open a session. Both can be
+	swapped out to run against a stand-in server (see MangaCMS.test).
+	'''
+
+	def __init__(self, size, connect=uploader.connect_sftp, make_uploader=uploader.MkUploader):
+		self.log     = logging.getLogger("Main.Manga.Mk.Up.Pool")
+		self.size    = size
+		self.connect = connect
+		self.make_uploader = make_uploader
+		self.idle    = queue.LifoQueue()
+		self.created = 0
+		self.lock    = threading.Lock()
+
+	def _discard(self, up):
+		try:
+			up.close()
+		except Exception:
+			pass
+		with self.lock:
+			self.created -= 1
+
+	def _checkout(self):
+		while True:
+			try:
+				up = self.idle.get_nowait()
+			except queue.Empty:
+				with self.lock:
+					can_create = self.created < self.size
+					if can_create:
+						self.created += 1
+				if can_create:
+					try:
+						return self.make_uploader(connect=self.connect)
+					except Exception:
+						with self.lock:
+							self.created -= 1
+						raise
+				up = self.idle.get()
+
+			if up.is_connected():
+				return up
+			self.log.info("Pooled SFTP session has disconnected. Replacing it.")
+			self._discard(up)
+
+	@contextlib.contextmanager
+	def uploader(self):
+		up = self._checkout()
+		try:
+			yield up
+		finally:
+			if up.is_connected():
+				self.idle.put(up)
+			else:
+				self._discard(up)
+
+	def close(self):
+		while True:
+			try:
+				up = self.idle.get_nowait()
+			except queue.Empty:
+				break
+			self._discard(up)
+
+
+class UploadWorker(object):
+	'''
+	Works through the upload queue, `batch_size` files at a time.
+
+	For each batch, the upload directories are looked up first, with any
+	that need creating created together in one pass. The files are then
+	uploaded in parallel, one per pooled session. Failed uploads are retried
+	after `base_delay`, doubling each attempt up to `max_delay`, and given up
+	on after `max_attempts`.
+	'''
+
+	batch_size   = 20
+	lease_time   = datetime.timedelta(hours=1)
+	max_attempts = 8
+	base_delay   = datetime.timedelta(minutes=5)
+	max_delay    = datetime.timedelta(hours=12)
+
+	def __init__(self, sessions=None, connect=uploader.connect_sftp, make_uploader=uploader.MkUploader):
+		self.log         = logging.getLogger("Main.Manga.Mk.Up.Queue")
+		self.sessions    = sessions or settings.mkSettings.get('uploadSessions', 3)
+		self.pool        = UploaderPool(self.sessions, connect, make_uploader)
+		self.lease_owner = "%s-%s-%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+	def claim(self):
+		tbl = db.MkUploadJob.__table__
+
+		candidates = sa.select([tbl.c.id])                                  \
+			.where(sa.or_(
+					sa.and_(
+						tbl.c.state == 'queued',
+						tbl.c.next_attempt <= sa.func.now(),
+					),
+					sa.and_(
+						tbl.c.state == 'running',
+						tbl.c.lease_expires < sa.func.now(),
+					)
+				))                                                          \
+			.order_by(tbl.c.next_attempt)                                   \
+			.limit(self.batch_size)                                         \
+			.with_for_update(skip_locked=True)
+
+		stmt = tbl.update()                                                 \
+			.where(tbl.c.id.in_(candidates))                                \
+			.values(
+					state         = 'running',
+					attempts      = tbl.c.attempts + 1,
+					lease_owner   = self.lease_owner,
+					lease_expires = sa.func.now() + self.lease_time,
+				)                                                           \
+			.returning(tbl.c.id, tbl.c.series_name, tbl.c.file_path, tbl.c.attempts)
+
+		with db.session_context() as sess:
+			return [dict(row) for row in sess.execute(stmt)]
+
+	def retry_delay(self, attempts):
+		delay = min(self.max_delay, self.base_delay * (2 ** max(0, attempts - 1)))
+		return delay * random.uniform(0.9, 1.1)
+
+	def _finish(self, job, remote_path=None, err_str=None, permanent=False):
+		tbl = db.MkUploadJob.__table__
+		now = datetime.datetime.now()
+
+		values = {'lease_owner' : None, 'lease_expires' : None}
+		if err_str is None:
+			values.update(state='complete', remote_path=remote_path, finished_at=now, err_str=None)
+			self.log.info("Uploaded %s -> %s", job['file_path'], remote_path)
+		elif permanent or job['attempts'] >= self.max_attempts:
+			values.update(state='error', err_str=err_str, finished_at=now)
+			self.log.error("Giving up on uploading %s after %s attempts", job['file_path'], job['attempts'])
+		else:
+			delay = self.retry_delay(job['attempts'])
+			values.update(state='queued', err_str=err_str, next_attempt=now + delay)
+			self.log.warning("Upload of %s failed (attempt %s). Retrying in %s", job['file_path'], job['attempts'], delay)
+
+		with db.session_context() as sess:
+			sess.execute(tbl.update().where(tbl.c.id == job['id']).values(**values))
+			if err_str is None:
+				set_upload_state(sess, job['file_path'], 'uploaded')
+
+	def _upload_one(self, job, ul_dir):
+		if not runStatus.run:
+			self._finish(job, err_str="Shut down before upload")
+			return
+		try:
+			with self.pool.uploader() as up:
+				remote_path = up.uploadToDirectory(job['series_name'], job['file_path'], ul_dir, attempts=1)
+			self._finish(job, remote_path=remote_path)
+
+		except (PermissionError, psycopg2.IntegrityError):
+			# Same as uploader.uploadFile(): the file's already there.
+			self._finish(job, remote_path=os.path.join(ul_dir, os.path.basename(job['file_path'])))
+
+		except Exception:
+			for line in traceback.format_exc().split("\n"):
+				self.log.error("	%s", line)
+			self._finish(job, err_str=traceback.format_exc())
+
+	def process_batch(self, jobs):
+		ready = []
+
+		with self.pool.uploader() as up:
+			for job in jobs:
+				if not os.path.exists(job['file_path']):
+					self._finish(job, err_str="File no longer exists", permanent=True)
+					with db.session_context() as sess:
+						set_upload_state(sess, job['file_path'], 'skipped')
+					continue
+				try:
+					ready.append((job, up.resolveUploadDirectory(job['series_name'], job['file_path'], create=False)))
+				except Exception:
+					self.log.error("Failed to find upload directory for %s", job['file_path'])
+					for line in traceback.format_exc().split("\n"):
+						self.log.error("	%s", line)
+					self._finish(job, err_str=traceback.format_exc())
+
+			if up.pending_dirs:
+				self.log.info("Creating %s upload directories", len(up.pending_dirs))
+			up.create_pending_dirs()
+
+		with ThreadPoolExecutor(max_workers=self.sessions) as executor:
+			list(executor.map(lambda tmp: self._upload_one(*tmp), ready))
+
+	def run(self, forever=False, poll_interval=30):
+		'''
+		Upload queued files until the queue is empty (or, with `forever`, until
+		we're told to stop). Returns the number of files processed.
+		'''
+		processed = 0
+		try:
+			while runStatus.run:
+				jobs = self.claim()
+				if jobs:
+					self.log.info("Claimed %s queued uploads", len(jobs))
+					self.process_batch(jobs)
+					processed += len(jobs)
+					continue
+
+				if not forever:
+					break
+				for dummy_x in range(poll_interval):
+					if not runStatus.run:
+						break
+					time.sleep(1)
+		finally:
+			self.pool.close()
+
+		self.log.info("Upload worker processed %s files", processed)
+		return processed
+
+
+class Runner(MangaCMS.ScrapePlugins.RunBase.ScraperBase):
+	loggerPath = "Main.Manga.Mk.Up.Run"
+
+	pluginName = "MkUploadQueue"
+
+	# Not a scraper, so there's nothing to load feeds or content with.
+	feedLoader    = None
+	contentLoader = None
+
+	def _go(self):
+		UploadWorker().run()
+
+
+if __name__ == "__main__":
+	import utilities.testBase as tb
+
+	with tb.testSetup():
+		UploadWorker().run(forever=True)
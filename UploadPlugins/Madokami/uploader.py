@@ -30,11 +30,23 @@ import MangaCMSOld.ScrapePlugins.MangaScraperDbBase
 import stat
 
 import UploadPlugins.Madokami.notifier
+import UploadPlugins.Madokami.remoteIndex as remoteIndex
 
 class CanonMismatch(Exception):
 	pass
 
 
+# Remote directories that never count as a series' directory.
+BADWORDS = [
+	'Non-English',
+	'Oneshots',
+	'Raws',
+	'Novels',
+	'_Doujinshi',
+	'AutoUploaded from Assorted Sources',
+]
+
+
 
 def splitall(path):
 	allparts = []
@@ -51,6 +63,33 @@ def splitall(path):
 			allparts.insert(0, parts[1])
 	return allparts
 
+def connect_sftp(log=None):
+	'''
+	Open an authenticated SFTP session to the Madokami server.
+	Returns a (ssh_client, sftp_client) tuple.
+	'''
+	log = log or logging.getLogger("Main.Manga.Mk.Up.Base")
+
+	host = settings.mkSettings["ftpAddr"]
+	port = settings.mkSettings["sftpPort"]
+
+	user   = settings.mkSettings["ftpUser"]
+	passwd = settings.mkSettings["ftpPass"]
+
+	log.info("Connecting to remote host: %s:%s", host, port)
+	# t = paramiko.Transport()
+	# t.settimeout(60)
+	# t.connect(None, user, passwd)
+	# self.sftp = paramiko.SFTPClient.from_transport(t)
+
+	ssh = paramiko.SSHClient()
+	ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+	ssh.connect(hostname=host, port=port, username=user, password=passwd, timeout=60)
+	sftp = ssh.open_sftp()
+
+	log.info("SFTP connected.")
+	return ssh, sftp
+
 class MkUploader(MangaCMSOld.ScrapePlugins.MangaScraperDbBase.MangaScraperDbBase):
 	# log = logging.getLogger("Main.Mk.Uploader")
 
@@ -65,40 +104,46 @@ class MkUploader(MangaCMSOld.ScrapePlugins.MangaScraperDbBase.MangaScraperDbBase
 	tableName = "MangaItems"
 
 
-	def __init__(self):
+	# `connect` opens the SFTP session (see connect_sftp()). It's a parameter
+	# so the upload queue can point uploaders at a stand-in server.
+	def __init__(self, connect=connect_sftp):
 
 		super().__init__()
 
 		self.wg = WebRequest.WebGetRobust(logPath=self.loggerPath+".Web")
 
 		self.log.info("Initializing SFTP connection")
+		self.ssh, self.sftp = connect(log=self.log)
 
-
-		host = settings.mkSettings["ftpAddr"]
-		port = settings.mkSettings["sftpPort"]
-
-		user   = settings.mkSettings["ftpUser"]
-		passwd = settings.mkSettings["ftpPass"]
-
-		self.log.info("Connecting to remote host: %s:%s", host, port)
-		# t = paramiko.Transport()
-		# t.settimeout(60)
-		# t.connect(None, user, passwd)
-		# self.sftp = paramiko.SFTPClient.from_transport(t)
-
-		self.ssh = paramiko.SSHClient()
-		self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-		self.ssh.connect(hostname=host, port=port, username=user, password=passwd, timeout=60)
-		self.sftp = self.ssh.open_sftp()
-
-		self.log.info("SFTP connected.")
+		self.remote_index = remoteIndex.RemoteDirIndex(
+				fetch_tree = lambda: self.wg.getpage(remoteIndex.FAKEDIRS_URL),
+				log        = self.log,
+			)
 
 		self.log.info("Init finished.")
 		self.mainDirs     = {}
 		self.unsortedDirs = {}
 
+		# Directories getUploadDirectory() decided it needs, when called with
+		# create=False. See create_pending_dirs().
+		self.pending_dirs = set()
+
 	def __del__(self):
-		self.sftp.close()
+		self.close()
+
+	def close(self):
+		if self.sftp:
+			self.sftp.close()
+			self.sftp = None
+		if self.ssh:
+			self.ssh.close()
+			self.ssh = None
+
+	def is_connected(self):
+		if not self.sftp:
+			return False
+		transport = self.sftp.get_channel().get_transport()
+		return bool(transport and transport.is_active())
 
 	def go(self):
 		pass
@@ -169,47 +214,30 @@ class MkUploader(MangaCMSOld.ScrapePlugins.MangaScraperDbBase.MangaScraperDbBase
 			except:
 				pass
 			self.sftp.rename(src, "/Admin cleanup/autoclean dirs/garbage dir %s" % src.replace("/", ";").replace(" ", "_"))
+			self.remote_index.removed(src)
+			self.remote_index.touched(dst)
 
 		return dst
 
 	def loadRemoteDirectory(self, fullPath, aggregate=False):
 		ret = {}
-		dirs = self.wg.getpage("https://manga.madokami.al/stupidapi/fakedirs")
-
-		requirePrefix = splitall(fullPath)
-
-		badwords = [
-			'Non-English',
-			'Oneshots',
-			'Raws',
-			'Novels',
-			'_Doujinshi',
-			'AutoUploaded from Assorted Sources',
-		]
-
-		rows = [tmp for tmp in
-					[splitall(item) for item in
-						[item[1:] if item.startswith("./") else item for item in dirs.split("\n")]
-					]
-				if
-					(
-							len(tmp) >= len(requirePrefix)
-						and
-							all([tmp[x] == requirePrefix[x] for x in range(len(requirePrefix))])
-						and
-							not any([badword in tmp for badword in badwords]))
-				]
+
+		# Comes from the local index of the remote tree, which is only reloaded
+		# if it's stale. The organizer is about to rearrange things, so it
+		# always gets a fresh copy.
+		self.remote_index.refresh(force=aggregate)
+
+		rows = [(splitall(path), name, canonName, matchingName) for path, name, canonName, matchingName
+					in self.remote_index.entries_under(fullPath)]
+		rows = [tmp for tmp in rows if not any([badword in tmp[0] for badword in BADWORDS])]
 
 
 		print(len(rows))
-		for line in rows:
+		for line, dirName, canonName, matchingName in rows:
 			if len(line) == 6:
 
-				dirName = line[-1]
 				if not dirName:
 					continue
-				canonName = nt.getCanonicalMangaUpdatesName(dirName)
-				matchingName = nt.prepFilenameForMatching(canonName)
 
 				# prepFilenameForMatching can result in empty directory names in some cases.
 				# Detect that, and don't bother with it if that happened.
@@ -329,39 +357,66 @@ class MkUploader(MangaCMSOld.ScrapePlugins.MangaScraperDbBase.MangaScraperDbBase
 		dirInfo = ret['data'].pop()
 		return dirInfo['path']
 
-	def getUploadDirectory(self, seriesName):
-
-		ulDir = self.getExistingDir(seriesName)
-
-		if not ulDir:
-			seriesName   = nt.getCanonicalMangaUpdatesName(seriesName)
-			safeFilename = nt.makeFilenameSafe(seriesName)
-			matchName    = nt.prepFilenameForMatching(seriesName)
-			matchName    = matchName.encode('utf-8', 'ignore').decode('utf-8')
-
-			self.checkInitDirs()
-			if matchName in self.mainDirs:
-				ulDir = self.mainDirs[matchName][0]
-			elif seriesName in self.mainDirs:
-				ulDir = self.mainDirs[seriesName][0]
+	def _make_upload_dir(self, ulDir, create):
+		if not create:
+			self.pending_dirs.add(ulDir)
+			return
+		try:
+			self.sftp.mkdir(ulDir)
+			self.remote_index.added(ulDir)
+		except OSError as e:
+			# If the error is just a "directory exists" warning, ignore it silently
+			if str(e) == 'OSError: File already exists':
+				self.remote_index.added(ulDir)
 			else:
+				self.log.warn("Error creating directory?")
+				self.log.warn(traceback.format_exc())
+
+	def create_pending_dirs(self):
+		'''
+		Create every directory queued up by getUploadDirectory(create=False)
+		calls, each once, and parents before their children.
+		'''
+		for ulDir in sorted(self.pending_dirs, key=lambda tmp: (tmp.count("/"), tmp)):
+			self.log.info("Creating container directory %s", ulDir)
+			self._make_upload_dir(ulDir, create=True)
+		self.pending_dirs = set()
+
+	# If `create` is false, a missing directory isn't created right away, but
+	# queued for create_pending_dirs(), so a batch of uploads can share the work.
+	def getUploadDirectory(self, seriesName, create=True):
+
+		canonName    = nt.getCanonicalMangaUpdatesName(seriesName)
+		safeFilename = nt.makeFilenameSafe(canonName)
+		matchName    = nt.prepFilenameForMatching(canonName)
+		matchName    = matchName.encode('utf-8', 'ignore').decode('utf-8')
+
+		# Local index of the remote tree first.
+		self.remote_index.refresh()
+		have = [tmp for tmp in self.remote_index.find(matchName, settings.mkSettings["mainContainerDir"], depth=5)
+					if not any([badword in splitall(tmp) for badword in BADWORDS])]
+		if have:
+			return have[0]
 
-				self.log.info("Need to create container directory for %s", seriesName)
-				ulDir = os.path.join(settings.mkSettings["uploadContainerDir"], settings.mkSettings["uploadDir"], safeFilename)
-				try:
-					self.sftp.mkdir(ulDir)
-				except OSError as e:
-					# If the error is just a "directory exists" warning, ignore it silently
-					if str(e) == 'OSError: File already exists':
-						pass
-					else:
-						self.log.warn("Error creating directory?")
-						self.log.warn(traceback.format_exc())
+		ulDir = self.getExistingDir(seriesName)
+		if ulDir:
+			return ulDir
+
+		# On a miss, just look at the autoupload directory (and only if it's
+		# changed since we last looked), rather than the whole tree.
+		uploadBase = os.path.join(settings.mkSettings["uploadContainerDir"], settings.mkSettings["uploadDir"])
+		self.remote_index.list_dir(self.sftp, uploadBase)
+		have = self.remote_index.find(matchName, uploadBase)
+		if have:
+			return have[0]
 
+		self.log.info("Need to create container directory for %s", canonName)
+		ulDir = os.path.join(uploadBase, safeFilename)
+		self._make_upload_dir(ulDir, create)
 
 		return ulDir
 
-	def getDoujinshiUploadDirectory(self, seriesName):
+	def getDoujinshiUploadDirectory(self, seriesName, create=True):
 		ulDir = self.getExistingDir(seriesName)
 
 		if not ulDir:
@@ -379,26 +434,39 @@ class MkUploader(MangaCMSOld.ScrapePlugins.MangaScraperDbBase.MangaScraperDbBase
 
 				self.log.info("Need to create container directory for %s", seriesName)
 				ulDir = os.path.join(settings.mkSettings["uploadContainerDir"], settings.mkSettings["uploadDir"], safeFilename)
-				try:
-					self.sftp.mkdir(ulDir)
-				except ftplib.error_perm:
-					self.log.warn("Directory exists?")
-					self.log.warn(traceback.format_exc())
+				if create:
+					try:
+						self.sftp.mkdir(ulDir)
+						self.remote_index.added(ulDir)
+					except ftplib.error_perm:
+						self.log.warn("Directory exists?")
+						self.log.warn(traceback.format_exc())
+				else:
+					self.pending_dirs.add(ulDir)
 
 
 		return ulDir
 
-	def uploadFileInternal(self, seriesName, filePath, db_commit=True):
+	def resolveUploadDirectory(self, seriesName, filePath, create=True):
 
 		if '(Doujinshi)' in filePath or 'Doujin}' in filePath:
 			self.checkInitDoujinDirs()
-			ulDir = self.getDoujinshiUploadDirectory(seriesName)
+			ulDir = self.getDoujinshiUploadDirectory(seriesName, create=create)
 		else:
-			ulDir = self.getUploadDirectory(seriesName)
+			ulDir = self.getUploadDirectory(seriesName, create=create)
 
 		while not isinstance(ulDir, str):
 			ulDir = ulDir[0]
 
+		return ulDir
+
+	def uploadFileInternal(self, seriesName, filePath, db_commit=True):
+		ulDir = self.resolveUploadDirectory(seriesName, filePath)
+		return self.uploadToDirectory(seriesName, filePath, ulDir, db_commit=db_commit)
+
+	# `attempts` is how many times to try the put before giving up. The upload
+	# queue retries (with backoff) itself, so it only makes one.
+	def uploadToDirectory(self, seriesName, filePath, ulDir, db_commit=True, attempts=50):
 
 		dummy_path, filename = os.path.split(filePath)
 
@@ -416,7 +484,7 @@ class MkUploader(MangaCMSOld.ScrapePlugins.MangaScraperDbBase.MangaScraperDbBase
 		self.log.info("From series %s", seriesName)
 		self.log.info("To container directory %s (%s)", ulDir, fqUploadPath)
 		self.sftp.chdir(ulDir)
-		for x in range(50):
+		for x in range(attempts):
 			try:
 				self.sftp.put(filePath, fqUploadPath)
 				break
@@ -427,12 +495,13 @@ class MkUploader(MangaCMSOld.ScrapePlugins.MangaScraperDbBase.MangaScraperDbBase
 				self.log.error("Failure uploading file!")
 				for line in traceback.format_exc().split("\n"):
 					self.log.error("	%s", line)
-				if x > 5:
+				if x > 5 or x + 1 >= attempts:
 					raise e
 		# command = "STOR %s" % filename
 		# assert self.ftp.encoding.lower() == "UTF-8".lower()
 		# self.ftp.storbinary(command, open(filePath, "rb"))
 		self.log.info("File Uploaded")
+		self.remote_index.touched(ulDir)
 
 
 		dummy_fPath, fName = os.path.split(filePath)
@@ -452,78 +521,15 @@ class MkUploader(MangaCMSOld.ScrapePlugins.MangaScraperDbBase.MangaScraperDbBase
 								tags        = "uploaded",
 								commit = True)
 
-	def get_recent_ul_failure(self):
+		return fqUploadPath
 
-		thresh_time = time.time() - 60*60*24*7
-
-		with self.transaction() as cur:
-			cur.execute("""SELECT
-								seriesName,
-								fileName,
-								downloadPath,
-								flags,
-								tags
-							FROM
-								MangaItems
-							WHERE
-									retreivalTime > %s
-								AND
-									dlState = 2
-								AND
-									sourceSite != 'mk'
-									;
-								""",
-								(thresh_time, ))
-
-			downloaded = cur.fetchall()
-
-			cur.execute("""SELECT
-								originName,
-								sourceUrl
-							FROM
-								MangaItems
-							WHERE
-								dlState = 3
-							;
-								""")
-
-			uploaded = cur.fetchall()
-
-		have1 = set([tmp[0] for tmp in uploaded])
-		have = set([
-				urllib.parse.unquote(tmp[1].split("/")[-1])
-			for
-				tmp
-			in
-				uploaded])
-
-		for tmp in uploaded:
-			have.add(tmp[1].split("/")[-1])
-			have.add(tmp[0].split("/")[-1])
-
-
-		self.log.info("Have items: %s", len(have))
-
-		# print(downloaded)
-
-		# print(have)
-		# for name in have:
-		# 	print(name)
-
-		files = []
-		for seriesName, fileName, downloadPath, flags, tags in downloaded:
-			# print(fileName, fileName in have)
-			fqpath = os.path.join(downloadPath, fileName)
-			# print("Filename:", fileName)
-			if fileName in have or urllib.parse.quote(fileName) in have:
-				pass
-				# print("Have:", fileName)
-			if os.path.exists(fqpath):
-				files.append((seriesName, fqpath))
+	# The files still waiting for an upload are tracked on their ReleaseFile
+	# rows (see uploadQueue.pending_uploads()).
+	def get_recent_ul_failure(self):
+		import UploadPlugins.Madokami.uploadQueue as uploadQueue
+		files = [(seriesName, fqpath) for seriesName, fqpath in uploadQueue.pending_uploads() if os.path.exists(fqpath)]
 		self.log.info("Found %s files that need to be uploaded", len(files))
 		return files
-		# print(have)
-		# print(uploaded)
 
 
 	def ul_missing(self):
@@ -543,9 +549,10 @@ def do_remote_organize():
 
 
 def do_missing_ul():
-	uploader = MkUploader()
-	uploader.loadRemoteDirectory("/")
-	uploader.ul_missing()
+	# uploadQueue imports this module, so it can't be imported at the top.
+	import UploadPlugins.Madokami.uploadQueue as uploadQueue
+	uploadQueue.requeue_missing()
+	uploadQueue.UploadWorker().run()
 
 
 def uploadFile(seriesName, filePath):
@@ -2,19 +2,22 @@
 
 import os.path
 import logging
-import rpyc
 import settings
 
+import deduplicator.connectionPool
+
 
 PHASH_DISTANCE_THRESHOLD = 4
 
 
 class ArchChecker(object):
 
-	def __init__(self, archPath, phashDistance=PHASH_DISTANCE_THRESHOLD, pathPositiveFilter=None, negativeKeywords=None, lock=True):
+	def __init__(self, archPath, phashDistance=PHASH_DISTANCE_THRESHOLD, pathPositiveFilter=None, negativeKeywords=None, lock=True, pool=None):
 		self.log = logging.getLogger("Main.Deduper")
 
-		self.remote = rpyc.connect("localhost", 12345)
+		# Connections to the dedup server are shared by every ArchChecker in
+		# the process.
+		self.pool = pool or deduplicator.connectionPool.get_pool()
 
 		# pathPositiveFilter filters
 		# Basically, if you pass a list of valid path prefixes, any matches not
@@ -29,9 +32,12 @@ class ArchChecker(object):
 
 		self.arch = archPath
 
-	def process(self, moveToPath=None):
+	# `phashDistance` overrides the distance the checker was created with.
+	def process(self, moveToPath=None, phashDistance=None):
+		if phashDistance is not None:
+			self.pdist = phashDistance
 		self.log.info("Processing download '%s'", self.arch)
-		status, bestMatch, intersections = self.remote.root.processDownload(self.arch, pathPositiveFilter=self.maskedPaths, negativeKeywords=self.negativeKeywords, distance=self.pdist, moveToPath=moveToPath)
+		status, bestMatch, intersections = self.pool.call('processDownload', self.arch, pathPositiveFilter=self.maskedPaths, negativeKeywords=self.negativeKeywords, distance=self.pdist, moveToPath=moveToPath)
 		self.log.info("Processed archive. Return status '%s'", status)
 		if bestMatch:
 			self.log.info("Matching archive '%s'", bestMatch)
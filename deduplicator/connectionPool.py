@@ -0,0 +1,190 @@
+
+import os
+import time
+import queue
+import socket
+import logging
+import threading
+import contextlib
+
+import rpyc
+import rpyc.core.netref
+import rpyc.utils.classic
+import settings
+
+
+class DedupServerUnavailable(Exception):
+	pass
+
+
+# Errors that mean the connection itself is gone (as opposed to the remote
+# call raising), so it shouldn't go back in the pool.
+CONNECTION_ERRORS = (EOFError, ConnectionError, socket.error, socket.timeout)
+
+
+def obtain(value):
+	'''
+	Copy `value` out of the connection it came from, so it's still usable
+	once the connection has gone back to the pool (and on to another
+	caller). Tuples come back from rpyc by value, but their contents (and
+	dicts and lists generally) may be netrefs.
+	'''
+	if isinstance(value, tuple):
+		return tuple(obtain(item) for item in value)
+	if not isinstance(value, rpyc.core.netref.BaseNetref):
+		return value
+	try:
+		return rpyc.utils.classic.obtain(value)
+	except Exception:
+		# The server doesn't allow pickling. Copy the common containers by hand.
+		if hasattr(value, "items"):
+			return {obtain(key) : obtain(val) for key, val in value.items()}
+		return [obtain(item) for item in value]
+
+
+class PooledConnection(object):
+	def __init__(self, conn):
+		self.conn      = conn
+		self.last_used = time.time()
+
+	@property
+	def root(self):
+		return self.conn.root
+
+	def close(self):
+		try:
+			self.conn.close()
+		except Exception:
+			pass
+
+
+class DedupConnectionPool(object):
+	'''
+	Pool of rpyc connections to the deduplication server.
+
+	At most `size` connections are open (and so at most `size` calls are
+	running against the server) at once. Callers beyond that wait up to
+	`acquire_timeout` seconds for one to come free.
+
+	Idle connections are reused, most recently used first. One that's been
+	idle longer than `health_check_interval` is pinged before it's handed
+	out, and replaced if that fails. A connection that drops (or is
+	interrupted) while in use is thrown away rather than returned to the
+	pool.
+	'''
+
+	acquire_timeout       = 60 * 30
+	health_check_interval = 60
+	ping_timeout          = 10
+
+	def __init__(self, host="localhost", port=12345, size=4, config=None):
+		self.log    = logging.getLogger("Main.Deduper.Pool")
+		self.host   = host
+		self.port   = port
+		self.size   = size
+		# Dedup calls on big archives can take a long while, so don't time them out.
+		self.config = config or {'sync_request_timeout' : None}
+
+		self.slots  = threading.BoundedSemaphore(size)
+		self.idle   = queue.LifoQueue()
+
+	def _connect(self):
+		try:
+			conn = rpyc.connect(self.host, self.port, config=self.config, keepalive=True)
+		except CONNECTION_ERRORS as e:
+			raise DedupServerUnavailable("Could not connect to the dedup server at %s:%s (%s)" % (self.host, self.port, e))
+		self.log.info("Opened connection to dedup server at %s:%s", self.host, self.port)
+		return PooledConnection(conn)
+
+	def _healthy(self, pconn):
+		if pconn.conn.closed:
+			return False
+		if time.time() - pconn.last_used < self.health_check_interval:
+			return True
+		try:
+			pconn.conn.ping(timeout=self.ping_timeout)
+			return True
+		except Exception:
+			return False
+
+	def _checkout(self):
+		while True:
+			try:
+				pconn = self.idle.get_nowait()
+			except queue.Empty:
+				return self._connect()
+
+			if self._healthy(pconn):
+				return pconn
+			self.log.info("Pooled dedup server connection is dead. Reconnecting.")
+			pconn.close()
+
+	@contextlib.contextmanager
+	def connection(self):
+		'''
+		A connection to the dedup server (its `root` is the remote service),
+		for the duration of the with block.
+		'''
+		if not self.slots.acquire(timeout=self.acquire_timeout):
+			raise DedupServerUnavailable("Timed out waiting for a dedup server connection")
+		try:
+			pconn = self._checkout()
+			reuse = False
+			try:
+				yield pconn
+				reuse = True
+			except CONNECTION_ERRORS:
+				raise
+			except Exception:
+				# The remote call raised. The connection itself is fine.
+				reuse = True
+				raise
+			finally:
+				# Anything else (a dropped connection, or being interrupted with a
+				# reply still on its way) means the connection can't be reused.
+				if reuse and not pconn.conn.closed:
+					pconn.last_used = time.time()
+					self.idle.put(pconn)
+				else:
+					pconn.close()
+		finally:
+			self.slots.release()
+
+	def call(self, method, *args, **kwargs):
+		'''
+		Call `method` on the remote service, on a pooled connection.
+
+		Calls aren't retried if the connection drops partway through, since
+		most of them (processDownload, for one) move or delete files. The
+		result is copied out (see obtain()) before the connection is released.
+		'''
+		with self.connection() as conn:
+			return obtain(getattr(conn.root, method)(*args, **kwargs))
+
+	def close(self):
+		while True:
+			try:
+				pconn = self.idle.get_nowait()
+			except queue.Empty:
+				break
+			pconn.close()
+
+
+_POOL      = None
+_POOL_PID  = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool():
+	'''
+	Process-wide DedupConnectionPool for the server in `settings.dedupServer`.
+
+	A forked child (e.g. a post-processing worker) gets a pool of its own,
+	rather than sharing its parent's sockets.
+	'''
+	global _POOL, _POOL_PID
+	with _POOL_LOCK:
+		if _POOL is None or _POOL_PID != os.getpid():
+			host, port = getattr(settings, "dedupServer", ("localhost", 12345))
+			_POOL = DedupConnectionPool(host, port, size=getattr(settings, "dedupConnections", 4))
+			_POOL_PID = os.getpid()
+		return _POOL
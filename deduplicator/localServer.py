@@ -0,0 +1,170 @@
+
+# Stand-in for the IntraArchiveDeduplicator rpyc server, so the dedup path
+# (ArchChecker and the connection pool) can be run, tested and benchmarked
+# without the real phash service.
+#
+# It only finds exact duplicates: an archive is a duplicate if every file in
+# it is also in one other archive it's seen. Phash distances are accepted but
+# ignored. Duplicates are deleted (or moved to `moveToPath`) just like the
+# real server does.
+#
+# Usage:
+#	python3 -m deduplicator.localServer [--port 12345] [--delay 0.5] [dir ...]
+
+import os
+import time
+import shutil
+import hashlib
+import zipfile
+import logging
+import argparse
+import threading
+
+import rpyc
+from rpyc.utils.server import ThreadedServer
+
+
+def hash_archive(path):
+	'''
+	md5 of each of the files in the archive at `path`, or of the file itself
+	if it isn't a zip.
+	'''
+	if not zipfile.is_zipfile(path):
+		with open(path, "rb") as fp:
+			return frozenset([hashlib.md5(fp.read()).hexdigest()])
+
+	ret = set()
+	with zipfile.ZipFile(path) as zfp:
+		for info in zfp.infolist():
+			if info.filename.endswith("/"):
+				continue
+			ret.add(hashlib.md5(zfp.read(info)).hexdigest())
+	return frozenset(ret)
+
+
+class DedupIndex(object):
+	'''
+	In-memory index of the files in every archive the server has seen.
+	'''
+
+	def __init__(self, scan_dirs=None):
+		self.log       = logging.getLogger("Main.Deduper.Local")
+		self.lock      = threading.Lock()
+		self.scan_dirs = scan_dirs or []
+		self.archives  = {}
+		self.by_hash   = {}
+		self.reload()
+
+	def _add(self, path, hashes):
+		# Must be called with the lock held.
+		self.archives[path] = hashes
+		for fhash in hashes:
+			self.by_hash.setdefault(fhash, set()).add(path)
+
+	def _remove(self, path):
+		# Must be called with the lock held.
+		for fhash in self.archives.pop(path, []):
+			self.by_hash[fhash].discard(path)
+
+	def reload(self):
+		with self.lock:
+			self.archives = {}
+			self.by_hash  = {}
+			for scan_dir in self.scan_dirs:
+				for root, dummy_dirs, files in os.walk(scan_dir):
+					for fname in files:
+						fpath = os.path.join(root, fname)
+						try:
+							self._add(fpath, hash_archive(fpath))
+						except (OSError, zipfile.BadZipFile):
+							self.log.warning("Could not read '%s'", fpath)
+			self.log.info("Indexed %s archives", len(self.archives))
+
+	def process(self, archPath, pathPositiveFilter=None, negativeKeywords=None, moveToPath=None):
+		hashes = hash_archive(archPath)
+		prefixes = list(pathPositiveFilter or [''])
+		negativeKeywords = list(negativeKeywords or [])
+
+		with self.lock:
+			self._remove(archPath)
+
+			intersections = {}
+			for fhash in hashes:
+				for other in self.by_hash.get(fhash, []):
+					intersections[other] = intersections.get(other, 0) + 1
+
+			intersections = {
+					other : count
+				for
+					other, count in intersections.items()
+				if
+						any([other.startswith(prefix) for prefix in prefixes])
+					and
+						not any([keyword in other for keyword in negativeKeywords])
+					and
+						os.path.exists(other)
+				}
+
+			bestMatch = None
+			if intersections:
+				bestMatch = max(intersections, key=lambda other: (intersections[other], other))
+
+			if hashes and bestMatch and intersections[bestMatch] == len(hashes):
+				if moveToPath:
+					shutil.move(archPath, os.path.join(moveToPath, os.path.basename(archPath)))
+				else:
+					os.unlink(archPath)
+				self.log.info("'%s' is a duplicate of '%s'. Removed.", archPath, bestMatch)
+				return "deleted was-duplicate", bestMatch, intersections
+
+			self._add(archPath, hashes)
+			return "", bestMatch, intersections
+
+
+class LocalDedupService(rpyc.Service):
+	'''
+	The subset of the real dedup server's interface used by ArchChecker and
+	RemoteInt. `index` and `delay` are shared by every connection.
+	'''
+
+	index = None
+
+	# Seconds each processDownload call sleeps for, to approximate the real
+	# server's phash search when benchmarking.
+	delay = 0
+
+	def exposed_processDownload(self, archPath, pathPositiveFilter=None, negativeKeywords=None, distance=None, moveToPath=None):
+		if self.delay:
+			time.sleep(self.delay)
+		return self.index.process(archPath, pathPositiveFilter=pathPositiveFilter, negativeKeywords=negativeKeywords, moveToPath=moveToPath)
+
+	def exposed_reloadTree(self):
+		self.index.reload()
+
+
+def make_server(port=12345, scan_dirs=None, delay=0, hostname="localhost"):
+	'''
+	Set up (but don't start) a server. Port 0 picks a free port, which is
+	then in `server.port`.
+	'''
+	LocalDedupService.index = DedupIndex(scan_dirs)
+	LocalDedupService.delay = delay
+
+	# Pickling lets clients copy results (the intersections dict) out by value.
+	return ThreadedServer(LocalDedupService, hostname=hostname, port=port, protocol_config={'allow_pickle' : True})
+
+def serve(port=12345, scan_dirs=None, delay=0, hostname="localhost"):
+	make_server(port=port, scan_dirs=scan_dirs, delay=delay, hostname=hostname).start()
+
+
+if __name__ == "__main__":
+	logging.basicConfig(level=logging.INFO)
+
+	parser = argparse.ArgumentParser(description="Stand-in for the archive deduplication server.")
+	parser.add_argument("--host",  default="localhost")
+	parser.add_argument("--port",  default=12345, type=int)
+	parser.add_argument("--delay", default=0, type=float, help="Seconds to sleep in each processDownload call.")
+	parser.add_argument("dirs",    nargs="*", help="Directories of archives to index at startup.")
+	args = parser.parse_args()
+
+	serve(port=args.port, scan_dirs=args.dirs, delay=args.delay, hostname=args.host)
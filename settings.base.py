@@ -57,7 +57,12 @@ bookCachePath    = '/SOMETHING/MangaCMS/BookCache'
 # You must have https://github.com/fake-name/IntraArchiveDeduplicator somewhere,
 # and have allowed it to build a database of the extant local files for it to
 # be of any use.
-# TODO: Allow remote deduper addresses (right now, localhost is assumed).
+# dedupServer is the (host, port) the deduplication server listens on, and
+# dedupConnections the most connections (and so concurrent dedup calls) each
+# process will open to it. deduplicator/localServer.py is a stand-in server
+# that only finds exact duplicates, for testing without the real one.
+dedupServer      = ("localhost", 12345)
+dedupConnections = 4
 
 # Folders to scan for folders to use as download paths.
 # Directories are scanned by sorted keys
@@ -127,6 +132,10 @@ skipTags = [
 	'tags to not download'
 ]
 
+# ...unless they also have a tag containing one of these.
+tags_keep = [
+]
+
 tagNegativeHighlight = [
 ]
 
@@ -193,6 +202,39 @@ badImageDir  = r"/somepath/dir"
 # When files are "deleted" through the web UI, they're moved here.
 recycleBin = r'/media/Storage/MangaRecycleBin'
 
+# When a freshly downloaded file has the same md5 as an existing file, the two
+# files are normally compared byte-for-byte before the new one is discarded.
+# If this is True, and both files have a known size and sha256, matching
+# size + sha256 is considered sufficient and the comparison is skipped.
+trustFileDigests = False
+
+# On-disk cache of fetched pages. If a chapter fails part way through, the pages
+# that were already fetched are reused on the retry. Set pageCacheDir to a
+# directory to enable it. Size is in bytes, TTL in seconds.
+pageCacheDir      = None
+pageCacheMaxBytes = 2 * 1024 * 1024 * 1024
+pageCacheTtl      = 60*60*24*7
+
+# ETag/Last-Modified/body hash per feed page, so scheduled feed runs can skip
+# pages that haven't changed. Set httpCacheDir to a directory to enable it.
+httpCacheDir      = None
+
+# Limit on the bytes of fetched content (pages, archives) held in memory at once,
+# per scheduler process. fetchHostMemoryBudget optionally applies a limit across
+# every process on the host as well, counted in the shared memory file
+# fetchHostMemoryBudgetFile. Fetch workers wait when the budget is used up.
+# None (the default) disables either limit. Set e.g. 512 * 1024 * 1024 to enable it.
+fetchMemoryBudget         = None
+fetchHostMemoryBudget     = None
+fetchHostMemoryBudgetFile = "/dev/shm/mangacms-fetch-budget"
+
+# Hand downloaded archives off to a queue (the post_process_jobs table) for
+# cleaning, dedup and upload, rather than doing it on the fetch threads. The
+# PostProcessQueue plugin works through the queue with postProcessWorkers
+# worker processes.
+postProcessQueue   = False
+postProcessWorkers = 4
+
 
 batotoSettings = {
 
@@ -226,6 +268,9 @@ mkSettings = {
 	# "uploadContainerDir"  : "/Manga/_Autouploads",
 	# "uploadDir"           : "Name this directory"
 
+	# Number of SFTP sessions the background upload worker keeps open.
+	# "uploadSessions"      : 3,
+
 }
 
 tadanohito = {
@@ -129,8 +129,8 @@ help_strings = [
 	"		using the name synonym system.",
 	"",
 	"	madokami_upload",
-	"		Look through the last week of downloads, and try to upload any.",
-	"		which appear to not have been uploaded..",
+	"		Find any downloads that are waiting to be uploaded, but aren't",
+	"		in the upload queue, and queue and upload them.",
 	"",
 	"	rescan_failed_h",
 	"		Rescan all H items that failed on previous phash processing.",